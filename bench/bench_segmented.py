@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Segmented-download benchmark.
+
+Serves a generated file from bench/range_server.py with a per-connection
+rate limit, downloads it with kexis_segmented.SegmentedFile at several
+connection counts and reports throughput and speed-up as JSON. Every
+download is checked byte-for-byte against the source.
+
+    python bench/bench_segmented.py [--size 64M] [--rate 4M] [--connections 1 2 4 8]
+
+Needs yt_dlp installed (kexis_segmented imports it).
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from kexis_segmented import SegmentedFile, probe_size  # noqa: E402
+from range_server import parse_rate, serve, write_random  # noqa: E402
+
+
+def urllib_opener(url, headers):
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30)
+
+
+def file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", type=parse_rate, default=parse_rate("64M"),
+                        help="test file size (default: 64M)")
+    parser.add_argument("--rate", type=parse_rate, default=parse_rate("4M"),
+                        help="per-connection server limit (default: 4M/s)")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="kexis-bench-") as tmp:
+        folder = Path(tmp)
+        source = folder / "stream.bin"
+        write_random(source, args.size)
+        expected = file_digest(source)
+
+        server = serve(folder, rate=args.rate, latency=args.latency)
+        url = f"http://127.0.0.1:{server.server_port}/stream.bin"
+        size = probe_size(url, {}, urllib_opener)
+
+        results = []
+        failures = []
+        for connections in args.connections:
+            target = folder / f"out-{connections}.part"
+            download = SegmentedFile(
+                url, str(target), size, connections=connections, opener=urllib_opener,
+                resume=False,
+            )
+            start = time.perf_counter()
+            download.run()
+            elapsed = time.perf_counter() - start
+            ok = file_digest(target) == expected
+            if not ok:
+                failures.append(f"{connections} connection(s): checksum mismatch")
+            results.append({
+                "connections": connections,
+                "segments": len(download.segments),
+                "seconds": round(elapsed, 3),
+                "bytes_per_s": round(size / elapsed),
+                "verified": ok,
+            })
+            target.unlink()
+        server.shutdown()
+
+    baseline = next((r["seconds"] for r in results if r["connections"] == 1), None)
+    for r in results:
+        r["speedup"] = round(baseline / r["seconds"], 2) if baseline else None
+
+    report = {
+        "benchmark": "segmented",
+        "timestamp": time.time(),
+        "size_bytes": size,
+        "per_connection_rate": args.rate,
+        "latency_s": args.latency,
+        "results": results,
+        "failures": failures,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        Path(args.json).write_text(text + "\n", encoding="utf-8")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
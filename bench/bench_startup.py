@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup-time guard for kexi's Downloader Pro.
+
+Imports each entry module in a fresh interpreter several times and
+reports the median import time. Fails (exit 1) when a median exceeds
+its budget, or when a module that is meant to load lazily (yt_dlp,
+tkinter, customtkinter, asyncio, the control API) shows up in
+``sys.modules`` right after import.
+
+    python bench/bench_startup.py [--runs 10] [--budget-ms 250] [--json out.json]
+
+The GUI module is only measured when customtkinter is installed.
+"""
+
+import argparse
+import importlib.util
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# module -> modules that must NOT be loaded by importing it
+TARGETS = {
+    "kexis_core": ["yt_dlp", "tkinter", "customtkinter", "asyncio"],
+    "kexis_headless": ["yt_dlp", "tkinter", "customtkinter", "kexis_api", "asyncio"],
+    "kexisdownloader": ["yt_dlp", "kexis_api", "asyncio"],
+}
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+t1 = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (t1 - t0) * 1000,
+    "loaded": [m for m in {forbidden!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(module: str, forbidden: list, runs: int) -> dict:
+    """Import ``module`` ``runs`` times in fresh interpreters."""
+    import_ms, wall_ms, loaded = [], [], set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, forbidden=forbidden)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        wall_ms.append((time.perf_counter() - start) * 1000)
+        if proc.returncode != 0:
+            return {"module": module, "error": proc.stderr.strip().splitlines()[-1:]}
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        import_ms.append(result["import_ms"])
+        loaded.update(result["loaded"])
+    return {
+        "module": module,
+        "runs": runs,
+        "import_ms_median": round(statistics.median(import_ms), 2),
+        "import_ms_min": round(min(import_ms), 2),
+        "process_ms_median": round(statistics.median(wall_ms), 2),
+        "eagerly_loaded": sorted(loaded),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=250.0,
+                        help="max median import time per module")
+    parser.add_argument("--json", metavar="FILE", help="also write results to FILE")
+    args = parser.parse_args()
+
+    results = []
+    failures = []
+    for module, forbidden in TARGETS.items():
+        if module == "kexisdownloader" and importlib.util.find_spec("customtkinter") is None:
+            results.append({"module": module, "skipped": "customtkinter not installed"})
+            continue
+        result = measure(module, forbidden, args.runs)
+        results.append(result)
+        if "error" in result:
+            failures.append(f"{module}: import failed: {result['error']}")
+            continue
+        if result["import_ms_median"] > args.budget_ms:
+            failures.append(
+                f"{module}: median import {result['import_ms_median']} ms > {args.budget_ms} ms"
+            )
+        if result["eagerly_loaded"]:
+            failures.append(f"{module}: eagerly imports {', '.join(result['eagerly_loaded'])}")
+
+    report = {
+        "benchmark": "startup",
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "budget_ms": args.budget_ms,
+        "results": results,
+        "failures": failures,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        Path(args.json).write_text(text + "\n", encoding="utf-8")
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark suite for kexi's Downloader Pro.
+
+Runs the download code against a local stand-in for YouTube: media files
+served by bench/range_server.py (byte ranges, per-connection rate limit,
+latency), the bench/fake_ytdlp.py executable for the subprocess engine,
+and the metadata in bench/fixtures. Nothing touches the network.
+
+    python bench/bench_suite.py [--only batch overhead poll formats]
+                                [--jobs 8] [--rate 8M] [--latency 0.02]
+                                [--json out.json] [--baseline old.json]
+
+Measures:
+
+    batch     wall-clock of a DownloadWorker batch, per engine
+    overhead  time run_download adds to one tiny download, per engine
+    poll      the GUI's _poll_log tick time while draining a log flood
+    formats   FormatTable parsing, views and choose_formats
+
+Every result is a timing where lower is better. With ``--baseline`` the
+run is compared against an earlier report and exits 1 if a result got
+slower by more than ``--tolerance``.
+
+The in-process engine is measured when yt_dlp is importable, and its
+batch only when ffmpeg is on PATH (the streams are real media then, so
+yt-dlp can merge them). The poll benchmark needs customtkinter and a
+display. Anything that can't run is reported as skipped, with the reason.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import queue
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+FIXTURES = ROOT / "bench" / "fixtures"
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+from range_server import parse_rate, serve, write_random  # noqa: E402
+
+BENCHMARKS = ("batch", "overhead", "poll", "formats")
+# Bytes of the single-file format the overhead benchmark downloads
+TINY_BYTES = 64 * 1024
+# Log items fed through _poll_log per run
+POLL_ITEMS = 50_000
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def result(name: str, value: float, unit: str = "s", **extra: Any) -> Dict[str, Any]:
+    scale = {"s": 1, "ms": 1e3, "us": 1e6}[unit]
+    return {"name": name, "value": round(value * scale, 3), "unit": unit, **extra}
+
+
+def skipped(name: str, reason: str) -> Dict[str, Any]:
+    return {"name": name, "skipped": reason}
+
+
+# ----------------------------------------------------------------------
+# Stand-in YouTube
+# ----------------------------------------------------------------------
+class FakeYouTube:
+    """Media server, fake yt-dlp executable and per-video metadata."""
+
+    def __init__(self, folder: Path, rate: float, latency: float, media_size: int) -> None:
+        self.folder = folder
+        self.media = folder / "media"
+        self.media.mkdir()
+        self.ffmpeg = shutil.which("ffmpeg")
+        self.real_media = bool(self.ffmpeg) and self._encode_media()
+        if not self.real_media:
+            write_random(self.media / "video.mp4", media_size)
+            write_random(self.media / "audio.m4a", media_size // 8)
+        write_random(self.media / "tiny.mp4", TINY_BYTES)
+        self.server = serve(self.media, rate=rate, latency=latency)
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}"
+        self.exe = self._write_shim()
+        self.template = json.loads((FIXTURES / "video.json").read_text(encoding="utf-8"))
+
+    def _encode_media(self) -> bool:
+        """Encode a short test pattern and tone; False if ffmpeg can't."""
+        common = [self.ffmpeg, "-v", "error", "-y", "-f", "lavfi"]
+        try:
+            subprocess.run(common + [
+                "-i", "testsrc2=size=640x360:rate=25", "-t", "20",
+                "-c:v", "mpeg4", "-b:v", "1M", str(self.media / "video.mp4"),
+            ], check=True, timeout=120)
+            subprocess.run(common + [
+                "-i", "sine=frequency=440", "-t", "20",
+                "-c:a", "aac", "-b:a", "128k", str(self.media / "audio.m4a"),
+            ], check=True, timeout=120)
+        except (OSError, subprocess.SubprocessError):
+            return False
+        return True
+
+    def _write_shim(self) -> str:
+        """A yt-dlp command that runs bench/fake_ytdlp.py with this Python."""
+        fake = ROOT / "bench" / "fake_ytdlp.py"
+        if os.name == "nt":
+            shim = self.folder / "yt-dlp.cmd"
+            shim.write_text(f'@"{sys.executable}" "{fake}" %*\r\n', encoding="utf-8")
+        else:
+            shim = self.folder / "yt-dlp"
+            shim.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{fake}" "$@"\n', encoding="utf-8")
+            shim.chmod(0o755)
+        return str(shim)
+
+    def info(self, video_id: str) -> Dict[str, Any]:
+        """The fixture, re-keyed to ``video_id``, its formats served locally.
+
+        Only the mp4 / m4a formats are kept, so whichever the ranking picks
+        can be merged; every video format serves the same file, as does
+        every audio format. Format 18 serves ``tiny.mp4``.
+        """
+        info = json.loads(json.dumps(self.template))
+        info["id"] = info["display_id"] = video_id
+        info["title"] = f"Bench {video_id}"
+        info["webpage_url"] = info["original_url"] = f"https://www.youtube.com/watch?v={video_id}"
+        formats = []
+        for f in info["formats"]:
+            if f.get("ext") not in ("mp4", "m4a") or f.get("protocol") != "https":
+                continue
+            name = "tiny.mp4" if f["format_id"] == "18" else (
+                "audio.m4a" if f.get("vcodec") == "none" else "video.mp4"
+            )
+            f.update(url=f"{self.base_url}/{name}", protocol="http",
+                     filesize=(self.media / name).stat().st_size)
+            f.pop("filesize_approx", None)
+            f.pop("fragments", None)
+            formats.append(f)
+        info["formats"] = formats
+        info.pop("requested_formats", None)
+        return info
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+class LogDrain(threading.Thread):
+    """Empties kexis_core.log_queue the way the UI would, keeping the items."""
+
+    def __init__(self, core) -> None:
+        super().__init__(daemon=True)
+        self.core = core
+        self.items: List[Any] = []
+        self.done = threading.Event()
+
+    def run(self) -> None:
+        while not self.done.is_set() or not self.core.log_queue.empty():
+            try:
+                self.items.append(self.core.log_queue.get(timeout=0.05))
+            except queue.Empty:
+                pass
+
+    def stop(self) -> List[Any]:
+        self.done.set()
+        self.join()
+        return self.items
+
+
+# ----------------------------------------------------------------------
+# Benchmarks
+# ----------------------------------------------------------------------
+def engines(core) -> Dict[str, Optional[str]]:
+    """engine -> reason it can't run here, or None."""
+    inprocess = None if importlib.util.find_spec("yt_dlp") else "yt_dlp is not installed"
+    return {"subprocess": None, "inprocess": inprocess}
+
+
+def bench_batch(core, fake: FakeYouTube, args, out: Path, captured: List[Any]) -> List[Dict[str, Any]]:
+    results = []
+    for engine, reason in engines(core).items():
+        name = f"batch.{engine}"
+        if engine == "inprocess" and not reason and not fake.real_media:
+            reason = "ffmpeg not found; yt-dlp can't merge synthetic streams"
+        if reason:
+            results.append(skipped(name, reason))
+            continue
+        core.SETTINGS["engine"] = engine
+        folder = out / name
+        folder.mkdir()
+        jobs = []
+        for i in range(args.jobs):
+            video_id = f"kxb{engine[0]}{i:07d}"
+            url = f"https://www.youtube.com/watch?v={video_id}"
+            core.remember_info(url, fake.info(video_id))
+            jobs.append((url, {"out": folder}))
+
+        drain = LogDrain(core)
+        drain.start()
+        start = time.perf_counter()
+        worker = core.DownloadWorker(jobs, tag="VIDEO", max_workers=args.workers)
+        worker.start()
+        worker.join()
+        elapsed = time.perf_counter() - start
+        items = drain.stop()
+        if engine == "subprocess":
+            captured.extend(items)
+
+        files = [p for p in folder.iterdir() if p.suffix == ".mp4"]
+        size = sum(p.stat().st_size for p in files)
+        results.append(result(
+            name, elapsed,
+            jobs=args.jobs, completed=len(files), failed=len(worker.failures),
+            bytes=size, bytes_per_s=round(size / elapsed), log_items=len(items),
+        ))
+    return results
+
+
+def bench_overhead(core, fake: FakeYouTube, args, out: Path) -> List[Dict[str, Any]]:
+    """Median time of run_download for one tiny single-file format.
+
+    ``floor`` is the same work without kexis_core: spawning the fake
+    executable (subprocess engine) or fetching the file (in-process), so
+    ``value - floor`` is what run_download itself costs.
+    """
+    import urllib.request
+
+    results = []
+    video_id = "kxbtiny0000"
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    core.remember_info(url, fake.info(video_id))
+    for engine, reason in engines(core).items():
+        name = f"overhead.{engine}"
+        if reason:
+            results.append(skipped(name, reason))
+            continue
+        core.SETTINGS["engine"] = engine
+        timings, floors = [], []
+        drain = LogDrain(core)
+        drain.start()
+        for n in range(args.repeat):
+            folder = out / f"{name}-{n}"
+            folder.mkdir()
+            start = time.perf_counter()
+            ok = core.run_download(url, folder, stream_format="18", tag="BENCH", job=n + 1)
+            timings.append(time.perf_counter() - start)
+            if not ok:
+                drain.stop()
+                results.append(skipped(name, "run_download failed"))
+                break
+
+            start = time.perf_counter()
+            if engine == "subprocess":
+                subprocess.run([fake.exe, "--version"], capture_output=True, check=True)
+            else:
+                with urllib.request.urlopen(f"{fake.base_url}/tiny.mp4") as resp:
+                    resp.read()
+            floors.append(time.perf_counter() - start)
+        else:
+            drain.stop()
+            median, floor = statistics.median(timings), statistics.median(floors)
+            results.append(result(
+                name, median, "ms", p95_ms=round(percentile(timings, 95) * 1e3, 3),
+                floor_ms=round(floor * 1e3, 3), overhead_ms=round((median - floor) * 1e3, 3),
+                runs=args.repeat,
+            ))
+    return results
+
+
+def bench_poll(core, args, captured: List[Any]) -> List[Dict[str, Any]]:
+    """Tick time of the GUI's _poll_log while it drains a flood of log items.
+
+    The items are the ones a real batch produced (repeated up to
+    POLL_ITEMS), or synthetic progress lines when the batch didn't run.
+    _poll_log runs on a small host object with real Tk widgets, so the
+    measurement covers the method itself, not the rest of the window.
+    """
+    name = "poll.tick"
+    try:
+        import tkinter
+
+        import kexisdownloader
+    except ImportError as exc:
+        return [skipped(name, f"GUI unavailable: {exc}")]
+    try:
+        root = tkinter.Tk()
+    except tkinter.TclError as exc:
+        return [skipped(name, f"no display: {exc}")]
+    root.withdraw()
+
+    app = kexisdownloader.kexisdownloader
+
+    class Host:
+        _poll_log = app._poll_log
+        _trim_log = app._trim_log
+
+        def __init__(self) -> None:
+            self._log_widgets = {"VIDEO": tkinter.Text(root), "AUDIO": tkinter.Text(root)}
+            self._batch_progress = core.BatchProgress()
+            self.progress_var = tkinter.DoubleVar(root)
+            self.progress_label = tkinter.Label(root)
+            self._log_spill = None
+            self._poll_due = None
+
+        def after(self, ms, callback) -> None:
+            pass  # the benchmark drives the ticks itself
+
+    items = [(tag, msg) for tag, msg in captured if tag in ("VIDEO", "progress")]
+    if not items:
+        items = [
+            ("VIDEO", f"[#{n % 8 + 1}] [download] {n % 100:5.1f}% of 10.00MiB at 2.00MiB/s ETA 00:05")
+            for n in range(1000)
+        ]
+    flood = (items * (POLL_ITEMS // len(items) + 1))[:POLL_ITEMS]
+
+    core.SETTINGS["log_spill_to_file"] = False
+    host = Host()
+    ticks, renders = [], []
+    for _ in range(args.repeat):
+        for item in flood:
+            core.log_queue.put(item)
+        while not core.log_queue.empty():
+            start = time.perf_counter()
+            host._poll_log()
+            ticks.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            root.update()
+            renders.append(time.perf_counter() - start)
+    root.destroy()
+    return [
+        result(name, statistics.median(ticks), "ms",
+               p95_ms=round(percentile(ticks, 95) * 1e3, 3), max_ms=round(max(ticks) * 1e3, 3),
+               ticks=len(ticks), items=len(flood) * args.repeat),
+        result("poll.render", statistics.median(renders), "ms",
+               p95_ms=round(percentile(renders, 95) * 1e3, 3)),
+    ]
+
+
+def bench_formats(core, args) -> List[Dict[str, Any]]:
+    """Per-call cost of the Format Checker's parsing and sorting."""
+    info = json.loads((FIXTURES / "video.json").read_text(encoding="utf-8"))
+    loops = 200
+
+    def timed(func) -> float:
+        runs = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            runs.append((time.perf_counter() - start) / loops)
+        return statistics.median(runs)
+
+    table = core.FormatTable(info)
+    views = [
+        (filter_name, column, descending)
+        for filter_name in core.FORMAT_FILTERS
+        for column in [None] + [c for c, _ in core.FORMAT_COLUMNS]
+        for descending in (False, True)
+    ]
+    constraints = core.FormatConstraints.from_settings()
+    return [
+        result("formats.parse", timed(lambda: core.FormatTable(info)), "us",
+               formats=len(info["formats"]), rows=len(table.rows)),
+        result("formats.view", timed(lambda: [table.view(*v) for v in views]) / len(views), "us",
+               views=len(views)),
+        result("formats.choose", timed(lambda: core.choose_formats(info, constraints)), "us"),
+    ]
+
+
+# ----------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------
+def git_revision() -> Optional[str]:
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+        )
+    except OSError:
+        return None
+    return proc.stdout.strip() or None
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Change of each result against the baseline report's result of the same name."""
+    before = {r["name"]: r for r in baseline.get("results", []) if "value" in r}
+    rows = []
+    for r in results:
+        old = before.get(r["name"])
+        if "value" not in r or not old or old["unit"] != r["unit"] or not old["value"]:
+            continue
+        change = r["value"] / old["value"] - 1
+        rows.append({
+            "name": r["name"], "before": old["value"], "after": r["value"], "unit": r["unit"],
+            "change": round(change, 3), "regressed": change > tolerance,
+        })
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--jobs", type=int, default=8, help="videos per batch (default: 8)")
+    parser.add_argument("--workers", type=int, default=4, help="batch concurrency (default: 4)")
+    parser.add_argument("--rate", type=parse_rate, default=parse_rate("8M"),
+                        help="per-connection server limit (default: 8M/s)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="seconds before each response body starts")
+    parser.add_argument("--media-size", type=parse_rate, default=parse_rate("4M"),
+                        help="video stream size when ffmpeg is unavailable (default: 4M)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per timing (default: 5)")
+    parser.add_argument("--json", metavar="FILE", help="also write the report to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against an earlier report")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="slowdown that counts as a regression (default: 0.25)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="kexis-suite-") as tmp:
+        tmp = Path(tmp)
+        # Settings, cache, archive and job store go to a throwaway profile
+        for var in ("HOME", "XDG_CONFIG_HOME", "APPDATA"):
+            os.environ[var] = str(tmp / "profile")
+        import kexis_core as core
+
+        core.SETTINGS.update(
+            archive_enabled=False, retry_attempts=0, expand_playlists=False,
+            bandwidth_limit=0, job_bandwidth_limit=0, bandwidth_schedule=False,
+        )
+        core.BANDWIDTH.refresh()
+        fake = None
+        if {"batch", "overhead"} & set(args.only):
+            fake = FakeYouTube(tmp, args.rate, args.latency, int(args.media_size))
+            core._ytdlp_exe = fake.exe
+        out = tmp / "out"
+        out.mkdir()
+
+        results: List[Dict[str, Any]] = []
+        captured: List[Any] = []
+        try:
+            if "batch" in args.only:
+                results += bench_batch(core, fake, args, out, captured)
+            if "overhead" in args.only:
+                results += bench_overhead(core, fake, args, out)
+            if "poll" in args.only:
+                results += bench_poll(core, args, captured)
+            if "formats" in args.only:
+                results += bench_formats(core, args)
+        finally:
+            if fake:
+                fake.close()
+            core.POSTPROCESS_POOL.shutdown()
+
+    report: Dict[str, Any] = {
+        "benchmark": "suite",
+        "timestamp": time.time(),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "jobs": args.jobs, "workers": args.workers, "rate": args.rate,
+            "latency_s": args.latency, "repeat": args.repeat,
+            "media": ("ffmpeg" if fake.real_media else "random") if fake else None,
+        },
+        "results": results,
+    }
+    regressed = False
+    if args.baseline:
+        report["comparison"] = compare(
+            results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance
+        )
+        regressed = any(row["regressed"] for row in report["comparison"])
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.json:
+        Path(args.json).write_text(text + "\n", encoding="utf-8")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
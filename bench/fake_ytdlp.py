@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stand-in for the yt-dlp executable, for benchmarks that must not touch
+YouTube.
+
+Understands the options kexis_core passes and answers from the recorded
+fixtures in bench/fixtures:
+
+    -J URL                     info JSON (video.json, re-keyed to the URL's ID)
+    --flat-playlist -J URL     playlist.json for playlist / channel URLs
+    -F URL                     the recorded format table
+    (anything else)            a download
+
+Downloads stream each selected format's ``url`` when it is an http(s)
+URL on this machine (see bench/range_server.py), otherwise they write
+``filesize`` bytes at $KEXIS_FAKE_RATE bytes/s (default 50M). Progress
+comes out as yt-dlp's ``--newline`` lines, or as kexis_core's KXP lines
+when ``--progress-template`` asks for them. Merging concatenates the
+parts, --extract-audio renames the file; neither is real media work.
+
+$KEXIS_FAKE_FAIL lists video IDs that fail with $KEXIS_FAKE_ERROR
+(default: an HTTP 429 error line).
+"""
+
+import json
+import os
+import re
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+VIDEO_ID_RE = re.compile(r"(?:v=|youtu\.be/|shorts/)([0-9A-Za-z_-]{11})")
+RATE_RE = re.compile(r"([\d.]+)\s*([KMG]?)", re.IGNORECASE)
+PROGRESS_INTERVAL_S = 0.1
+BLOCK_BYTES = 64 * 1024
+OUTPUT_TYPES = ("infojson:", "pl_infojson:", "thumbnail:", "subtitle:", "description:")
+
+
+def parse_rate(text: str) -> float:
+    m = RATE_RE.match(text or "")
+    if not m:
+        return 0.0
+    return float(m.group(1)) * {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[m.group(2).upper()]
+
+
+def fmt_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.2f}{unit}"
+        n /= 1024
+    return f"{n:.2f}TiB"
+
+
+def parse_args(argv: List[str]) -> Dict[str, Any]:
+    """Collect the options kexis_core uses; everything else is ignored."""
+    opts: Dict[str, Any] = {"o": [], "progress_template": [], "print_to_file": [], "urls": []}
+    with_value = {
+        "-f", "-o", "-N", "--remote-components", "--audio-format", "--audio-quality",
+        "--merge-output-format", "--limit-rate", "--cookies", "--cookies-from-browser",
+        "--load-info-json", "--progress-template",
+    }
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--print-to-file":
+            opts["print_to_file"].append((argv[i + 1], argv[i + 2]))
+            i += 3
+            continue
+        if arg in with_value:
+            value = argv[i + 1]
+            key = arg.lstrip("-").replace("-", "_")
+            if arg in ("-o", "--progress-template"):
+                opts[key].append(value)
+            else:
+                opts[key] = value
+            i += 2
+            continue
+        if arg.startswith("-"):
+            opts[arg.lstrip("-").replace("-", "_")] = True
+        else:
+            opts["urls"].append(arg)
+        i += 1
+    return opts
+
+
+def load_fixture(name: str) -> Dict[str, Any]:
+    return json.loads((FIXTURES / name).read_text(encoding="utf-8"))
+
+
+def info_for(url: str) -> Dict[str, Any]:
+    info = load_fixture("video.json")
+    m = VIDEO_ID_RE.search(url)
+    if m:
+        info["id"] = info["display_id"] = m.group(1)
+        info["webpage_url"] = info["original_url"] = url
+    return info
+
+
+def select_formats(info: Dict[str, Any], selector: str) -> List[Dict[str, Any]]:
+    """Resolve the first alternative of ``selector`` that names real formats."""
+    formats = [f for f in info.get("formats") or [] if f.get("vcodec", "none") != "none"
+               or f.get("acodec", "none") != "none"]
+    by_id = {str(f.get("format_id")): f for f in formats}
+    audio = sorted((f for f in formats if f.get("vcodec") == "none"),
+                   key=lambda f: f.get("abr") or 0)
+    video = sorted((f for f in formats if f.get("vcodec") != "none"),
+                   key=lambda f: ((f.get("height") or 0), f.get("tbr") or 0))
+
+    def pick(token: str) -> Optional[Dict[str, Any]]:
+        token = token.split("[", 1)[0]
+        if token in by_id:
+            return by_id[token]
+        if token == "bestaudio":
+            return audio[-1] if audio else None
+        if token in ("bestvideo", "best"):
+            return video[-1] if video else None
+        return None
+
+    for alternative in (selector or "best").split("/"):
+        picked = [pick(t) for t in alternative.split("+")]
+        if all(picked):
+            return picked
+    return []
+
+
+def expand_template(template: str, info: Dict[str, Any], fmt: Dict[str, Any]) -> str:
+    values = {**info, "ext": fmt.get("ext") or "bin", "format_id": fmt.get("format_id")}
+    return re.sub(r"%\((\w+)\)s", lambda m: str(values.get(m.group(1), "NA")), template)
+
+
+class Progress:
+    """Prints download progress the way the caller asked for it."""
+
+    def __init__(self, kxp: bool, stream: str, total: int) -> None:
+        self.kxp, self.stream, self.total = kxp, stream, total
+        self.started = time.monotonic()
+        self.last = 0.0
+
+    def __call__(self, done: int, final: bool = False) -> None:
+        now = time.monotonic()
+        if not final and now - self.last < PROGRESS_INTERVAL_S:
+            return
+        self.last = now
+        elapsed = max(now - self.started, 1e-6)
+        speed = done / elapsed
+        eta = int((self.total - done) / speed) if speed and self.total else None
+        if self.kxp:
+            payload = {
+                "status": "finished" if final else "downloading",
+                "downloaded_bytes": done, "total_bytes": self.total,
+                "speed": speed, "eta": eta, "fragment_index": None, "fragment_count": None,
+            }
+            print(f"KXP {self.stream} {json.dumps(payload)}", flush=True)
+        else:
+            pct = done * 100.0 / self.total if self.total else 100.0
+            print(f"[download] {pct:5.1f}% of {fmt_bytes(self.total):>10} at "
+                  f"{fmt_bytes(speed):>10}/s ETA {(eta or 0) // 60:02d}:{(eta or 0) % 60:02d}",
+                  flush=True)
+
+
+def fetch(fmt: Dict[str, Any], path: Path, progress: Progress, limit: float) -> None:
+    url = fmt.get("url") or ""
+    started = time.monotonic()
+    done = 0
+    with open(path, "wb") as out:
+        if url.startswith(("http://127.0.0.1", "http://localhost")):
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                progress.total = int(resp.headers.get("Content-Length") or 0)
+                for block in iter(lambda: resp.read(BLOCK_BYTES), b""):
+                    out.write(block)
+                    done += len(block)
+                    progress(done)
+                    if limit:
+                        ahead = done / limit - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+        else:
+            rate = limit or parse_rate(os.environ.get("KEXIS_FAKE_RATE", "50M"))
+            total = int(fmt.get("filesize") or fmt.get("filesize_approx") or 1 << 20)
+            progress.total = total
+            zero = bytes(BLOCK_BYTES)
+            while done < total:
+                n = min(BLOCK_BYTES, total - done)
+                out.write(zero[:n])
+                done += n
+                progress(done)
+                ahead = done / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    progress(done, final=True)
+
+
+def download(opts: Dict[str, Any]) -> int:
+    if opts.get("load_info_json"):
+        info = json.loads(Path(opts["load_info_json"]).read_text(encoding="utf-8"))
+    else:
+        info = info_for(opts["urls"][-1])
+
+    failing = {v for v in os.environ.get("KEXIS_FAKE_FAIL", "").split(",") if v}
+    if info.get("id") in failing:
+        message = os.environ.get(
+            "KEXIS_FAKE_ERROR", "unable to download video data: HTTP Error 429: Too Many Requests"
+        )
+        print(f"ERROR: [youtube] {info['id']}: {message}", flush=True)
+        return 1
+
+    formats = select_formats(info, opts.get("f", "best"))
+    if not formats:
+        print(f"ERROR: [youtube] {info.get('id')}: Requested format is not available", flush=True)
+        return 1
+
+    templates = [t for t in opts["o"] if not t.startswith(OUTPUT_TYPES)]
+    out_tpl = templates[-1] if templates else "%(title)s [%(id)s].%(ext)s"
+    for t in opts["o"]:
+        if t.startswith("infojson:") and opts.get("write_info_json"):
+            path = Path(expand_template(t[len("infojson:"):], info, {"ext": "info.json"}))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(info), encoding="utf-8")
+
+    kxp = any("KXP" in t for t in opts["progress_template"])
+    limit = parse_rate(opts.get("limit_rate", ""))
+    merged = len(formats) > 1
+    parts = []
+    for fmt in formats:
+        name = out_tpl if not merged else out_tpl.replace("%(ext)s", "f%(format_id)s.%(ext)s")
+        path = Path(expand_template(name, info, fmt))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        parts.append(path)
+        if opts.get("continue") and path.is_file() and path.stat().st_size:
+            # Left there by a parallel stream fetch (kexis_core.prefetch_streams)
+            print(f"[download] {path} has already been downloaded", flush=True)
+            continue
+        print(f"[download] Destination: {path}", flush=True)
+        fetch(fmt, path, Progress(kxp, str(fmt.get("format_id")), 0), limit)
+
+    final = parts[0]
+    if merged:
+        final = Path(expand_template(out_tpl, info, {"ext": opts.get("merge_output_format") or "mkv"}))
+        if kxp:
+            print('KXP Merger {"status":"started","postprocessor":"Merger"}', flush=True)
+        print(f'[Merger] Merging formats into "{final}"', flush=True)
+        with open(final, "wb") as out:
+            for part in parts:
+                out.write(part.read_bytes())
+                part.unlink()
+    if opts.get("extract_audio"):
+        if kxp:
+            print('KXP ExtractAudio {"status":"started","postprocessor":"ExtractAudio"}', flush=True)
+        target = final.with_suffix("." + (opts.get("audio_format") or "mp3"))
+        print(f"[ExtractAudio] Destination: {target}", flush=True)
+        final = final.replace(target)
+
+    for spec, path in opts["print_to_file"]:
+        if spec == "after_move:filepath":
+            with open(path, "a", encoding="utf-8") as fh:
+                fh.write(f"{final}\n")
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    opts = parse_args(argv)
+    if opts.get("version"):
+        print("2099.01.01 (kexis bench fake)")
+        return 0
+    url = opts["urls"][-1] if opts["urls"] else ""
+    if opts.get("J") or opts.get("dump_single_json"):
+        if opts.get("flat_playlist") and not VIDEO_ID_RE.search(url):
+            info = load_fixture("playlist.json")
+            info["webpage_url"] = url
+        else:
+            info = info_for(url)
+        print(json.dumps(info))
+        return 0
+    if opts.get("F") or opts.get("list_formats"):
+        sys.stdout.write((FIXTURES / "video.formats.txt").read_text(encoding="utf-8"))
+        return 0
+    if not url and not opts.get("load_info_json"):
+        print("ERROR: You must provide at least one URL.", flush=True)
+        return 2
+    return download(opts)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
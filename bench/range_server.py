@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP file server for benchmarks.
+
+Serves a folder with ``Range`` support (``206 Partial Content``) and can
+imitate a CDN that throttles each connection and answers slowly:
+
+    python bench/range_server.py FOLDER [--port 8765] [--rate 2M] [--latency 0.05]
+
+``--rate`` caps every connection separately, so splitting a download
+across N connections can go up to N times faster, as it does against
+YouTube's per-connection throttling.
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+SEND_BLOCK_BYTES = 16 * 1024
+
+
+def parse_rate(text: str) -> float:
+    """Parse ``500K`` / ``2M`` / ``1.5G`` (bytes per second); 0 means unlimited."""
+    m = re.fullmatch(r"([\d.]+)\s*([KMG]?)i?B?", text.strip(), re.IGNORECASE)
+    if not m:
+        raise argparse.ArgumentTypeError(f"invalid rate: {text!r}")
+    scale = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[m.group(2).upper()]
+    return float(m.group(1)) * scale
+
+
+def write_random(path: Path, size: int) -> None:
+    """Fill ``path`` with ``size`` random (incompressible) bytes."""
+    with open(path, "wb") as fh:
+        remaining = int(size)
+        while remaining > 0:
+            block = os.urandom(min(remaining, 1 << 20))
+            fh.write(block)
+            remaining -= len(block)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Static file handler with byte ranges, throttling and latency."""
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, *args, rate: float = 0.0, latency: float = 0.0, **kwargs):
+        self.rate = rate
+        self.latency = latency
+        super().__init__(*args, **kwargs)
+
+    def log_message(self, format, *args):  # noqa: A002 - base class signature
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _byte_range(self, size: int) -> Optional[Tuple[int, int]]:
+        header = self.headers.get("Range")
+        m = RANGE_RE.match(header or "")
+        if not m or not (m.group(1) or m.group(2)):
+            return None
+        if m.group(1):
+            start = int(m.group(1))
+            end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+        else:  # suffix range: the last N bytes
+            start, end = max(0, size - int(m.group(2))), size - 1
+        # Malformed ranges are ignored and the whole file is sent
+        return (start, end) if start <= end or start >= size else None
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404, "File not found")
+            return None
+        size = path.stat().st_size
+        byte_range = self._byte_range(size)
+        if byte_range and byte_range[0] >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", self.guess_type(str(path)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        fh = open(path, "rb")
+        fh.seek(start)
+        self._remaining = end - start + 1
+        return fh
+
+    def copyfile(self, source, outputfile):
+        if self.latency:
+            time.sleep(self.latency)
+        started = time.monotonic()
+        sent = 0
+        while self._remaining > 0:
+            block = source.read(min(SEND_BLOCK_BYTES, self._remaining))
+            if not block:
+                break
+            try:
+                outputfile.write(block)
+            except (BrokenPipeError, ConnectionResetError):
+                return  # client hung up, e.g. after reading a probe
+            sent += len(block)
+            self._remaining -= len(block)
+            if self.rate:
+                ahead = sent / self.rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+
+def serve(
+    folder: Path, port: int = 0, rate: float = 0.0, latency: float = 0.0, verbose: bool = False
+) -> ThreadingHTTPServer:
+    """Start a server on a background thread; ``server.server_port`` has the port."""
+    handler = partial(RangeRequestHandler, directory=str(folder), rate=rate, latency=latency)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--rate", type=parse_rate, default=0.0,
+                        help="per-connection limit, e.g. 2M (default: unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds before each response body starts")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+
+    server = serve(args.folder, args.port, args.rate, args.latency, args.verbose)
+    print(f"Serving {args.folder} on http://127.0.0.1:{server.server_port}/", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
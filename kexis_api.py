@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+kexi's Downloader Pro - local control API
+
+An HTTP/JSON API on 127.0.0.1 for queueing and watching downloads from
+other tools, served by an asyncio server on a background thread. Off by
+default; enable it in Preferences or with ``--api`` in headless mode.
+
+    GET    /api/status               engine, batches, concurrency
+    POST   /api/jobs                 queue a batch (see job_options)
+    GET    /api/jobs                 batches queued through the API (finished
+                                     ones for FINISHED_KEEP_S)
+    GET    /api/jobs/BATCH           one batch, with each job's state
+    DELETE /api/jobs/BATCH           cancel a batch
+    DELETE /api/jobs/BATCH/JOB       cancel one job of it
+    GET    /api/events[?batch=BATCH&logs=1]
+                                     Server-Sent Events: progress, batches,
+                                     and log lines when logs=1
+
+and, on a cluster coordinator (``--coordinator``), for kexis_cluster
+workers:
+
+    GET    /api/cluster              queued jobs and known workers
+    POST   /api/cluster/lease        {"worker", "capacity"} -> jobs to run
+    POST   /api/cluster/heartbeat    {"worker", "leases", "items"} -> leases to drop
+    POST   /api/cluster/result       {"worker", "lease", "ok", "outputs", "errors",
+                                      "items", "released"}
+
+For example:
+
+    curl -X POST localhost:8737/api/jobs -H 'Content-Type: application/json' \\
+         -d '{"urls": ["https://youtu.be/..."], "audio": true, "codec": "flac"}'
+
+Each POST becomes one DownloadWorker batch tagged ``API-<id>``, so it is
+scheduled, archived, retried and resumed like a batch started from the
+GUI. When the api_token setting is set, requests need an
+``Authorization: Bearer <token>`` header (or ``?token=`` for EventSource).
+Requests whose Host isn't local are refused, which keeps web pages from
+reaching the API through DNS rebinding. A coordinator listening on the
+LAN accepts any Host instead, and therefore always needs the token.
+
+This module must not import tkinter, like kexis_core.
+"""
+
+import asyncio
+import hmac
+import json
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from kexis_core import (
+    AUDIO_CODECS_RIGHT,
+    AUDIO_IDS_LEFT,
+    CLUSTER,
+    GLOBAL_LIMITER,
+    JOB_STORE,
+    SETTINGS,
+    VIDEO_IDS,
+    DownloadWorker,
+    ProgressEvent,
+    add_log_listener,
+    find_cookies_file,
+    remove_log_listener,
+    split_url_list,
+    tab_concurrency,
+)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 16 * 1024 * 1024
+# Events buffered per SSE client; a client further behind loses events
+EVENT_BUFFER = 1000
+# Seconds between SSE keep-alive comments and batch-finished checks
+KEEPALIVE_S = 15.0
+WATCH_S = 0.5
+# Seconds a finished batch can still be looked up before it is forgotten
+FINISHED_KEEP_S = 600.0
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "[::1]")
+REASONS = {
+    200: "OK", 201: "Created", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized",
+    403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    415: "Unsupported Media Type", 500: "Internal Server Error",
+}
+
+
+class ApiError(Exception):
+    """A request the API refuses; becomes a JSON ``{"error": ...}`` response."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def job_options(body: Dict[str, Any]) -> Tuple[str, dict]:
+    """Return (tag kind, options dict) for a POST /api/jobs body.
+
+    Builds what the Video / Audio tabs do. Fields: ``audio`` (bool),
+    ``out`` (folder, default ~/Downloads), ``cookies``, ``connections``;
+    video: ``video_format`` and ``audio_format`` (format IDs or the
+    labels the tabs show); audio: ``codec`` and ``also_codecs``.
+    """
+    audio = bool(body.get("audio"))
+    out = Path(str(body.get("out") or Path.home() / "Downloads")).expanduser().resolve()
+    try:
+        out.mkdir(parents=True, exist_ok=True)
+    except OSError as exc:
+        raise ApiError(400, f"cannot use output folder: {exc}")
+    opts: Dict[str, Any] = dict(out=out, audio=audio, cookies_path=body.get("cookies") or find_cookies_file())
+    if audio:
+        codec = body.get("codec") or AUDIO_CODECS_RIGHT[0]
+        extra = body.get("also_codecs") or []
+        unknown = [c for c in [codec, *extra] if c not in AUDIO_CODECS_RIGHT]
+        if unknown or not isinstance(extra, list):
+            raise ApiError(400, f"codecs must be among {', '.join(AUDIO_CODECS_RIGHT)}")
+        opts["right_codec"] = codec
+        extra = [c for c in dict.fromkeys(extra) if c != codec]
+        if extra:
+            opts["extra_codecs"] = extra
+    else:
+        video_format = str(body.get("video_format") or "best")
+        audio_format = str(body.get("audio_format") or "251")
+        opts["video_id"] = VIDEO_IDS.get(video_format, video_format)
+        opts["audio_id"] = AUDIO_IDS_LEFT.get(audio_format, audio_format)
+    if body.get("connections") is not None:
+        try:
+            opts["connections"] = max(1, int(body["connections"]))
+        except (TypeError, ValueError):
+            raise ApiError(400, "connections must be a number")
+    return ("AUDIO" if audio else "VIDEO"), opts
+
+
+class _Batch:
+    """A batch queued through the API."""
+
+    def __init__(self, batch_id: str, kind: str, worker: DownloadWorker) -> None:
+        self.id = batch_id
+        self.kind = kind
+        self.worker = worker
+        self.created = time.time()
+        self.finished: Optional[float] = None
+
+    def describe(self, with_jobs: bool = False) -> Dict[str, Any]:
+        worker = self.worker
+        states = JOB_STORE.states(list(worker.store_ids))
+        jobs = [
+            {"job": n, "url": url, "state": states.get(store_id, "unknown")}
+            for n, ((url, _), store_id) in enumerate(zip(worker.jobs, worker.store_ids), start=1)
+        ]
+        counts: Dict[str, int] = {}
+        for job in jobs:
+            counts[job["state"]] = counts.get(job["state"], 0) + 1
+        info: Dict[str, Any] = {
+            "id": self.id,
+            "tag": worker.tag,
+            "kind": self.kind.lower(),
+            "created": self.created,
+            "finished": self.finished,
+            "cancelled": worker.stop_flag,
+            "counts": counts,
+            "failures": list(worker.failures),
+        }
+        if with_jobs:
+            info["jobs"] = jobs
+        return info
+
+
+class ControlAPI:
+    """The API server; :meth:`start` runs it on its own thread and event loop.
+
+    ``on_batch(worker)`` is called (on the API thread) for every batch it
+    starts, so the GUI can show its log and cancel it with the rest.
+    """
+
+    def __init__(
+        self,
+        port: Optional[int] = None,
+        token: Optional[str] = None,
+        on_batch: Optional[Callable[[DownloadWorker], None]] = None,
+        host: str = "127.0.0.1",
+    ) -> None:
+        self.host = host
+        self.port = SETTINGS["api_port"] if port is None else port
+        self.token = SETTINGS["api_token"] if token is None else token
+        self.on_batch = on_batch
+        self.batches: Dict[str, _Batch] = {}
+        self._clients: List[Tuple[asyncio.Queue, Optional[str], bool]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    # Lifecycle ----------------------------------------------------------
+    def start(self) -> int:
+        """Start serving; returns the bound port. Raises OSError if it can't bind."""
+        if not self.local and not self.token:
+            raise ValueError(f"listening on {self.host} needs an API token")
+        self._thread = threading.Thread(target=self._run, name="kexis-api", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+        add_log_listener(self._on_item)
+        return self.port
+
+    def stop(self) -> None:
+        """Stop serving; batches already queued keep running."""
+        remove_log_listener(self._on_item)
+        if self._loop and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        loop = self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port, limit=MAX_HEADER_BYTES)
+            )
+        except OSError as exc:
+            self._error = exc
+            self._ready.set()
+            loop.close()
+            return
+        self.port = self._server.sockets[0].getsockname()[1]
+        loop.create_task(self._watch_batches())
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            self._server.close()
+            # Open connections (SSE streams never end on their own) keep
+            # wait_closed() waiting from Python 3.12 on; cancelling their
+            # handlers closes them
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(self._server.wait_closed())
+            loop.close()
+
+    @property
+    def local(self) -> bool:
+        """True when only this machine can connect."""
+        return self.host in ("127.0.0.1", "localhost", "::1")
+
+    # Events -------------------------------------------------------------
+    def _on_item(self, tag: str, msg: Any) -> None:
+        """Log listener; runs on whichever thread queued the item."""
+        loop = self._loop
+        if self._clients and loop and loop.is_running():
+            loop.call_soon_threadsafe(self._publish, tag, msg)
+
+    def _publish(self, tag: str, msg: Any) -> None:
+        if isinstance(msg, ProgressEvent):
+            # Progress is queued under "progress"; the batch is in the event
+            event, data, tag = "progress", {**msg._asdict(), "percent": msg.percent}, msg.tag
+        else:
+            event, data = "log", {"tag": tag, "msg": str(msg).strip("\n")}
+        self._broadcast(event, data, tag)
+
+    def _broadcast(self, event: str, data: Dict[str, Any], tag: str = "") -> None:
+        payload = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+        for events, only_tag, logs in self._clients:
+            if (only_tag and tag != only_tag) or (event == "log" and not logs):
+                continue
+            try:
+                events.put_nowait(payload)
+            except asyncio.QueueFull:
+                pass
+
+    async def _watch_batches(self) -> None:
+        """Announce batches as their workers finish, and forget old ones."""
+        while True:
+            await asyncio.sleep(WATCH_S)
+            now = time.time()
+            for batch in list(self.batches.values()):
+                if batch.finished is None and not batch.worker.is_alive():
+                    batch.finished = now
+                    self._broadcast(
+                        "batch", {"id": batch.id, "tag": batch.worker.tag, "state": "finished"},
+                        batch.worker.tag,
+                    )
+                elif batch.finished is not None and now - batch.finished > FINISHED_KEEP_S:
+                    del self.batches[batch.id]
+
+    # HTTP ---------------------------------------------------------------
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                method, target, headers, body = await self._read_request(reader)
+                await self._dispatch(method, target, headers, body, writer)
+            except ApiError as exc:
+                await self._respond(writer, exc.status, {"error": str(exc)})
+            except (asyncio.LimitOverrunError, ValueError):
+                await self._respond(writer, 400, {"error": "malformed request"})
+            except Exception as exc:
+                await self._respond(writer, 500, {"error": str(exc)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Shutting down (see _run); asyncio's stream protocol would log
+            # the cancellation of a connection handler as an error
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        head = await reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, _ = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise ApiError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target, headers, body
+
+    def _check_access(self, headers: Dict[str, str], query: Dict[str, List[str]]) -> None:
+        host = headers.get("host", "")
+        host = host[: host.find("]") + 1] if host.startswith("[") else host.split(":", 1)[0]
+        if self.local and host.lower() not in LOCAL_HOSTS:
+            raise ApiError(403, "only local requests are accepted")
+        if self.token:
+            auth = headers.get("authorization", "")
+            given = auth[7:] if auth.startswith("Bearer ") else (query.get("token") or [""])[0]
+            # Constant time, so the token can't be guessed a byte at a time
+            if not hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+                raise ApiError(401, "missing or wrong API token")
+
+    async def _dispatch(self, method, target, headers, body, writer) -> None:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        self._check_access(headers, query)
+        parts = [p for p in url.path.split("/") if p]
+        if parts[:1] != ["api"]:
+            raise ApiError(404, "not found")
+        route = parts[1:]
+
+        if route == ["status"] and method == "GET":
+            await self._respond(writer, 200, self._status())
+        elif route == ["events"] and method == "GET":
+            await self._stream_events(writer, query)
+        elif route == ["jobs"] and method == "POST":
+            batch, ignored = await asyncio.get_running_loop().run_in_executor(
+                None, self._start_batch, self._json_body(headers, body)
+            )
+            await self._respond(writer, 201, {**(await self._describe([batch]))[0], "ignored": ignored})
+        elif route == ["jobs"] and method == "GET":
+            await self._respond(writer, 200, {"batches": await self._describe(list(self.batches.values()))})
+        elif len(route) in (2, 3) and route[0] == "jobs":
+            batch = self.batches.get(route[1])
+            if batch is None:
+                raise ApiError(404, f"no batch {route[1]}")
+            if method == "GET" and len(route) == 2:
+                await self._respond(writer, 200, (await self._describe([batch], with_jobs=True))[0])
+            elif method == "DELETE":
+                self._cancel(batch, route[2] if len(route) == 3 else None)
+                await self._respond(writer, 202, (await self._describe([batch]))[0])
+            else:
+                raise ApiError(405, "method not allowed")
+        elif route[:1] == ["cluster"]:
+            await self._respond(writer, 200, self._cluster(method, route[1:], headers, body))
+        else:
+            raise ApiError(404 if method in ("GET", "POST", "DELETE") else 405, "not found")
+
+    @staticmethod
+    async def _describe(batches: List[_Batch], with_jobs: bool = False) -> List[Dict[str, Any]]:
+        """``describe()`` the batches off the loop, since it reads the job store."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [b.describe(with_jobs) for b in batches]
+        )
+
+    @staticmethod
+    def _json_body(headers: Dict[str, str], body: bytes) -> Dict[str, Any]:
+        if not headers.get("content-type", "").startswith("application/json"):
+            # Also stops plain HTML forms from posting here
+            raise ApiError(415, "send JSON with Content-Type: application/json")
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise ApiError(400, "body is not valid JSON")
+        if not isinstance(request, dict):
+            raise ApiError(400, "body must be a JSON object")
+        return request
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, query: Dict[str, List[str]]) -> None:
+        only_tag = None
+        if query.get("batch"):
+            batch = self.batches.get(query["batch"][0])
+            if batch is None:
+                raise ApiError(404, f"no batch {query['batch'][0]}")
+            only_tag = batch.worker.tag
+        logs = (query.get("logs") or ["0"])[0] not in ("0", "false", "")
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nConnection: keep-alive\r\n\r\n"
+        )
+        await writer.drain()
+        client = (asyncio.Queue(EVENT_BUFFER), only_tag, logs)
+        self._clients.append(client)
+        try:
+            while True:
+                try:
+                    payload = await asyncio.wait_for(client[0].get(), KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    payload = ": keep-alive\n\n"
+                writer.write(payload.encode("utf-8"))
+                await writer.drain()
+        finally:
+            self._clients.remove(client)
+
+    # Actions ------------------------------------------------------------
+    def _status(self) -> Dict[str, Any]:
+        running = [b for b in self.batches.values() if b.finished is None]
+        return {
+            "engine": SETTINGS["engine"],
+            "batches": len(self.batches),
+            "running_batches": len(running),
+            "active_jobs": GLOBAL_LIMITER.active,
+            "max_concurrent_jobs": SETTINGS["max_concurrent_jobs"],
+        }
+
+    def _start_batch(self, request: Dict[str, Any]) -> Tuple[_Batch, List[str]]:
+        """Queue the request's URLs as one DownloadWorker batch (off the loop: it hits SQLite)."""
+        urls = request.get("urls")
+        if isinstance(urls, str):
+            urls = urls.splitlines()
+        if not isinstance(urls, list):
+            raise ApiError(400, "urls must be a list of YouTube URLs")
+        urls, ignored = split_url_list("\n".join(str(u) for u in urls))
+        if not urls:
+            raise ApiError(400, "no valid YouTube URLs")
+        kind, opts = job_options(request)
+        batch_id = uuid.uuid4().hex[:8]
+        worker = DownloadWorker(
+            [(u, dict(opts)) for u in urls], tag=f"API-{batch_id}", max_workers=tab_concurrency(kind)
+        )
+        batch = self.batches[batch_id] = _Batch(batch_id, kind, worker)
+        if self.on_batch:
+            self.on_batch(worker)
+        worker.start()
+        self._loop.call_soon_threadsafe(
+            self._broadcast, "batch", {"id": batch_id, "tag": worker.tag, "state": "queued",
+                                       "jobs": len(urls)}, worker.tag,
+        )
+        return batch, ignored
+
+    def _cluster(self, method: str, route: List[str], headers, body) -> Dict[str, Any]:
+        """Answer a cluster worker (see Coordinator in kexis_core)."""
+        if not CLUSTER.active:
+            raise ApiError(404, "this instance isn't a cluster coordinator")
+        if not route and method == "GET":
+            return CLUSTER.status()
+        if method != "POST" or len(route) != 1:
+            raise ApiError(405 if len(route) == 1 else 404, "not found")
+        request = self._json_body(headers, body)
+        worker = str(request.get("worker") or "")
+        if not worker:
+            raise ApiError(400, "name the worker")
+        try:
+            if route == ["lease"]:
+                jobs = CLUSTER.lease(worker, max(0, int(request.get("capacity") or 0)))
+                return {"jobs": jobs, "lease_s": SETTINGS["cluster_lease_s"]}
+            if route == ["heartbeat"]:
+                leases = [str(x) for x in request.get("leases") or []]
+                return {"drop": CLUSTER.heartbeat(worker, leases, request.get("items") or [])}
+            if route == ["result"]:
+                accepted = CLUSTER.complete(
+                    worker, str(request.get("lease")), bool(request.get("ok")),
+                    [str(x) for x in request.get("outputs") or []],
+                    [str(x) for x in request.get("errors") or []],
+                    request.get("items") or [], bool(request.get("released")),
+                )
+                return {"accepted": accepted}
+        except (TypeError, ValueError) as exc:
+            raise ApiError(400, f"malformed {route[0]}: {exc}")
+        raise ApiError(404, "not found")
+
+    def _cancel(self, batch: _Batch, job: Optional[str]) -> None:
+        if job is None:
+            batch.worker.stop()
+            return
+        try:
+            number = int(job)
+        except ValueError:
+            raise ApiError(404, f"no job {job}")
+        if not 1 <= number <= len(batch.worker.jobs):
+            raise ApiError(404, f"no job {job}")
+        batch.worker.cancel_job(number)
+
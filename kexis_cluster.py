@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+kexi's Downloader Pro - cluster worker
+
+Spreads large batches over several machines, so one connection's
+bandwidth and YouTube's per-IP throttling stop being the limit. One
+instance is the coordinator and owns the queue; the others are workers
+that pull jobs from it:
+
+    python kexisdownloader.py --daemon ~/spool --coordinator -j 32
+    python kexisdownloader.py --worker http://192.168.1.10:8737 -j 4
+
+The coordinator serves its control API on the LAN (api_host 0.0.0.0;
+the api_token setting must be the same everywhere). Each worker leases
+as many jobs as it has free slots, runs them with run_download, and
+reports the output paths back. While a job runs, the worker's heartbeats
+renew its lease and carry the job's log lines and progress, so they show
+up on the coordinator as if the job ran there. A worker that stops
+sending heartbeats for cluster_lease_s seconds loses its jobs to the
+others; one stopped with Ctrl+C hands its jobs back at once.
+
+Workers use their own cookies and engine settings. They save into the
+coordinator's output folder path unless ``-o`` names one of their own.
+Retries, the download archive and the job store stay on the coordinator.
+
+This module must not import tkinter, like kexis_core.
+"""
+
+import json
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from kexis_core import (
+    SETTINGS,
+    DownloadWorker,
+    ProgressEvent,
+    add_log_listener,
+    cacheable_video_id,
+    find_cookies_file,
+    pick_formats,
+    remove_log_listener,
+    run_download,
+    ui_append,
+)
+
+# Seconds between lease requests while there are free slots, and between
+# heartbeats while jobs run (never more than a third of the lease)
+POLL_S = 1.0
+# Back-off while the coordinator can't be reached
+OFFLINE_RETRY_S = 5.0
+REQUEST_TIMEOUT_S = 15.0
+# Log lines / progress events kept per heartbeat; older ones are dropped
+MAX_ITEMS = 2000
+
+
+class _LeasedJob:
+    """One leased job running here; the proc_ref run_download reports to."""
+
+    def __init__(self, lease: Dict[str, Any]) -> None:
+        self.lease = lease
+        self.id: str = lease["lease"]
+        # Unique per job, so the log listener can tell whose line it is
+        self.tag = f"LEASE-{self.id[:8]}"
+        self.cancelled = False
+        self.procs: List[Any] = []
+        self._lock = threading.Lock()
+
+    def attach(self, job: int, proc) -> None:
+        with self._lock:
+            self.procs.append(proc)
+        if self.cancelled:
+            DownloadWorker._terminate(proc)
+
+    def detach(self, job: int, proc=None) -> None:
+        with self._lock:
+            if proc in self.procs:
+                self.procs.remove(proc)
+
+    def is_cancelled(self, job: int) -> bool:
+        return self.cancelled
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        with self._lock:
+            procs = list(self.procs)
+        for proc in procs:
+            DownloadWorker._terminate(proc)
+
+
+class ClusterWorker:
+    """Pulls jobs from a coordinator and runs up to ``capacity`` at once."""
+
+    def __init__(
+        self,
+        coordinator: str,
+        capacity: int = 1,
+        name: Optional[str] = None,
+        token: Optional[str] = None,
+        out: Optional[Path] = None,
+    ) -> None:
+        self.base = coordinator.rstrip("/")
+        if not self.base.endswith("/api"):
+            self.base += "/api"
+        self.capacity = max(1, capacity)
+        self.name = name or socket.gethostname()
+        self.token = SETTINGS["api_token"] if token is None else token
+        self.out = out
+        self.lease_s = float(SETTINGS["cluster_lease_s"])
+        self.running: Dict[str, _LeasedJob] = {}
+        self.stop_flag = False
+        # Set when the coordinator rejected the token or URL
+        self.refused = False
+        self._items: List[list] = []
+        self._lock = threading.Lock()
+
+    # Coordinator --------------------------------------------------------
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        request = urllib.request.Request(
+            f"{self.base}/cluster/{path}",
+            data=json.dumps({"worker": self.name, **payload}, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        if self.token:
+            request.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_S) as resp:
+            return json.loads(resp.read())
+
+    def _take_items(self, lease_id: Optional[str] = None) -> List[list]:
+        with self._lock:
+            if lease_id is None:
+                items, self._items = self._items, []
+            else:
+                items = [i for i in self._items if i[0] == lease_id]
+                self._items = [i for i in self._items if i[0] != lease_id]
+        return items
+
+    def _on_item(self, tag: str, msg: Any) -> None:
+        """Log listener: keep this worker's job output for the next heartbeat."""
+        if isinstance(msg, ProgressEvent):
+            tag = msg.tag
+        if not tag.startswith("LEASE-"):
+            return
+        run = next((r for r in list(self.running.values()) if r.tag == tag), None)
+        if run is None:
+            return
+        item = [run.id, "progress", msg._asdict()] if isinstance(msg, ProgressEvent) else [run.id, "log", str(msg)]
+        with self._lock:
+            self._items.append(item)
+            del self._items[:-MAX_ITEMS]
+
+    # Jobs ---------------------------------------------------------------
+    def _run(self, run: _LeasedJob) -> None:
+        lease = run.lease
+        opts = dict(lease["opts"])
+        out = self.out or Path(lease["out"])
+        outputs: List[str] = []
+        errors: List[str] = []
+        ok = False
+        try:
+            out.mkdir(parents=True, exist_ok=True)
+            opts["cookies_path"] = find_cookies_file()
+            if not opts.get("audio") and SETTINGS["auto_formats"] and cacheable_video_id(lease["url"]):
+                pick_formats(lease["url"], opts, tag=run.tag, job=lease["job"])
+            ok = run_download(
+                lease["url"], out, **opts, tag=run.tag, proc_ref=run, job=lease["job"],
+                outputs=outputs, errors=errors,
+            )
+        except Exception as exc:
+            errors.append(f"ERROR: {exc}")
+        # Cancelled by the coordinator: it isn't waiting for a result.
+        # Stopped here: hand the job back so another worker takes it now
+        released = run.cancelled and self.stop_flag
+        for attempt in range(3):
+            try:
+                self._post("result", {
+                    "lease": run.id, "ok": ok and not run.cancelled, "outputs": outputs,
+                    "errors": errors, "items": self._take_items(run.id), "released": released,
+                })
+                break
+            except (OSError, ValueError) as exc:
+                # The lease expires and the job is re-run elsewhere
+                ui_append("CLUSTER", f"[cluster] Could not report job {lease['job']}: {exc}")
+                time.sleep(POLL_S * (attempt + 1))
+        self.running.pop(run.id, None)
+
+    def _heartbeat(self) -> None:
+        if not self.running:
+            return
+        drop = self._post(
+            "heartbeat", {"leases": list(self.running), "items": self._take_items()}
+        ).get("drop", [])
+        for lease_id in drop:
+            run = self.running.get(lease_id)
+            if run:
+                ui_append("CLUSTER", f"[cluster] Job {run.lease['job']} was cancelled by the coordinator")
+                run.cancel()
+
+    def _lease(self) -> None:
+        free = self.capacity - len(self.running)
+        if free <= 0 or self.stop_flag:
+            return
+        reply = self._post("lease", {"capacity": free})
+        self.lease_s = float(reply.get("lease_s") or self.lease_s)
+        for lease in reply.get("jobs", []):
+            run = _LeasedJob(lease)
+            self.running[run.id] = run
+            ui_append("CLUSTER", f"[cluster] Job {lease['job']} of {lease['tag']}: {lease['url']}")
+            threading.Thread(target=self._run, args=(run,), name=run.tag, daemon=True).start()
+
+    # Lifecycle ----------------------------------------------------------
+    def run(self) -> None:
+        """Work until :meth:`stop`; running jobs are handed back when stopped."""
+        add_log_listener(self._on_item)
+        offline = False
+        last_beat = 0.0
+        try:
+            while not self.stop_flag:
+                try:
+                    if time.monotonic() - last_beat >= min(POLL_S, self.lease_s / 3):
+                        self._heartbeat()
+                        last_beat = time.monotonic()
+                    self._lease()
+                    if offline:
+                        ui_append("CLUSTER", f"[cluster] Coordinator {self.base} is back")
+                        offline = False
+                    time.sleep(POLL_S)
+                except (OSError, ValueError) as exc:
+                    if isinstance(exc, urllib.error.HTTPError) and exc.code in (401, 403, 404):
+                        ui_append("CLUSTER", f"[cluster] Coordinator refused this worker: {exc}")
+                        self.refused = True
+                        self.stop()
+                        break
+                    if not offline:
+                        ui_append("CLUSTER", f"[cluster] Coordinator {self.base} unreachable: {exc}")
+                        offline = True
+                    time.sleep(OFFLINE_RETRY_S)
+            for run in list(self.running.values()):
+                run.cancel()
+            deadline = time.monotonic() + REQUEST_TIMEOUT_S
+            while self.running and time.monotonic() < deadline:
+                time.sleep(0.1)
+        finally:
+            remove_log_listener(self._on_item)
+
+    def stop(self) -> None:
+        self.stop_flag = True
@@ -0,0 +1,3387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+kexi's Downloader Pro - download core
+
+Everything that works without a display: settings, the yt-dlp engines,
+the metadata cache, download archive, job store and the DownloadWorker
+scheduler. Shared by the GUI (kexisdownloader.py) and the headless CLI
+(kexis_headless.py), so it must never import tkinter or customtkinter.
+"""
+
+import os
+import sys
+import re
+import shutil
+import queue
+import threading
+import subprocess
+import json
+import random
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+import sqlite3
+import tempfile
+import importlib.util
+import multiprocessing
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+)
+from pathlib import Path
+from typing import Dict, List, Tuple, Optional, Any, NamedTuple, Callable
+
+# yt_dlp itself is imported inside the functions that need it: loading its
+# extractor registry costs more than everything else at startup combined,
+# and the subprocess engine never needs it at all.
+
+
+# ----------------------------------------------------------------------
+# User settings
+# ----------------------------------------------------------------------
+def user_config_dir() -> Path:
+    """Return the per-user config directory for the app."""
+    if sys.platform == "win32":
+        base = Path(os.environ.get("APPDATA") or Path.home() / "AppData" / "Roaming")
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Application Support"
+    else:
+        base = Path(os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config")
+    return base / "kexisdownloader"
+
+
+SETTINGS_FILE = user_config_dir() / "settings.json"
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "max_concurrent_jobs": 6,          # across all tabs
+    "tab_concurrency": {"VIDEO": 4, "AUDIO": 4},
+    "engine": "subprocess",            # see ENGINES
+    "download_connections": 4,         # per file: byte ranges / fragments
+    "parallel_streams": True,          # fetch video + audio side by side (in-process engine)
+    "pipeline_postprocess": True,      # convert audio off the download slots
+    "postprocess_workers": 0,          # conversion processes, 0 = CPU count
+    "cache_enabled": True,
+    "cache_ttl_hours": 3,              # stream URLs expire after ~6 h
+    "cache_max_mb": 64,
+    "archive_enabled": True,           # skip jobs already in the archive
+    "archive_scan_on_startup": False,  # seed the archive from output folders
+    "log_max_lines": 5000,             # per log widget, 0 = unlimited
+    "log_max_kb": 0,                   # per log widget, 0 = unlimited
+    "log_spill_to_file": False,        # keep the full history under logs/
+    "resume_jobs_on_startup": True,    # offer to resume unfinished jobs
+    "expand_playlists": True,          # one job per playlist / channel video
+    "bandwidth_limit": 0,              # bytes/s for all downloads, 0 = unlimited
+    "job_bandwidth_limit": 0,          # bytes/s per download, 0 = unlimited
+    "bandwidth_schedule": False,       # lift both limits during the hours below
+    "full_speed_from": 22,             # hour of day (local time)
+    "full_speed_until": 7,
+    "retry_attempts": 3,               # per job, transient failures only; 0 = off
+    "auto_formats": True,              # pick exact format IDs from the metadata
+    "format_max_height": 0,            # 0 = no cap
+    "format_codecs": ["av1", "vp9", "avc1"],  # allowed video codecs, best first
+    "format_container": "mp4",         # "mp4", "webm" or "" for either
+    "format_min_audio_kbps": 0,
+    "api_enabled": False,              # local HTTP control API, see kexis_api
+    "api_port": 8737,                  # on 127.0.0.1
+    "api_token": "",                   # required as a Bearer token when set
+    "api_host": "127.0.0.1",           # "0.0.0.0" lets cluster workers on the LAN in (token required)
+    "cluster_lease_s": 30,             # seconds a silent cluster worker keeps its jobs
+}
+
+
+def load_settings() -> Dict[str, Any]:
+    """Load settings from disk, falling back to the defaults."""
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    try:
+        stored = json.loads(SETTINGS_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return settings
+    if isinstance(stored, dict):
+        for key, value in stored.items():
+            if isinstance(settings.get(key), dict) and isinstance(value, dict):
+                settings[key].update(value)
+            else:
+                settings[key] = value
+    return settings
+
+
+def save_settings() -> None:
+    """Write the current settings to disk."""
+    try:
+        SETTINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        SETTINGS_FILE.write_text(json.dumps(SETTINGS, indent=2), encoding="utf-8")
+    except OSError as exc:
+        print(f"⚠ Could not save settings: {exc}")
+
+
+SETTINGS = load_settings()
+
+
+# ----------------------------------------------------------------------
+# Thread-safe log queue
+# ----------------------------------------------------------------------
+log_queue:  queue.Queue[tuple[str, Any]] = queue.Queue()
+
+
+# Extra consumers of every queued item (e.g. the control API). Replaced,
+# never mutated, so ui_append can iterate it without a lock
+_log_listeners: Tuple[Any, ...] = ()
+
+
+def add_log_listener(listener) -> None:
+    """Also call ``listener(tag, msg)`` for every item, from the sending thread."""
+    global _log_listeners
+    _log_listeners = (*_log_listeners, listener)
+
+
+def remove_log_listener(listener) -> None:
+    global _log_listeners
+    _log_listeners = tuple(fn for fn in _log_listeners if fn is not listener)
+
+
+def ui_append(tag: str, msg: str | float) -> None:
+    """Push a log line / progress value onto the queue."""
+    log_queue.put((tag, msg))
+    for listener in _log_listeners:
+        listener(tag, msg)
+
+
+# Tag of the items ui_call queues; the GUI's log pump runs them
+UI_CALL = "call"
+
+
+def ui_call(fn: Callable[..., Any], *args: Any) -> None:
+    """Run ``fn(*args)`` on the GUI thread; safe to call from any thread.
+
+    It travels on the log queue, so it runs after everything logged
+    before it. Tk must only be touched from its own thread.
+    """
+    log_queue.put((UI_CALL, (fn, args)))
+
+
+PROGRESS_LINE_RE = re.compile(r"^(\[#\d+\] )?\[download\]\s+[\d.]+%")
+
+
+LOG_DIR = user_config_dir() / "logs"
+
+
+class LogSpill:
+    """Append-only per-tag log files that keep the history trimmed from the UI."""
+
+    def __init__(self, folder: Path) -> None:
+        self.folder = folder
+        self._files: Dict[str, Any] = {}
+
+    def write(self, tag: str, lines: List[str]) -> None:
+        fh = self._files.get(tag)
+        if fh is None:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            name = f"{tag.lower()}-{time.strftime('%Y%m%d')}.log"
+            fh = self._files[tag] = open(self.folder / name, "a", encoding="utf-8")
+        fh.write("\n".join(lines) + "\n")
+        fh.flush()
+
+    def close(self) -> None:
+        for fh in self._files.values():
+            fh.close()
+        self._files.clear()
+
+
+def coalesce_log_lines(lines: List[str]) -> List[str]:
+    """Collapse runs of progress lines so only the latest per job survives.
+
+    A job's progress line replaces its previous one unless the job logged
+    something else in between; the relative order of each job's output
+    is preserved.
+    """
+    out: List[str] = []
+    last_progress: Dict[str, int] = {}
+    for line in lines:
+        m = PROGRESS_LINE_RE.match(line)
+        job = (m.group(1) if m else None) or ""
+        if not m:
+            job = line[: line.find("] ") + 2] if line.startswith("[#") else ""
+            last_progress.pop(job, None)
+            out.append(line)
+        elif job in last_progress:
+            out[last_progress[job]] = line
+        else:
+            last_progress[job] = len(out)
+            out.append(line)
+    return out
+
+
+# ----------------------------------------------------------------------
+# Progress events
+# ----------------------------------------------------------------------
+# Stream-level phases come from yt-dlp; job-level ones from DownloadWorker
+PROGRESS_PHASES = (
+    "download", "finished", "postprocess", "error",     # per stream
+    "queued", "retrying", "done", "failed", "cancelled",  # per job
+)
+JOB_END_PHASES = ("done", "failed", "cancelled")
+
+
+class ProgressEvent(NamedTuple):
+    """One progress report for a job, published on the queue as ``"progress"``."""
+
+    job: int
+    phase: str                          # see PROGRESS_PHASES
+    downloaded: int = 0                 # bytes
+    total: Optional[int] = None         # bytes (exact or estimated)
+    speed: Optional[float] = None       # bytes/s
+    eta: Optional[float] = None         # seconds
+    fragment_index: Optional[int] = None
+    fragment_count: Optional[int] = None
+    stream: str = ""                    # format ID, or postprocessor name
+    tag: str = ""                       # batch the job belongs to ("VIDEO", …)
+
+    @property
+    def percent(self) -> Optional[float]:
+        if self.phase == "finished":
+            return 100.0
+        if not self.total:
+            return None
+        return min(100.0, self.downloaded * 100.0 / self.total)
+
+    @classmethod
+    def from_hook(
+        cls, job: int, d: Dict[str, Any], stream: str = "", tag: str = ""
+    ) -> "ProgressEvent":
+        """Build an event from a yt-dlp progress / postprocessor hook dict."""
+        if "postprocessor" in d:
+            return cls(job, "postprocess", stream=d["postprocessor"] or stream, tag=tag)
+        status = d.get("status")
+        return cls(
+            job,
+            {"downloading": "download", "finished": "finished"}.get(status, "error"),
+            downloaded=int(d.get("downloaded_bytes") or 0),
+            total=d.get("total_bytes") or d.get("total_bytes_estimate"),
+            speed=d.get("speed"),
+            eta=d.get("eta"),
+            fragment_index=d.get("fragment_index"),
+            fragment_count=d.get("fragment_count"),
+            stream=stream,
+            tag=tag,
+        )
+
+    def describe(self) -> str:
+        """Render the event like yt-dlp's own ``[download]`` line."""
+        parts = ["[download]"]
+        pct = self.percent
+        if pct is not None:
+            parts.append(f"{pct:5.1f}% of {format_bytes(self.total):>10}")
+        else:
+            parts.append(f"{format_bytes(self.downloaded):>10}")
+        if self.speed:
+            parts.append(f"at {format_bytes(self.speed):>10}/s")
+        if self.eta is not None and self.phase == "download":
+            parts.append(f"ETA {int(self.eta) // 60:02d}:{int(self.eta) % 60:02d}")
+        if self.fragment_count:
+            parts.append(f"(frag {self.fragment_index}/{self.fragment_count})")
+        return " ".join(parts)
+
+
+def format_bytes(n: Optional[float]) -> str:
+    """Format a byte count the way yt-dlp does (``12.34MiB``)."""
+    if n is None:
+        return "N/A"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(n) < 1024:
+            return f"{n:.2f}{unit}"
+        n /= 1024
+    return f"{n:.2f}TiB"
+
+
+# --progress-template output: "KXP <stream> <json>", parsed by parse_progress_line
+PROGRESS_MARK = "KXP "
+PROGRESS_TEMPLATES = [
+    "download:" + PROGRESS_MARK + "%(info.format_id)s "
+    '{"status":%(progress.status)j,'
+    '"downloaded_bytes":%(progress.downloaded_bytes|null)s,'
+    '"total_bytes":%(progress.total_bytes,progress.total_bytes_estimate|null)s,'
+    '"speed":%(progress.speed|null)s,"eta":%(progress.eta|null)s,'
+    '"fragment_index":%(progress.fragment_index|null)s,'
+    '"fragment_count":%(progress.fragment_count|null)s}',
+    "postprocess:" + PROGRESS_MARK + "%(progress.postprocessor)s "
+    '{"status":%(progress.status)j,"postprocessor":%(progress.postprocessor)j}',
+]
+
+
+def parse_progress_line(job: int, line: str, tag: str = "") -> Optional[ProgressEvent]:
+    """Parse one ``PROGRESS_TEMPLATES`` line, or return None if it is not one."""
+    if not line.startswith(PROGRESS_MARK):
+        return None
+    try:
+        _, stream, payload = line.split(" ", 2)
+        return ProgressEvent.from_hook(job, json.loads(payload), stream, tag)
+    except ValueError:
+        return None
+
+
+class _JobProgress:
+    """Per-job state tracked by :class:`BatchProgress`."""
+
+    __slots__ = ("state", "fraction", "streams")
+
+    def __init__(self) -> None:
+        self.state = "queued"
+        self.fraction = 0.0
+        self.streams: Dict[str, Tuple[int, Optional[int]]] = {}
+
+    @property
+    def total_bytes(self) -> Optional[int]:
+        totals = [t for _, t in self.streams.values() if t]
+        return sum(totals) if totals else None
+
+    @property
+    def remaining_bytes(self) -> int:
+        return sum(max(0, t - d) for d, t in self.streams.values() if t)
+
+
+class BatchProgress:
+    """Aggregate view of every job across running batches.
+
+    Fed with :class:`ProgressEvent` objects. Completion is job-weighted
+    and never moves backwards for a job, even when a second stream
+    (e.g. the audio of a ``video+audio`` download) starts. Bandwidth is
+    measured from bytes actually received over a sliding window, and the
+    ETA assumes queued jobs are as large as the average known job.
+    """
+
+    WINDOW_S = 5.0
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.jobs: Dict[Tuple[str, int], _JobProgress] = {}
+        self._received = 0
+        self._samples: deque = deque()
+
+    def update(self, ev: ProgressEvent, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        key = (ev.tag, ev.job)
+        if ev.phase == "queued":
+            if self.jobs and self.running == 0 and self.queued == 0:
+                self.reset()
+            self.jobs[key] = _JobProgress()
+            return
+        if ev.phase == "retrying":
+            # Back in the queue; its next attempt starts from scratch
+            self.jobs[key] = _JobProgress()
+            return
+
+        job = self.jobs.setdefault(key, _JobProgress())
+        if ev.phase in JOB_END_PHASES:
+            job.state = ev.phase
+            job.fraction = 1.0
+            for stream, (done, total) in job.streams.items():
+                job.streams[stream] = (done, done)
+            return
+
+        job.state = "running"
+        if ev.phase in ("download", "finished"):
+            prev_done = job.streams.get(ev.stream, (0, None))[0]
+            total = ev.total or (ev.downloaded if ev.phase == "finished" else None)
+            job.streams[ev.stream] = (ev.downloaded, total)
+            self._received += max(0, ev.downloaded - prev_done)
+            known = [(d, t) for d, t in job.streams.values() if t]
+            if known:
+                fraction = sum(d for d, _ in known) / sum(t for _, t in known)
+                # Only the job-level "done" event takes a job to 100%
+                job.fraction = max(job.fraction, min(fraction, 0.99))
+            self._samples.append((now, self._received))
+            while self._samples and now - self._samples[0][0] > self.WINDOW_S:
+                self._samples.popleft()
+
+    def _count(self, *states: str) -> int:
+        return sum(1 for j in self.jobs.values() if j.state in states)
+
+    @property
+    def total(self) -> int:
+        return len(self.jobs)
+
+    @property
+    def queued(self) -> int:
+        return self._count("queued")
+
+    @property
+    def running(self) -> int:
+        return self._count("running")
+
+    @property
+    def finished(self) -> int:
+        return self._count(*JOB_END_PHASES)
+
+    @property
+    def failed(self) -> int:
+        return self._count("failed")
+
+    def completion(self) -> float:
+        """Overall batch completion in [0, 1]."""
+        if not self.jobs:
+            return 0.0
+        return sum(j.fraction for j in self.jobs.values()) / len(self.jobs)
+
+    def rate(self, now: Optional[float] = None) -> float:
+        """Aggregate download bandwidth in bytes/s over the last window."""
+        now = time.monotonic() if now is None else now
+        if not self._samples:
+            return 0.0
+        t0, b0 = self._samples[0]
+        if now - t0 > self.WINDOW_S or now <= t0:
+            return 0.0
+        return (self._received - b0) / (now - t0)
+
+    def eta(self, now: Optional[float] = None) -> Optional[float]:
+        """Seconds until every queued and running job has been downloaded."""
+        speed = self.rate(now)
+        if speed <= 0:
+            return None
+        sizes = [j.total_bytes for j in self.jobs.values() if j.total_bytes]
+        average = sum(sizes) / len(sizes) if sizes else 0
+        remaining = 0.0
+        for j in self.jobs.values():
+            if j.state == "queued":
+                remaining += average
+            elif j.state == "running":
+                remaining += j.remaining_bytes if j.total_bytes else average
+        return remaining / speed
+
+    def summary(self, now: Optional[float] = None) -> str:
+        """One-line status for the progress label."""
+        if not self.jobs:
+            return "Ready to download"
+        failed = f", {self.failed} failed" if self.failed else ""
+        if self.running == 0 and self.queued == 0:
+            return f"✅ Finished {self.finished}/{self.total}{failed}"
+        text = (
+            f"Downloading...  {self.completion() * 100:.0f}%  ·  "
+            f"{self.finished}/{self.total} done{failed}  ·  {self.running} active"
+        )
+        speed = self.rate(now)
+        if speed > 0:
+            text += f"  ·  {format_bytes(speed)}/s"
+        eta = self.eta(now)
+        if eta is not None:
+            text += f"  ·  ETA {int(eta) // 3600:d}:{int(eta) % 3600 // 60:02d}:{int(eta) % 60:02d}"
+        return text
+
+
+# ----------------------------------------------------------------------
+# Telemetry
+# ----------------------------------------------------------------------
+# Upper bounds (seconds) of the timing histogram buckets; the UI poll
+# timings land in the small ones, whole jobs in the large ones
+TELEMETRY_BUCKETS_S = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900,
+)
+# Known phases in the order a job goes through them, for display
+TELEMETRY_PHASES = (
+    "batch", "queue_wait", "metadata", "job", "spawn", "extract", "download",
+    "merge", "extract_audio", "postprocess", "convert", "ui_poll", "ui_poll_delay",
+)
+# yt-dlp postprocessor name -> phase; other postprocessors are "postprocess"
+_POSTPROCESS_PHASES = {"Merger": "merge", "ExtractAudio": "extract_audio"}
+# Suffix of an export file -> format, see Telemetry.export
+TELEMETRY_FORMATS = {".json": "json", ".csv": "csv", ".prom": "prometheus", ".txt": "prometheus"}
+
+
+class _Timing:
+    """Count, sum, extremes and histogram of one phase's durations."""
+
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * len(TELEMETRY_BUCKETS_S)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(TELEMETRY_BUCKETS_S):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+def _phase_order(item) -> Tuple[int, str, str]:
+    (phase, engine), _ = item
+    rank = TELEMETRY_PHASES.index(phase) if phase in TELEMETRY_PHASES else len(TELEMETRY_PHASES)
+    return rank, phase, engine
+
+
+class Telemetry:
+    """Where the time goes: phase timings, counters and gauges.
+
+    Timings are keyed by (phase, engine). Download phases come from
+    :class:`PhaseClock`; DownloadWorker adds ``queue_wait``, ``metadata``,
+    ``convert``, ``job`` and ``batch``, the GUI ``ui_poll`` (time spent in
+    one log pump tick) and ``ui_poll_delay`` (how late the tick ran).
+    Counters (``bytes_downloaded``, ``jobs``, ``retries``) carry one label;
+    gauges (``log_queue_depth``) keep their latest and highest value.
+
+    Thread-safe; every call is a dict update under one lock.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.started = time.time()
+            self._timings: Dict[Tuple[str, str], _Timing] = {}
+            self._counters: Dict[Tuple[str, str], float] = {}
+            self._gauges: Dict[str, Tuple[float, float]] = {}
+
+    def observe(self, phase: str, seconds: float, engine: str = "") -> None:
+        with self._lock:
+            timing = self._timings.get((phase, engine))
+            if timing is None:
+                timing = self._timings[(phase, engine)] = _Timing()
+            timing.observe(max(0.0, seconds))
+
+    @contextmanager
+    def timed(self, phase: str, engine: str = ""):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.monotonic() - start, engine)
+
+    def count(self, name: str, n: float = 1, label: str = "") -> None:
+        with self._lock:
+            self._counters[(name, label)] = self._counters.get((name, label), 0) + n
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            _, highest = self._gauges.get(name, (0, 0))
+            self._gauges[name] = (value, max(highest, value))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything recorded so far, as plain JSON-ready data."""
+        with self._lock:
+            phases = [
+                {
+                    "phase": phase, "engine": engine, "count": t.count,
+                    "total_s": round(t.total, 6), "mean_s": round(t.total / t.count, 6),
+                    "min_s": round(t.min, 6), "max_s": round(t.max, 6),
+                    "buckets": dict(zip(map(str, TELEMETRY_BUCKETS_S), t.buckets)),
+                }
+                for (phase, engine), t in sorted(self._timings.items(), key=_phase_order)
+            ]
+            counters = [
+                {"name": name, "label": label, "value": value}
+                for (name, label), value in sorted(self._counters.items())
+            ]
+            gauges = [
+                {"name": name, "value": value, "max": highest}
+                for name, (value, highest) in sorted(self._gauges.items())
+            ]
+        return {
+            "started": self.started,
+            "uptime_s": round(time.time() - self.started, 3),
+            "phases": phases,
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_csv(self) -> str:
+        """One row per timing, counter and gauge."""
+        import csv
+        import io
+
+        snap = self.snapshot()
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["kind", "name", "label", "count", "total_s", "mean_s", "min_s", "max_s", "value"])
+        for p in snap["phases"]:
+            writer.writerow([
+                "timing", p["phase"], p["engine"], p["count"],
+                p["total_s"], p["mean_s"], p["min_s"], p["max_s"], "",
+            ])
+        for c in snap["counters"]:
+            writer.writerow(["counter", c["name"], c["label"], "", "", "", "", "", c["value"]])
+        for g in snap["gauges"]:
+            writer.writerow(["gauge", g["name"], "", "", "", "", "", "", g["value"]])
+            writer.writerow(["gauge", g["name"] + "_max", "", "", "", "", "", "", g["max"]])
+        return buf.getvalue()
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format, e.g. for node_exporter's textfile collector."""
+        snap = self.snapshot()
+        lines = [
+            "# HELP kexis_phase_seconds Time spent in each phase of a download job.",
+            "# TYPE kexis_phase_seconds histogram",
+        ]
+        for p in snap["phases"]:
+            labels = f'phase="{p["phase"]}",engine="{p["engine"]}"'
+            cumulative = 0
+            for bound, n in p["buckets"].items():
+                cumulative += n
+                lines.append(f'kexis_phase_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'kexis_phase_seconds_bucket{{{labels},le="+Inf"}} {p["count"]}')
+            lines.append(f"kexis_phase_seconds_sum{{{labels}}} {p['total_s']}")
+            lines.append(f"kexis_phase_seconds_count{{{labels}}} {p['count']}")
+        for name in sorted({c["name"] for c in snap["counters"]}):
+            lines.append(f"# TYPE kexis_{name}_total counter")
+            for c in snap["counters"]:
+                if c["name"] == name:
+                    label = f'{{label="{c["label"]}"}}' if c["label"] else ""
+                    lines.append(f"kexis_{name}_total{label} {c['value']}")
+        for g in snap["gauges"]:
+            lines.append(f"# TYPE kexis_{g['name']} gauge")
+            lines.append(f"kexis_{g['name']} {g['value']}")
+            lines.append(f"# TYPE kexis_{g['name']}_max gauge")
+            lines.append(f"kexis_{g['name']}_max {g['max']}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> None:
+        """Write to ``path`` as JSON, CSV or Prometheus text, by its suffix."""
+        kind = TELEMETRY_FORMATS.get(Path(path).suffix.lower())
+        if kind is None:
+            raise ValueError(f"unknown stats format {Path(path).suffix!r} (use {', '.join(TELEMETRY_FORMATS)})")
+        text = {"json": self.to_json, "csv": self.to_csv, "prometheus": self.to_prometheus}[kind]()
+        # Written whole then renamed, so a collector never reads half a file
+        tmp = Path(f"{path}.tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, path)
+
+
+TELEMETRY = Telemetry()
+
+
+class PhaseClock:
+    """Splits one yt-dlp run into consecutive phases for TELEMETRY.
+
+    Starts in ``first`` ("spawn" for a new process, "extract" in-process),
+    moves to "extract" on the first output, "download" on the first
+    progress event and "merge" / "extract_audio" / "postprocess" when a
+    postprocessor starts. Each phase's duration is recorded when the next
+    one begins, and bytes received are counted when the clock stops.
+    """
+
+    def __init__(self, engine: str, first: str = "spawn") -> None:
+        self.engine = engine
+        self.phase = first
+        self.since = time.monotonic()
+        self._received: Dict[str, int] = {}
+
+    def enter(self, phase: str) -> None:
+        if phase == self.phase:
+            return
+        now = time.monotonic()
+        TELEMETRY.observe(self.phase, now - self.since, self.engine)
+        self.phase, self.since = phase, now
+
+    def line(self, line: str) -> None:
+        """Any output from yt-dlp: the process is up and extracting."""
+        if self.phase == "spawn":
+            self.enter("extract")
+        elif line.startswith("[Merger]"):
+            self.enter("merge")
+
+    def event(self, ev: ProgressEvent) -> None:
+        if ev.phase in ("download", "finished"):
+            self._received[ev.stream] = max(
+                self._received.get(ev.stream, 0), ev.downloaded or (ev.total or 0)
+            )
+            self.enter("download")
+        elif ev.phase == "postprocess":
+            self.enter(_POSTPROCESS_PHASES.get(ev.stream, "postprocess"))
+
+    def stop(self) -> None:
+        TELEMETRY.observe(self.phase, time.monotonic() - self.since, self.engine)
+        received = sum(self._received.values())
+        if received:
+            TELEMETRY.count("bytes_downloaded", received, self.engine)
+
+
+# ----------------------------------------------------------------------
+# Video / audio format dictionaries
+# ----------------------------------------------------------------------
+VIDEO_IDS: Dict[str, str] = {
+     "Best Quality (Auto)": "best",
+    "8K – AV01 – 403": "403",  "8K – AV1 – 416": "416", "8K – AV1 – 417": "417",
+    "8K – VP9 – 571": "571", "8K – VP9 – 272": "272",
+    "8K – AV1 – 402": "402", "8K – AV1 – 701": "701", "8K – AV1 – 700": "700",
+    "4K – AV01 – 401": "401", "4K – VP9 – 315": "315", "4K – VP9 – 337": "337",
+    "4K – AV01 – 400": "400", "4K – AV1 – 399": "399",
+    "4K – AV01 – 398": "398", "4K – VP9 – 313": "313",
+    "1440p – VP9 – 308": "308", "1440p – VP9 – 271": "271", "1440p – VP9 – 336": "336",
+    "1440p – AV1 – 302": "302", "1440p – AVC1 – 264": "264",
+    "1080p – VP9 – 303": "303", "1080p – VP9 – 248": "248", "1080p – VP9 – 335": "335",
+    "1080p – AV1 – 301": "301", "1080p – AVC1 – 137": "137",
+    "720p – AVC1 – 136": "136",  "720p – VP9 – 247": "247"
+}
+
+
+AUDIO_IDS_LEFT = {
+    "Best Audio (Opus)": "251",
+    "High Audio (Opus)": "250",
+    "Medium Audio (Opus)": "249",
+    "AAC Audio (M4A)": "140",
+    "Low Audio (AAC)": "139",
+}
+
+AUDIO_CODECS_RIGHT = ["mp3", "flac", "alac", "wav", "m4a", "opus", "ogg"]
+
+
+# ----------------------------------------------------------------------
+# Find yt-dlp binary
+# ----------------------------------------------------------------------
+def find_yt_dlp() -> str:
+    """Return the absolute path to the yt-dlp executable."""
+    if getattr(sys, "frozen", False):
+        bundle_dir = Path(
+            sys._MEIPASS if hasattr(sys, "_MEIPASS") else sys.executable
+        ).parent
+        candidate = bundle_dir. parent / "Resources" / "bin" / "yt-dlp"
+        if candidate.exists():
+            return str(candidate)
+        candidate = bundle_dir / "bin" / "yt-dlp"
+        if candidate.exists():
+            return str(candidate)
+
+    venv_path = Path(__file__).parent / "venv" / "bin" / "yt-dlp"
+    if venv_path.exists():
+        return str(venv_path)
+
+    exe = shutil.which("yt-dlp") or shutil.which("yt_dlp. exe")
+    if not exe:
+        raise FileNotFoundError(
+            "yt-dlp not found. Install it with `pip install yt-dlp`."
+        )
+    return exe
+
+
+_ytdlp_exe: Optional[str] = None
+
+
+def ytdlp_exe() -> str:
+    """Return the yt-dlp executable, locating it on first use.
+
+    A successful lookup is cached; a failed one raises FileNotFoundError
+    and is retried next time, so installing yt-dlp doesn't need a restart.
+    """
+    global _ytdlp_exe
+    if _ytdlp_exe is None:
+        _ytdlp_exe = find_yt_dlp()
+    return _ytdlp_exe
+
+
+# ----------------------------------------------------------------------
+# Process loop
+# ----------------------------------------------------------------------
+# Longest output line read from a streamed child (yt-dlp prints short ones)
+PROCESS_LINE_LIMIT = 1 << 20
+
+
+def _creation_flags() -> int:
+    """Keep children from opening console windows on Windows."""
+    return getattr(subprocess, "CREATE_NO_WINDOW", 0) if os.name == "nt" else 0
+
+
+class ChildProcess:
+    """A child running on PROCESS_LOOP; terminate() / kill() work from any thread."""
+
+    def __init__(self, loop, proc) -> None:
+        self._loop = loop
+        self._proc = proc
+
+    @property
+    def pid(self) -> int:
+        return self._proc.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._proc.returncode
+
+    def _signal(self, name: str) -> None:
+        def send() -> None:
+            if self._proc.returncode is None:
+                try:
+                    getattr(self._proc, name)()
+                except ProcessLookupError:
+                    pass
+
+        self._loop.call_soon_threadsafe(send)
+
+    def terminate(self) -> None:
+        self._signal("terminate")
+
+    def kill(self) -> None:
+        self._signal("kill")
+
+
+class ProcessLoop:
+    """One asyncio event loop, on one background thread, for every yt-dlp child.
+
+    Children are started with ``asyncio.create_subprocess_exec`` and
+    their output is read without blocking, so a batch of dozens of
+    downloads doesn't hold a thread per process just to read its pipe,
+    and :class:`ChildProcess` stops a cancelled one at once rather than
+    at its next line of output. Blocking code waits with :meth:`run`;
+    the GUI uses :meth:`submit` and gets results back through
+    :func:`ui_call`. The loop (and asyncio) load on first use.
+    """
+
+    def __init__(self) -> None:
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                import asyncio
+
+                self._loop = asyncio.new_event_loop()
+                self._watch_children(self._loop)
+                threading.Thread(target=self._loop.run_forever, name="kexis-processes", daemon=True).start()
+            return self._loop
+
+    @staticmethod
+    def _watch_children(loop) -> None:
+        """Wait for children with pidfds where asyncio would use a thread each.
+
+        Before Python 3.12 the default child watcher on Unix runs one
+        thread per child; Linux 5.3+ can watch them on the loop itself.
+        """
+        if sys.version_info >= (3, 12) or not hasattr(os, "pidfd_open"):
+            return
+        import asyncio
+
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            return
+        watcher = asyncio.PidfdChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+    def submit(self, coro) -> Future:
+        """Schedule ``coro`` on the loop; returns a concurrent.futures.Future."""
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro) -> Any:
+        """Run ``coro`` on the loop and wait for its result. Never call it from the loop."""
+        return self.submit(coro).result()
+
+    async def stream(
+        self,
+        cmd: List[str],
+        on_line: Callable[[str], bool],
+        on_start: Optional[Callable[[ChildProcess], None]] = None,
+    ) -> int:
+        """Run ``cmd`` and feed each line of its output to ``on_line``; returns the exit code.
+
+        stderr is merged into stdout. ``on_start`` gets the ChildProcess
+        once it runs; ``on_line`` returning True terminates it. Both are
+        called on the loop, so they must not block.
+        """
+        import asyncio
+
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            limit=PROCESS_LINE_LIMIT,
+            creationflags=_creation_flags(),
+        )
+        try:
+            if on_start:
+                on_start(ChildProcess(self._loop, proc))
+            while True:
+                raw = await proc.stdout.readline()
+                if not raw:
+                    break
+                if on_line(raw.decode("utf-8", "replace").rstrip()):
+                    proc.terminate()
+                    break
+            return await proc.wait()
+        finally:
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+
+    async def capture(self, cmd: List[str]) -> Tuple[int, str, str]:
+        """Run ``cmd`` to completion; returns (exit code, stdout, stderr)."""
+        import asyncio
+
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            creationflags=_creation_flags(),
+        )
+        out, err = await proc.communicate()
+        return proc.returncode, out.decode("utf-8", "replace"), err.decode("utf-8", "replace")
+
+
+PROCESS_LOOP = ProcessLoop()
+
+
+async def ytdlp_json(cmd: List[str]) -> Any:
+    """Run a yt-dlp ``-J`` command on PROCESS_LOOP and parse what it prints."""
+    code, out, err = await PROCESS_LOOP.capture(cmd)
+    if code != 0:
+        raise RuntimeError(err.strip() or f"yt-dlp exited with {code}")
+    return json.loads(out)
+
+
+# ----------------------------------------------------------------------
+# URL validation
+# ----------------------------------------------------------------------
+URL_RE = re.compile(r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$")
+
+
+def split_url_list(text: str) -> Tuple[List[str], List[str]]:
+    """Split a pasted multi-line string into (YouTube URLs, ignored lines).
+
+    Log output that ends up in the same text box (banners, ``[…]`` lines,
+    ✅/❌ results) is skipped silently rather than reported as ignored.
+    """
+    raw = [x.strip() for x in text.splitlines() if x.strip()]
+    urls:  list[str] = []
+    ignored:  list[str] = []
+
+    for line in raw:
+        if (
+            line.startswith("=")
+            or line.startswith("-")
+            or "DOWNLOAD" in line. upper()
+            or "RUNNING" in line.upper()
+            or "COMMAND:" in line. upper()
+            or line.startswith("Paste")
+            or line.startswith("[")
+            or "✅" in line
+            or "❌" in line
+        ):
+            continue
+
+        if URL_RE.match(line):
+            urls.append(line)
+        else:
+            ignored.append(line)
+
+    return urls, ignored
+
+
+def find_cookies_file() -> Optional[str]:
+    """Search the usual places for a cookies.txt file."""
+    for p in (
+        Path.home() / "Downloads" / "cookies.txt",
+        Path.cwd() / "cookies.txt",
+        Path.home() / "cookies.txt",
+    ):
+        if p.is_file():
+            return str(p)
+    return None
+
+
+# ----------------------------------------------------------------------
+# Metadata cache
+# ----------------------------------------------------------------------
+VIDEO_ID_RE = re.compile(
+    r"(?:youtu\.be/|[?&]v=|/(?:shorts|live|embed)/)([0-9A-Za-z_-]{11})(?![0-9A-Za-z_-])"
+)
+
+# Keys that describe one particular download rather than the video itself
+_VOLATILE_INFO_KEYS = ("requested_downloads", "filepath", "_filename", "filename")
+
+
+def cacheable_video_id(url: str) -> Optional[str]:
+    """Return the video ID of a single-video URL, or None.
+
+    Playlist URLs (including ``watch?v=…&list=…``) are not cacheable
+    because yt-dlp expands them to several entries.
+    """
+    if "list=" in url:
+        return None
+    m = VIDEO_ID_RE.search(url)
+    return m.group(1) if m else None
+
+
+class MetadataCache:
+    """SQLite store of extracted info dicts keyed by video ID.
+
+    Entries expire ``ttl`` seconds after they were written, and the least
+    recently used entries are evicted once the compressed payloads exceed
+    ``max_bytes``. Safe to share between worker threads.
+    """
+
+    def __init__(self, path: Path, *, ttl: float, max_bytes: int) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS info ("
+                " video_id TEXT PRIMARY KEY, data BLOB NOT NULL,"
+                " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, video_id: str) -> Optional[Dict[str, Any]]:
+        """Return the cached info dict, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT data, created FROM info WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                db.execute("DELETE FROM info WHERE video_id = ?", (video_id,))
+                db.commit()
+                return None
+            db.execute("UPDATE info SET accessed = ? WHERE video_id = ?", (now, video_id))
+            db.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, video_id: str, info: Dict[str, Any]) -> None:
+        """Store ``info`` and evict old entries beyond the size budget."""
+        clean = {k: v for k, v in info.items() if k not in _VOLATILE_INFO_KEYS}
+        data = zlib.compress(json.dumps(clean).encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?, ?)",
+                (video_id, data, len(data), now, now),
+            )
+            db.execute("DELETE FROM info WHERE created < ?", (now - self.ttl,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM info").fetchone()[0]
+            if total > self.max_bytes:
+                rows = db.execute(
+                    "SELECT video_id, size FROM info WHERE video_id != ? ORDER BY accessed",
+                    (video_id,),
+                ).fetchall()
+                for vid, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    db.execute("DELETE FROM info WHERE video_id = ?", (vid,))
+                    total -= size
+            db.commit()
+
+    def titles(self) -> Dict[str, str]:
+        """Return ``{title: video_id}`` for every cached entry."""
+        with self._lock:
+            rows = self._db().execute("SELECT video_id, data FROM info").fetchall()
+        titles: Dict[str, str] = {}
+        for vid, data in rows:
+            try:
+                title = json.loads(zlib.decompress(data)).get("title")
+            except (zlib.error, ValueError):
+                continue
+            if title:
+                titles[title] = vid
+        return titles
+
+    def delete(self, video_id: str) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM info WHERE video_id = ?", (video_id,))
+            self._db().commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db().execute("DELETE FROM info")
+            self._db().commit()
+
+
+METADATA_CACHE = MetadataCache(
+    user_config_dir() / "metadata.sqlite",
+    ttl=SETTINGS["cache_ttl_hours"] * 3600,
+    max_bytes=SETTINGS["cache_max_mb"] * 1024 * 1024,
+)
+
+
+def cached_info(url: str) -> Optional[Dict[str, Any]]:
+    """Return cached metadata for ``url`` if caching applies and is fresh."""
+    if not SETTINGS["cache_enabled"]:
+        return None
+    vid = cacheable_video_id(url)
+    return METADATA_CACHE.get(vid) if vid else None
+
+
+def remember_info(url: str, info: Dict[str, Any]) -> None:
+    """Cache ``info`` for ``url`` when it is a single, cacheable video."""
+    vid = cacheable_video_id(url)
+    if not SETTINGS["cache_enabled"] or not vid or info.get("_type", "video") != "video":
+        return
+    try:
+        METADATA_CACHE.put(vid, info)
+    except (sqlite3.Error, TypeError, ValueError) as exc:
+        print(f"⚠ Metadata cache write failed: {exc}")
+
+
+def forget_info(url: str) -> None:
+    """Drop the cache entry for ``url`` (e.g. after its stream URLs expired)."""
+    vid = cacheable_video_id(url)
+    if vid:
+        try:
+            METADATA_CACHE.delete(vid)
+        except sqlite3.Error:
+            pass
+
+
+def write_info_file(info: Dict[str, Any], folder: str) -> str:
+    """Write ``info`` as a ``--load-info-json`` file inside ``folder``."""
+    path = Path(folder) / "cached.info.json"
+    path.write_text(json.dumps(info), encoding="utf-8")
+    return str(path)
+
+
+def cookie_args(cookies_path: str | None) -> List[str]:
+    """Return the yt-dlp CLI arguments for ``cookies_path``."""
+    if not cookies_path:
+        return []
+    cp = Path(cookies_path).expanduser()
+    if cp.is_file():
+        return ["--cookies", str(cp)]
+    return ["--cookies-from-browser", "chrome"]
+
+
+# ----------------------------------------------------------------------
+# Core download routine
+# ----------------------------------------------------------------------
+ENGINES = {
+    "subprocess": "Subprocess (yt-dlp executable)",
+    "inprocess": "In-process (yt_dlp module)",
+}
+
+
+# ----------------------------------------------------------------------
+# Format ranking
+# ----------------------------------------------------------------------
+# Heights of the VIDEO_IDS rows, for replacing an ID a video doesn't offer
+_LABEL_HEIGHTS = {"8K": 4320, "4K": 2160}
+VIDEO_ID_HEIGHTS: Dict[str, int] = {
+    fid: _LABEL_HEIGHTS.get(label.split()[0]) or int(label.split()[0].rstrip("p"))
+    for label, fid in VIDEO_IDS.items()
+    if fid != "best"
+}
+_CODEC_FAMILIES = (
+    ("av01", "av1"), ("vp09", "vp9"), ("vp9", "vp9"), ("avc1", "avc1"), ("h264", "avc1"),
+    ("hev1", "hevc"), ("hvc1", "hevc"), ("mp4a", "aac"), ("opus", "opus"), ("vorbis", "vorbis"),
+)
+# Container -> audio extension that merges into it without re-encoding
+_AUDIO_EXT_FOR = {"mp4": "m4a", "webm": "webm"}
+# Direct files before DASH manifests before HLS at equal quality
+_PROTOCOL_RANK = {"https": 2, "http": 2, "http_dash_segments": 1}
+
+
+def codec_family(codec: Optional[str]) -> str:
+    """``av01.0.12M.08`` -> ``av1``, ``mp4a.40.2`` -> ``aac``, ``none`` -> ``none``."""
+    codec = (codec or "none").lower()
+    for prefix, family in _CODEC_FAMILIES:
+        if codec.startswith(prefix):
+            return family
+    return codec.split(".")[0]
+
+
+class FormatConstraints(NamedTuple):
+    """What the user allows; see the format_* settings."""
+
+    max_height: int = 0                     # 0 = no cap
+    codecs: Tuple[str, ...] = ()            # allowed video codecs, best first; () = any
+    container: str = ""                     # "mp4" / "webm"; "" = either
+    min_audio_kbps: float = 0.0
+
+    @classmethod
+    def from_settings(cls) -> "FormatConstraints":
+        return cls(
+            max_height=int(SETTINGS["format_max_height"] or 0),
+            codecs=tuple(SETTINGS["format_codecs"] or ()),
+            container=SETTINGS["format_container"] or "",
+            min_audio_kbps=float(SETTINGS["format_min_audio_kbps"] or 0),
+        )
+
+
+class FormatChoice(NamedTuple):
+    """Formats picked by :func:`choose_formats`."""
+
+    video: Dict[str, Any]
+    audio: Optional[Dict[str, Any]]         # None when ``video`` has audio
+
+    @property
+    def video_id(self) -> str:
+        return self.video["format_id"]
+
+    @property
+    def audio_id(self) -> Optional[str]:
+        return self.audio["format_id"] if self.audio else None
+
+    def describe(self) -> str:
+        """``401 (2160p60 AV1 mp4) + 251 (OPUS 135k webm)``"""
+        v = self.video
+        fps = f"{v['fps']:.0f}" if v.get("fps") and v["fps"] > 30 else ""
+        text = (
+            f"{v['format_id']} ({v.get('height') or '?'}p{fps} "
+            f"{codec_family(v.get('vcodec')).upper()} {v.get('ext')})"
+        )
+        if self.audio:
+            a = self.audio
+            kbps = a.get("abr") or a.get("tbr")
+            text += (
+                f" + {a['format_id']} ({codec_family(a.get('acodec')).upper()}"
+                f"{f' {kbps:.0f}k' if kbps else ''} {a.get('ext')})"
+            )
+        return text
+
+
+def _video_formats(formats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [f for f in formats if codec_family(f.get("vcodec")) != "none" and f.get("height")]
+
+
+def _audio_formats(formats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        f for f in formats
+        if codec_family(f.get("acodec")) != "none" and codec_family(f.get("vcodec")) == "none"
+    ]
+
+
+def rank_video_formats(
+    formats: List[Dict[str, Any]], constraints: FormatConstraints
+) -> List[Dict[str, Any]]:
+    """Video formats allowed by ``constraints``, best first.
+
+    Resolution decides, then codec preference, frame rate, protocol and
+    bitrate; the format ID breaks remaining ties so the order never
+    depends on the order yt-dlp listed them in. A constraint that would
+    leave nothing is dropped (container, then codecs); with nothing under
+    the height cap, the smallest formats are used.
+    """
+    candidates = _video_formats(formats)
+    if constraints.container:
+        candidates = [f for f in candidates if f.get("ext") == constraints.container] or candidates
+    if constraints.codecs:
+        candidates = [
+            f for f in candidates if codec_family(f.get("vcodec")) in constraints.codecs
+        ] or candidates
+    if constraints.max_height:
+        capped = [f for f in candidates if f["height"] <= constraints.max_height]
+        if not capped and candidates:
+            lowest = min(f["height"] for f in candidates)
+            capped = [f for f in candidates if f["height"] == lowest]
+        candidates = capped
+
+    def key(f: Dict[str, Any]):
+        family = codec_family(f.get("vcodec"))
+        preference = (
+            -constraints.codecs.index(family) if family in constraints.codecs
+            else -len(constraints.codecs)
+        )
+        return (
+            f["height"],
+            preference,
+            f.get("fps") or 0,
+            _PROTOCOL_RANK.get(f.get("protocol") or "", 0),
+            f.get("vbr") or f.get("tbr") or 0,
+            f["format_id"],
+        )
+
+    return sorted(candidates, key=key, reverse=True)
+
+
+def rank_audio_formats(
+    formats: List[Dict[str, Any]], constraints: FormatConstraints
+) -> List[Dict[str, Any]]:
+    """Audio-only formats allowed by ``constraints``, best first.
+
+    The video's original-language track comes first, then the format that
+    merges into the chosen container, then bitrate (Opus before AAC at
+    equal bitrate). Dynamic-range-compressed ("-drc") variants rank below
+    the normal ones. Constraints that would leave nothing are dropped.
+    """
+    candidates = _audio_formats(formats)
+    if constraints.min_audio_kbps:
+        candidates = [
+            f for f in candidates
+            if (f.get("abr") or f.get("tbr") or 0) >= constraints.min_audio_kbps
+        ] or candidates
+    wanted_ext = _AUDIO_EXT_FOR.get(constraints.container)
+
+    def key(f: Dict[str, Any]):
+        return (
+            f.get("language_preference") or 0,
+            not str(f["format_id"]).endswith("-drc"),
+            f.get("ext") == wanted_ext if wanted_ext else True,
+            f.get("abr") or f.get("tbr") or 0,
+            codec_family(f.get("acodec")) == "opus",
+            f["format_id"],
+        )
+
+    return sorted(candidates, key=key, reverse=True)
+
+
+def choose_formats(
+    info: Dict[str, Any],
+    constraints: FormatConstraints,
+    video_id: Optional[str] = None,
+    audio_id: Optional[str] = None,
+) -> Optional[FormatChoice]:
+    """Pick the exact video + audio formats to download from ``info``.
+
+    Requested IDs that the video offers are kept. One it doesn't offer
+    (or "best") is replaced by the top-ranked format, capped at the
+    requested ID's resolution. Returns None when ``info`` lists no video
+    formats, leaving the choice to yt-dlp's selector.
+    """
+    formats = info.get("formats") or []
+    by_id = {str(f.get("format_id")): f for f in formats}
+
+    video = by_id.get(video_id or "")
+    if video is None or video not in _video_formats(formats):
+        height = VIDEO_ID_HEIGHTS.get(video_id or "")
+        if height and (not constraints.max_height or height < constraints.max_height):
+            constraints = constraints._replace(max_height=height)
+        ranked = rank_video_formats(formats, constraints)
+        if not ranked:
+            return None
+        video = ranked[0]
+
+    if codec_family(video.get("acodec")) != "none":
+        return FormatChoice(video, None)
+    audio = by_id.get(audio_id or "")
+    if audio is None or audio not in _audio_formats(formats):
+        ranked = rank_audio_formats(formats, constraints)
+        audio = ranked[0] if ranked else None
+    return FormatChoice(video, audio)
+
+
+def pick_formats(url: str, opts: dict, *, tag: str, job: int) -> None:
+    """Replace a video job's format IDs with exact ones the video offers.
+
+    The metadata goes into ``opts["info"]``, so the download reuses it
+    instead of extracting again, whether or not the cache is on.
+    If it can't be fetched, the job keeps its IDs and yt-dlp's
+    fallback selector decides (and reports the error).
+    """
+    try:
+        with TELEMETRY.timed("metadata", SETTINGS["engine"]):
+            info = extract_info(url, opts.get("cookies_path"))
+    except Exception as exc:
+        ui_append(tag, f"[#{job}] [format] Metadata unavailable, leaving the choice to yt-dlp: {exc}")
+        return
+    opts["info"] = info
+    requested = opts.get("video_id")
+    choice = choose_formats(
+        info, FormatConstraints.from_settings(), requested, opts.get("audio_id")
+    )
+    if choice is None:
+        return
+    if requested and requested not in ("best", choice.video_id):
+        ui_append(tag, f"[#{job}] [format] {requested} isn't offered for this video")
+    ui_append(tag, f"[#{job}] [format] Downloading {choice.describe()}")
+    opts["video_id"], opts["audio_id"] = choice.video_id, choice.audio_id
+
+
+def format_selector(
+    audio: bool, video_id: str | None = None, audio_id: str | None = None
+) -> str:
+    """Return the yt-dlp ``-f`` selector for a job."""
+    if audio:
+        return "bestaudio"
+    if video_id and video_id != "best":
+        if audio_id:
+            return f"{video_id}+{audio_id}/bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"
+        return f"{video_id}+bestaudio/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best"
+    return "bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"
+
+
+# Where yt-dlp puts the component streams of a merged download; a
+# component already there is reused instead of downloaded again
+STREAM_TEMPLATE = "%(title)s.f%(format_id)s.%(ext)s"
+
+
+def prefetch_streams(
+    url: str,
+    out: Path,
+    format_ids: List[str],
+    *,
+    cookies_path: str | None = None,
+    tag: str = "Job",
+    proc_ref: Optional["DownloadWorker"] = None,
+    job: int = 0,
+    connections: Optional[int] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> List[str]:
+    """Download the component streams of a merged format concurrently.
+
+    Each stream is saved where yt-dlp's merge step looks for it, so the
+    regular download that follows only has to merge them. Streams report
+    progress under the same job number, so the pair shows as one job.
+    A stream that fails here is fetched again by that regular run, unless
+    the failure is permanent (see :func:`classify_failure`): then its
+    error lines are returned and the regular run should be skipped.
+    """
+    prefix = f"[#{job}] " if job else ""
+    try:
+        info = info or extract_info(url, cookies_path)
+    except Exception as exc:
+        ui_append(tag, f"{prefix}⚠ Parallel stream fetch skipped: {exc}")
+        return []
+    available = {f.get("format_id") for f in info.get("formats") or []}
+    missing = [fid for fid in format_ids if fid not in available]
+    if missing:
+        # The format selector's fallbacks will pick something else
+        ui_append(tag, f"{prefix}⚠ Format(s) {', '.join(missing)} not offered; fetching streams in turn")
+        return []
+
+    ui_append(tag, f"{prefix}Fetching streams {' + '.join(format_ids)} in parallel")
+    errors: Dict[str, List[str]] = {fid: [] for fid in format_ids}
+    with ThreadPoolExecutor(max_workers=len(format_ids), thread_name_prefix=f"{tag}-{job}") as pool:
+        futures = {
+            fid: pool.submit(
+                run_download, url, out, cookies_path=cookies_path, tag=tag, proc_ref=proc_ref,
+                job=job, connections=connections, stream_format=fid, errors=errors[fid], info=info,
+            )
+            for fid in format_ids
+        }
+    if proc_ref and proc_ref.is_cancelled(job):
+        return []
+    for fid, future in futures.items():
+        try:
+            if future.result():
+                continue
+        except Exception as exc:
+            errors[fid].append(str(exc))
+        kind, reason = classify_failure(errors[fid])
+        if kind == "permanent":
+            return errors[fid]
+        ui_append(tag, f"{prefix}⚠ Stream {fid} failed ({reason}); the merge run fetches it again")
+    return []
+
+
+def run_download(
+    url: str,
+    out:  Path,
+    *,
+    audio:  bool = False,
+    audio_id: str | None = None,
+    video_id: str | None = None,
+    right_codec: str | None = None,
+    cookies_path: str | None = None,
+    tag: str = "Job",
+    proc_ref: Optional["DownloadWorker"] = None,
+    job: int = 0,
+    outputs: Optional[List[str]] = None,
+    connections: Optional[int] = None,
+    stream_format: Optional[str] = None,
+    transcode: bool = True,
+    errors: Optional[List[str]] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Build the yt-dlp command and run it.
+
+    Final file paths are appended to ``outputs`` when it is given, and
+    the reasons for a failure (yt-dlp's ``ERROR:`` lines, exceptions, a
+    non-zero exit code) to ``errors``.
+    ``connections`` overrides the download_connections setting for this job.
+    ``stream_format`` downloads just that one format, unmerged, to
+    ``STREAM_TEMPLATE`` (see :func:`prefetch_streams`).
+    ``transcode=False`` keeps audio in the format it was downloaded in;
+    the post-processing pipeline converts it afterwards.
+    ``info`` is metadata already extracted for ``url`` (see
+    :func:`pick_formats`); it is used instead of extracting again, even
+    with the metadata cache off.
+    """
+    connections = max(1, int(connections or SETTINGS["download_connections"]))
+    with BANDWIDTH.job((id(proc_ref), job)):
+        return _run_download(
+            url, out, audio=audio, audio_id=audio_id, video_id=video_id,
+            right_codec=right_codec, cookies_path=cookies_path, tag=tag,
+            proc_ref=proc_ref, job=job, outputs=outputs, connections=connections,
+            stream_format=stream_format, transcode=transcode, errors=errors, info=info,
+        )
+
+
+def _run_download(
+    url: str,
+    out: Path,
+    *,
+    audio: bool,
+    audio_id: str | None,
+    video_id: str | None,
+    right_codec: str | None,
+    cookies_path: str | None,
+    tag: str,
+    proc_ref: Optional["DownloadWorker"],
+    job: int,
+    outputs: Optional[List[str]],
+    connections: int,
+    stream_format: Optional[str],
+    transcode: bool,
+    errors: Optional[List[str]],
+    info: Optional[Dict[str, Any]],
+) -> bool:
+    prefix = f"[#{job}] " if job else ""
+    # Only in-process: with the executable, the pair costs two extra
+    # yt-dlp processes per job for a gain of about half a second
+    if (
+        not stream_format and not audio and audio_id and video_id and video_id != "best"
+        and SETTINGS["parallel_streams"] and SETTINGS["engine"] == "inprocess"
+    ):
+        permanent = prefetch_streams(
+            url, out, [video_id, audio_id], cookies_path=cookies_path, tag=tag,
+            proc_ref=proc_ref, job=job, connections=connections, info=info,
+        )
+        if proc_ref and proc_ref.is_cancelled(job):
+            return False
+        if permanent:
+            # Fetching the pair again would only fail the same way
+            ui_append(tag, f"{prefix}Skipping the merge run: {permanent[0]}")
+            if errors is not None:
+                errors.extend(permanent)
+            return False
+
+    if SETTINGS["engine"] == "inprocess":
+        return run_download_inprocess(
+            url, out, audio=audio, audio_id=audio_id, video_id=video_id,
+            right_codec=right_codec, cookies_path=cookies_path,
+            tag=tag, proc_ref=proc_ref, job=job, outputs=outputs,
+            connections=connections, stream_format=stream_format, transcode=transcode,
+            errors=errors, info=info,
+        )
+
+    out_tpl = str(out / (STREAM_TEMPLATE if stream_format else "%(title)s.%(ext)s"))
+    fmt = stream_format or format_selector(audio, video_id, audio_id)
+    try:
+        exe = ytdlp_exe()
+    except FileNotFoundError as exc:
+        ui_append(tag, f"{prefix}[EXCEPTION] {exc}")
+        if errors is not None:
+            errors.append(str(exc))
+        return False
+
+    if audio:
+        cmd = [
+            exe,
+            "--remote-components", "ejs: github",
+            "-f", fmt,
+        ]
+        if transcode:
+            cmd.extend([
+                "--extract-audio",
+                "--audio-format", right_codec or "mp3",
+                "--audio-quality", "0",
+            ])
+        cmd.extend(["--newline", "-o", out_tpl])
+    else:
+        # --merge-output-format has no effect on a single stream_format
+        cmd = [
+            exe,
+            "--remote-components", "ejs:github",
+            "-f", fmt,
+            "--merge-output-format", "mp4",
+            "--newline",
+            "-o", out_tpl,
+        ]
+
+    cmd.append("--continue")
+    rate_limit = BANDWIDTH.subprocess_limit()
+    if rate_limit:
+        cmd.extend(["--limit-rate", str(rate_limit)])
+    if connections > 1:
+        # The executable can only parallelise fragmented (DASH/HLS) formats;
+        # splitting single-file streams needs the in-process engine
+        cmd.extend(["-N", str(connections)])
+    cmd.extend(cookie_args(cookies_path))
+    for template in PROGRESS_TEMPLATES:
+        cmd.extend(["--progress-template", template])
+
+    # Reuse cached metadata when we have it, otherwise have yt-dlp dump
+    # the info JSON into a scratch folder so the next run can skip extraction
+    tmp_dir = tempfile.mkdtemp(prefix="kexis-")
+    outputs_file = Path(tmp_dir) / "outputs.txt"
+    cmd.extend(["--print-to-file", "after_move:filepath", str(outputs_file)])
+    info = info or cached_info(url)
+    if info:
+        cmd.extend(["--load-info-json", write_info_file(info, tmp_dir)])
+        ui_append(tag, f"{prefix}[cache] Reusing metadata for {url}")
+    else:
+        if cacheable_video_id(url):
+            cmd.extend(["--write-info-json", "-o", f"infojson:{tmp_dir}/%(id)s.%(ext)s"])
+        cmd.append(url)
+
+    ui_append(tag, f"{prefix}Running command:\n{' '.join(cmd)}\n")
+
+    child: List[ChildProcess] = []
+    clock = PhaseClock("subprocess")
+
+    def on_start(proc: ChildProcess) -> None:
+        child.append(proc)
+        if proc_ref:
+            proc_ref.attach(job, proc)
+
+    # Runs on PROCESS_LOOP; returning True stops yt-dlp
+    def on_line(line: str) -> bool:
+        clock.line(line)
+        event = parse_progress_line(job, line, tag)
+        if event:
+            clock.event(event)
+            ui_append("progress", event)
+            if event.phase != "postprocess":
+                ui_append(tag, prefix + event.describe())
+        else:
+            ui_append(tag, prefix + line)
+            if errors is not None and line.startswith("ERROR:"):
+                errors.append(line)
+        return bool(proc_ref and proc_ref.is_cancelled(job))
+
+    try:
+        returncode = PROCESS_LOOP.run(PROCESS_LOOP.stream(cmd, on_line, on_start))
+        ok = returncode == 0
+        if ok and outputs is not None and outputs_file.is_file():
+            outputs.extend(
+                ln for ln in outputs_file.read_text(encoding="utf-8").splitlines() if ln
+            )
+        if ok and not info:
+            for written in Path(tmp_dir).glob("*.info.json"):
+                try:
+                    remember_info(url, json.loads(written.read_text(encoding="utf-8")))
+                except (OSError, ValueError):
+                    pass
+        elif not ok and info:
+            forget_info(url)
+        if not ok and errors is not None:
+            errors.append(f"yt-dlp exited with code {returncode}")
+        return ok
+
+    except Exception as exc:
+        ui_append(tag, f"{prefix}[EXCEPTION] {exc}")
+        if errors is not None:
+            errors.append(str(exc))
+        return False
+    finally:
+        clock.stop()
+        if proc_ref and child:
+            proc_ref.detach(job, child[0])
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+# ----------------------------------------------------------------------
+# In-process engine
+# ----------------------------------------------------------------------
+class _QueueLogger:
+    """yt-dlp logger that forwards messages to the log queue."""
+
+    def __init__(self, tag: str, prefix: str = "", errors: Optional[List[str]] = None) -> None:
+        self.tag = tag
+        self.prefix = prefix
+        self.errors = errors
+
+    def debug(self, msg: str) -> None:
+        # yt-dlp routes regular screen output through debug() as well
+        if not msg.startswith("[debug] "):
+            ui_append(self.tag, self.prefix + msg)
+
+    def info(self, msg: str) -> None:
+        ui_append(self.tag, self.prefix + msg)
+
+    def warning(self, msg: str) -> None:
+        ui_append(self.tag, f"{self.prefix}WARNING: {msg}")
+
+    def error(self, msg: str) -> None:
+        ui_append(self.tag, self.prefix + msg)
+        if self.errors is not None:
+            self.errors.append(msg)
+
+
+def ydl_base_options(cookies_path: str | None = None) -> Dict[str, Any]:
+    """Options shared by every in-process ``YoutubeDL`` instance."""
+    opts: Dict[str, Any] = {
+        "quiet": True,
+        "noprogress": True,
+        "no_color": True,
+        "remote_components": ["ejs:github"],
+    }
+    if cookies_path:
+        cp = Path(cookies_path).expanduser()
+        if cp.is_file():
+            opts["cookiefile"] = str(cp)
+        else:
+            opts["cookiesfrombrowser"] = ("chrome",)
+    return opts
+
+
+def run_download_inprocess(
+    url: str,
+    out: Path,
+    *,
+    audio: bool = False,
+    audio_id: str | None = None,
+    video_id: str | None = None,
+    right_codec: str | None = None,
+    cookies_path: str | None = None,
+    tag: str = "Job",
+    proc_ref: Optional["DownloadWorker"] = None,
+    job: int = 0,
+    outputs: Optional[List[str]] = None,
+    connections: int = 1,
+    stream_format: Optional[str] = None,
+    transcode: bool = True,
+    errors: Optional[List[str]] = None,
+    info: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """Download ``url`` with ``yt_dlp.YoutubeDL`` in the calling thread.
+
+    Same contract as :func:`run_download`, but progress comes from
+    yt-dlp's progress hooks and no interpreter is spawned per URL.
+    Cancellation is checked on every progress callback. With more than
+    one connection, single-file streams are split into byte ranges (see
+    kexis_segmented) and fragmented ones fetch fragments concurrently.
+    """
+    import yt_dlp
+
+    ydl_class = yt_dlp.YoutubeDL
+    if connections > 1:
+        from kexis_segmented import SegmentedYoutubeDL as ydl_class
+
+    prefix = f"[#{job}] " if job else ""
+    cancelled = (lambda: proc_ref.is_cancelled(job)) if proc_ref else (lambda: False)
+    governor_key = (id(proc_ref), job)
+    received: Dict[str, int] = {}
+
+    def throttle(nbytes: int) -> None:
+        BANDWIDTH.throttle(governor_key, nbytes, cancelled)
+
+    def on_progress(d: Dict[str, Any]) -> None:
+        if cancelled():
+            raise yt_dlp.utils.DownloadCancelled("Cancelled by user")
+        if d.get("status") == "downloading" and not d.get("throttled"):
+            name = d.get("tmpfilename") or d.get("filename") or ""
+            done = d.get("downloaded_bytes") or 0
+            previous = received.get(name, 0)
+            received[name] = done
+            throttle(done - previous if done >= previous else done)
+        event = ProgressEvent.from_hook(
+            job, d, (d.get("info_dict") or {}).get("format_id", ""), tag
+        )
+        clock.event(event)
+        ui_append("progress", event)
+        if event.phase != "postprocess":
+            ui_append(tag, prefix + event.describe())
+
+    opts = ydl_base_options(cookies_path)
+    opts.update(
+        format=stream_format or format_selector(audio, video_id, audio_id),
+        outtmpl=str(out / (STREAM_TEMPLATE if stream_format else "%(title)s.%(ext)s")),
+        logger=_QueueLogger(tag, prefix, errors),
+        progress_hooks=[on_progress],
+        postprocessor_hooks=[on_progress],
+        continuedl=True,
+        concurrent_fragment_downloads=connections,
+        segmented_connections=connections,
+        bandwidth_throttle=throttle,
+    )
+    if outputs is not None:
+        opts["post_hooks"] = [outputs.append]
+    if audio:
+        if transcode:
+            opts["postprocessors"] = [{
+                "key": "FFmpegExtractAudio",
+                "preferredcodec": right_codec or "mp3",
+                "preferredquality": "0",
+            }]
+    else:
+        opts["merge_output_format"] = "mp4"
+
+    ui_append(tag, f"{prefix}Running in-process: {url}\n")
+    info = info or cached_info(url)
+    tmp_dir = tempfile.mkdtemp(prefix="kexis-")
+    clock = PhaseClock("inprocess", first="extract")
+    try:
+        with ydl_class(opts) as ydl:
+            if info:
+                ui_append(tag, f"{prefix}[cache] Reusing metadata for {url}")
+                return ydl.download_with_info_file(write_info_file(info, tmp_dir)) == 0
+            result = ydl.extract_info(url, download=True)
+            if result:
+                remember_info(url, ydl.sanitize_info(result))
+            return True
+    except yt_dlp.utils.DownloadCancelled:
+        return False
+    except Exception as exc:
+        if info:
+            forget_info(url)
+        ui_append(tag, f"{prefix}[EXCEPTION] {exc}")
+        if errors is not None:
+            errors.append(str(exc))
+        return False
+    finally:
+        clock.stop()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def extract_info(url: str, cookies_path: str | None = None) -> Dict[str, Any]:
+    """Return yt-dlp's info dict for ``url``, from the cache when possible."""
+    info = cached_info(url)
+    if info:
+        return info
+    if SETTINGS["engine"] != "inprocess":
+        return PROCESS_LOOP.run(extract_info_async(url, cookies_path))
+
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(ydl_base_options(cookies_path)) as ydl:
+        info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+    remember_info(url, info)
+    return info
+
+
+async def extract_info_async(url: str, cookies_path: str | None = None) -> Dict[str, Any]:
+    """:func:`extract_info` as a coroutine for PROCESS_LOOP.
+
+    With the subprocess engine no thread waits on yt-dlp; the yt_dlp
+    module blocks, so the in-process engine runs in the loop's executor.
+    """
+    info = cached_info(url)
+    if info:
+        return info
+    if SETTINGS["engine"] == "inprocess":
+        import asyncio
+
+        return await asyncio.get_running_loop().run_in_executor(None, extract_info, url, cookies_path)
+
+    cmd = [ytdlp_exe(), "--remote-components", "ejs:github", "-J", *cookie_args(cookies_path), url]
+    info = await ytdlp_json(cmd)
+    remember_info(url, info)
+    return info
+
+
+# ----------------------------------------------------------------------
+# Format table
+# ----------------------------------------------------------------------
+class FormatRow(NamedTuple):
+    """One entry of a video's format list, as the Format Checker shows it."""
+
+    format_id: str
+    ext: str
+    kind: str                           # "video", "audio" or "video+audio"
+    resolution: str                     # "3840x2160" or "audio only"
+    height: int
+    fps: float
+    vcodec: str                         # codec family, see codec_family()
+    acodec: str
+    abr: float                          # audio kbps, 0 if unknown / none
+    tbr: float                          # total kbps
+    size: Optional[int]                 # bytes, exact or estimated
+    protocol: str
+    note: str
+
+    @classmethod
+    def from_format(cls, f: Dict[str, Any], duration: Optional[float] = None) -> "FormatRow":
+        vcodec, acodec = codec_family(f.get("vcodec")), codec_family(f.get("acodec"))
+        kind = "video+audio" if vcodec != "none" and acodec != "none" else (
+            "video" if vcodec != "none" else "audio"
+        )
+        tbr = float(f.get("tbr") or 0)
+        size = f.get("filesize") or f.get("filesize_approx")
+        if not size and tbr and duration:
+            size = int(tbr * 125 * duration)  # kbit/s -> bytes
+        return cls(
+            format_id=str(f.get("format_id")),
+            ext=f.get("ext") or "",
+            kind=kind,
+            resolution=(
+                f"{f.get('width') or '?'}x{f['height']}" if f.get("height") else
+                "audio only" if kind == "audio" else (f.get("resolution") or "")
+            ),
+            height=int(f.get("height") or 0),
+            fps=float(f.get("fps") or 0),
+            vcodec=vcodec,
+            acodec=acodec,
+            abr=float(f.get("abr") or (tbr if kind == "audio" else 0)),
+            tbr=tbr,
+            size=int(size) if size else None,
+            protocol=f.get("protocol") or "",
+            note=f.get("format_note") or "",
+        )
+
+
+# (FormatRow field, heading) in display order; any of them can be sorted on
+FORMAT_COLUMNS = (
+    ("format_id", "ID"), ("ext", "EXT"), ("resolution", "RESOLUTION"), ("fps", "FPS"),
+    ("vcodec", "VCODEC"), ("acodec", "ACODEC"), ("abr", "ABR"), ("tbr", "TBR"),
+    ("size", "SIZE"), ("protocol", "PROTO"), ("note", "NOTE"),
+)
+FORMAT_FILTERS: Dict[str, Any] = {
+    "all": lambda r: True,
+    "audio": lambda r: r.kind == "audio",
+    "high_audio": lambda r: r.kind == "audio" and r.abr >= 256,
+    "highest_audio": lambda r: r.kind == "audio" and r.abr >= 480,
+    "video": lambda r: r.kind != "audio",
+}
+
+
+class FormatTable:
+    """A video's formats, parsed once from the info JSON.
+
+    Filtering and sorting work on the parsed rows, so changing the view
+    never re-fetches or re-parses anything.
+    """
+
+    def __init__(self, info: Dict[str, Any]) -> None:
+        self.video_id = info.get("id") or ""
+        self.title = info.get("title") or ""
+        self.info = info
+        self.rows = [
+            FormatRow.from_format(f, info.get("duration"))
+            for f in info.get("formats") or []
+            if codec_family(f.get("vcodec")) != "none" or codec_family(f.get("acodec")) != "none"
+        ]
+        self.by_id = {row.format_id: row for row in self.rows}
+
+    def view(
+        self, filter_name: str = "all", sort_by: Optional[str] = None, descending: bool = False
+    ) -> List[FormatRow]:
+        """Rows passing ``filter_name`` (see FORMAT_FILTERS), sorted by a column.
+
+        Unsorted views keep yt-dlp's order (worst to best). Rows without a
+        value for the column sort last either way.
+        """
+        rows = [r for r in self.rows if FORMAT_FILTERS[filter_name](r)]
+        if not sort_by:
+            return rows
+        present = [r for r in rows if getattr(r, sort_by) not in (None, "", 0)]
+        missing = [r for r in rows if getattr(r, sort_by) in (None, "", 0)]
+
+        def key(r: FormatRow):
+            if sort_by == "resolution":
+                return (r.height, r.fps, r.format_id)
+            return (getattr(r, sort_by), r.format_id)
+
+        return sorted(present, key=key, reverse=descending) + missing
+
+    def best_audio(self, rows: Optional[List[FormatRow]] = None) -> Optional[FormatRow]:
+        """Highest-bitrate audio-only row among ``rows`` (default: all)."""
+        audio = [r for r in (self.rows if rows is None else rows) if r.kind == "audio"]
+        return max(audio, key=lambda r: (r.abr, r.format_id), default=None)
+
+
+# ----------------------------------------------------------------------
+# Playlist / channel expansion
+# ----------------------------------------------------------------------
+# Collections are flat-extracted this many at a time
+EXPAND_WORKERS = 4
+# A bare channel URL lists its tabs (Videos, Shorts, Live), each of which
+# is a playlist of its own; don't follow links any deeper than that
+EXPAND_MAX_DEPTH = 2
+# Placeholder titles YouTube uses for entries that can't be downloaded
+_UNAVAILABLE_TITLES = ("[Private video]", "[Deleted video]")
+
+
+def is_collection_url(url: str) -> bool:
+    """True for playlist, channel and other multi-video URLs."""
+    return cacheable_video_id(url) is None
+
+
+def flat_extract(url: str, cookies_path: str | None = None) -> Dict[str, Any]:
+    """Return the flat info dict of a collection: its entries, unresolved."""
+    if SETTINGS["engine"] == "inprocess":
+        import yt_dlp
+
+        opts = {**ydl_base_options(cookies_path), "extract_flat": "in_playlist"}
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+    cmd = [
+        ytdlp_exe(), "--remote-components", "ejs:github",
+        "--flat-playlist", "-J", *cookie_args(cookies_path), url,
+    ]
+    return PROCESS_LOOP.run(ytdlp_json(cmd))
+
+
+def _entry_url(entry: Dict[str, Any]) -> Optional[str]:
+    """Return a downloadable URL for a flat playlist entry."""
+    url = entry.get("url") or entry.get("webpage_url")
+    if entry.get("ie_key") == "Youtube" and entry.get("id"):
+        # Shorts and other variants all download the same way
+        return f"https://www.youtube.com/watch?v={entry['id']}"
+    return url
+
+
+def expand_jobs(
+    jobs: List[Tuple[str, dict]],
+    tag: str,
+    cancelled=lambda: False,
+) -> List[Tuple[str, dict]]:
+    """Replace collection jobs with one job per video and drop duplicates.
+
+    Collections are flat-extracted concurrently, level by level (a
+    channel's tabs are fetched together once the channel has listed
+    them). Each video inherits the options of the job it came from and
+    keeps the position of that job in the queue. A collection that fails
+    to expand is kept as a single job so yt-dlp can report the error.
+    """
+    # collection URL -> its entries, or None when listing it failed
+    expanded: Dict[str, Optional[List[str]]] = {}
+    pending = list(dict.fromkeys(url for url, _ in jobs if is_collection_url(url)))
+    cookies = {url: opts.get("cookies_path") for url, opts in jobs}
+
+    with ThreadPoolExecutor(max_workers=EXPAND_WORKERS, thread_name_prefix="expand") as pool:
+        for depth in range(EXPAND_MAX_DEPTH):
+            if not pending or cancelled():
+                break
+            futures = {
+                url: pool.submit(flat_extract, url, cookies.get(url)) for url in pending
+            }
+            pending = []
+            for url, future in futures.items():
+                try:
+                    info = future.result()
+                except Exception as exc:  # includes yt_dlp's DownloadError
+                    ui_append(tag, f"[expand] ⚠ Could not list {url}: {exc}")
+                    expanded[url] = None
+                    continue
+                children: List[str] = []
+                skipped = 0
+                for entry in (info or {}).get("entries") or []:
+                    if not entry or entry.get("title") in _UNAVAILABLE_TITLES:
+                        skipped += 1
+                        continue
+                    child = _entry_url(entry)
+                    if not child:
+                        skipped += 1
+                        continue
+                    children.append(child)
+                    if is_collection_url(child) and child not in expanded and depth + 1 < EXPAND_MAX_DEPTH:
+                        cookies[child] = cookies.get(url)
+                        pending.append(child)
+                expanded[url] = children
+                title = (info or {}).get("title") or url
+                note = f" ({skipped} unavailable skipped)" if skipped else ""
+                ui_append(tag, f"[expand] 📃 {title}: {len(children)} item(s){note}")
+
+    def flatten(url: str, seen: Tuple[str, ...] = ()) -> List[str]:
+        children = expanded.get(url)
+        if children is None or url in seen:
+            return [url]
+        out: List[str] = []
+        for child in children:
+            out.extend(flatten(child, seen + (url,)))
+        return out
+
+    result: List[Tuple[str, dict]] = []
+    keys = set()
+    duplicates = 0
+    for url, opts in jobs:
+        for video_url in flatten(url):
+            key = (str(opts.get("out")), archive_key(video_url, opts) or video_url)
+            if key in keys:
+                duplicates += 1
+                continue
+            keys.add(key)
+            result.append((video_url, opts))
+    if duplicates:
+        ui_append(tag, f"[expand] ⏭ Skipped {duplicates} duplicate(s)")
+    return result
+
+
+# ----------------------------------------------------------------------
+# Download archive
+# ----------------------------------------------------------------------
+# Output extension -> codec, used when seeding the archive from disk
+_EXT_CODECS = {
+    "mp4": "mp4", "mp3": "mp3", "flac": "flac", "wav": "wav",
+    "m4a": "m4a", "opus": "opus", "ogg": "ogg",
+}
+_BRACKET_ID_RE = re.compile(r"\[([0-9A-Za-z_-]{11})\]")
+
+# Format wildcard for entries seeded from disk, whose format is unknown
+ANY_FORMAT = "*"
+
+
+def archive_key(url: str, opts: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """Return the (video ID, format, codec) tuple a job would produce."""
+    vid = cacheable_video_id(url)
+    if not vid:
+        return None
+    if opts.get("audio"):
+        return vid, "bestaudio", opts.get("right_codec") or "mp3"
+    video_id = opts.get("video_id")
+    if video_id and video_id != "best":
+        return vid, f"{video_id}+{opts.get('audio_id') or 'bestaudio'}", "mp4"
+    return vid, "best", "mp4"
+
+
+class DownloadArchive:
+    """SQLite index of completed (video ID, format, codec) downloads.
+
+    An entry only counts while the file it points at still exists, so
+    deleting a download from disk makes it eligible again.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS archive ("
+                " video_id TEXT NOT NULL, format TEXT NOT NULL, codec TEXT NOT NULL,"
+                " path TEXT NOT NULL, completed REAL NOT NULL,"
+                " PRIMARY KEY (video_id, format, codec))"
+            )
+        return self._conn
+
+    def contains(self, key: Tuple[str, str, str]) -> Optional[str]:
+        """Return the archived file path for ``key``, or None."""
+        vid, fmt, codec = key
+        with self._lock:
+            db = self._db()
+            rows = db.execute(
+                "SELECT format, path FROM archive"
+                " WHERE video_id = ? AND codec = ? AND format IN (?, ?)",
+                (vid, codec, fmt, ANY_FORMAT),
+            ).fetchall()
+            for row_fmt, path in rows:
+                if path and Path(path).exists():
+                    return path
+                db.execute(
+                    "DELETE FROM archive WHERE video_id = ? AND format = ? AND codec = ?",
+                    (vid, row_fmt, codec),
+                )
+            db.commit()
+        return None
+
+    def add(self, key: Tuple[str, str, str], path: str) -> None:
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO archive VALUES (?, ?, ?, ?, ?)",
+                (*key, path, time.time()),
+            )
+            self._db().commit()
+
+    def seed_from_folder(self, folder: Path) -> int:
+        """Add media files found in ``folder`` to the archive.
+
+        The video ID comes from a ``[id]`` in the file name, a sidecar
+        ``.info.json``, or a title match against the metadata cache.
+        Returns the number of files indexed.
+        """
+        titles = _cached_titles()
+        added = 0
+        for entry in folder.iterdir() if folder.is_dir() else ():
+            codec = _EXT_CODECS.get(entry.suffix.lower().lstrip("."))
+            if not codec or not entry.is_file():
+                continue
+            vid = None
+            m = _BRACKET_ID_RE.search(entry.stem)
+            if m:
+                vid = m.group(1)
+            else:
+                sidecar = entry.with_suffix(".info.json")
+                try:
+                    vid = json.loads(sidecar.read_text(encoding="utf-8")).get("id")
+                except (OSError, ValueError):
+                    vid = titles.get(entry.stem)
+            if vid:
+                self.add((vid, ANY_FORMAT, codec), str(entry))
+                added += 1
+        return added
+
+
+def _cached_titles() -> Dict[str, str]:
+    """Map output-file stems to video IDs for everything in the metadata cache."""
+    import yt_dlp
+
+    try:
+        titles = METADATA_CACHE.titles()
+    except sqlite3.Error:
+        return {}
+    return {yt_dlp.utils.sanitize_filename(t): vid for t, vid in titles.items()}
+
+
+DOWNLOAD_ARCHIVE = DownloadArchive(user_config_dir() / "archive.sqlite")
+
+
+def seed_archive(folders: List[Path], tag: str = "VIDEO") -> None:
+    """Scan ``folders`` into the archive and log how many files were found."""
+    for folder in folders:
+        try:
+            count = DOWNLOAD_ARCHIVE.seed_from_folder(folder)
+        except (OSError, sqlite3.Error) as exc:
+            ui_append(tag, f"[archive] ⚠ Scan of {folder} failed: {exc}")
+            continue
+        ui_append(tag, f"[archive] 📚 Indexed {count} file(s) from {folder}")
+
+
+# ----------------------------------------------------------------------
+# Persistent job queue
+# ----------------------------------------------------------------------
+JOB_STATES = ("queued", "running", "done", "failed", "cancelled")
+
+
+class JobStore:
+    """Durable record of every queued job and its state.
+
+    Jobs still ``queued`` or ``running`` when the app exits (or crashes)
+    are offered for resumption on the next launch; yt-dlp's ``--continue``
+    then picks up any ``.part`` files they left behind.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, tag TEXT NOT NULL,"
+                " url TEXT NOT NULL, opts TEXT NOT NULL, state TEXT NOT NULL,"
+                " updated REAL NOT NULL)"
+            )
+        return self._conn
+
+    @staticmethod
+    def _encode(opts: Dict[str, Any]) -> str:
+        return json.dumps({k: str(v) if isinstance(v, Path) else v for k, v in opts.items()})
+
+    @staticmethod
+    def _decode(text: str) -> Dict[str, Any]:
+        opts = json.loads(text)
+        if "out" in opts:
+            opts["out"] = Path(opts["out"])
+        return opts
+
+    def add(self, tag: str, jobs: List[Tuple[str, dict]]) -> List[int]:
+        """Record ``jobs`` as queued and return their store IDs."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            ids = [
+                db.execute(
+                    "INSERT INTO jobs (tag, url, opts, state, updated) VALUES (?, ?, ?, 'queued', ?)",
+                    (tag, url, self._encode(opts), now),
+                ).lastrowid
+                for url, opts in jobs
+            ]
+            db.commit()
+        return ids
+
+    def replace(self, job_ids: List[int], tag: str, jobs: List[Tuple[str, dict]]) -> List[int]:
+        """Swap the rows ``job_ids`` for ``jobs`` in one transaction."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(i,) for i in job_ids])
+            ids = [
+                db.execute(
+                    "INSERT INTO jobs (tag, url, opts, state, updated) VALUES (?, ?, ?, 'queued', ?)",
+                    (tag, url, self._encode(opts), now),
+                ).lastrowid
+                for url, opts in jobs
+            ]
+            db.commit()
+        return ids
+
+    def set_state(self, job_id: int, state: str) -> None:
+        with self._lock:
+            self._db().execute(
+                "UPDATE jobs SET state = ?, updated = ? WHERE id = ?",
+                (state, time.time(), job_id),
+            )
+            self._db().commit()
+
+    def states(self, job_ids: List[int]) -> Dict[int, str]:
+        """Return the current state of each of ``job_ids`` that exists."""
+        found: Dict[int, str] = {}
+        with self._lock:
+            # Stay under SQLite's limit on bound parameters
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i:i + 500]
+                found.update(self._db().execute(
+                    f"SELECT id, state FROM jobs WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return found
+
+    def pending(self) -> Dict[str, List[Tuple[int, str, dict]]]:
+        """Return unfinished jobs grouped by tag, in queue order."""
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT id, tag, url, opts FROM jobs"
+                " WHERE state IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+        grouped: Dict[str, List[Tuple[int, str, dict]]] = {}
+        for job_id, tag, url, opts in rows:
+            grouped.setdefault(tag, []).append((job_id, url, self._decode(opts)))
+        return grouped
+
+    def discard_pending(self) -> None:
+        """Mark every unfinished job as cancelled."""
+        with self._lock:
+            self._db().execute(
+                "UPDATE jobs SET state = 'cancelled', updated = ?"
+                " WHERE state IN ('queued', 'running')",
+                (time.time(),),
+            )
+            self._db().commit()
+
+    def prune(self, max_age_s: float = 30 * 86400) -> None:
+        """Forget finished jobs older than ``max_age_s``."""
+        with self._lock:
+            self._db().execute(
+                "DELETE FROM jobs WHERE state IN ('done', 'failed', 'cancelled')"
+                " AND updated < ?",
+                (time.time() - max_age_s,),
+            )
+            self._db().commit()
+
+
+JOB_STORE = JobStore(user_config_dir() / "jobs.sqlite")
+
+
+# ----------------------------------------------------------------------
+# Post-processing pipeline
+# ----------------------------------------------------------------------
+# AUDIO_CODECS_RIGHT names that yt-dlp's codec table calls something else
+_ACODEC_NAMES = {"ogg": "vorbis"}
+# Encoder options equivalent to yt-dlp's --audio-quality 0 (best VBR)
+_BEST_QUALITY_ARGS = {
+    "libmp3lame": ["-q:a", "0"],
+    "libvorbis": ["-q:a", "10"],
+    "aac": ["-q:a", "4"],
+}
+
+
+def _transcode_plan(
+    source: Path, source_codec: Optional[str], codecs: List[str]
+) -> Tuple[List[str], List[Tuple[str, List[str]]]]:
+    """Plan :func:`transcode_audio`'s single ffmpeg run.
+
+    Returns the output paths in ``codecs`` order, and the (output path,
+    ffmpeg options) pairs to write; a target that already is ``source``
+    is in the first list only.
+    """
+    from yt_dlp.postprocessor.ffmpeg import ACODECS
+
+    # Codecs named after their extension (m4a, flac, ...) get the plain
+    # file name; the others (alac) get "<title>.<codec>.<ext>" on a clash
+    targets: Dict[str, Path] = {}
+    for codec in sorted(codecs, key=lambda c: ACODECS[_ACODEC_NAMES.get(c, c)][0] != c):
+        ext = ACODECS[_ACODEC_NAMES.get(codec, codec)][0]
+        target = source.with_suffix(f".{ext}")
+        if target in targets.values():
+            target = source.with_suffix(f".{codec}.{ext}")
+        targets[codec] = target
+
+    results: List[str] = []
+    outputs: List[Tuple[str, List[str]]] = []
+    for codec in codecs:
+        name = _ACODEC_NAMES.get(codec, codec)
+        _, encoder, extra_opts = ACODECS[name]
+        target = targets[codec]
+        if source_codec == name or (source_codec == "aac" and name == "m4a"):
+            if target == source:
+                results.append(str(source))
+                continue
+            opts = ["-vn", "-acodec", "copy"]
+            if source_codec == "aac":
+                opts += ["-bsf:a", "aac_adtstoasc"]
+        elif encoder:
+            opts = ["-vn", "-acodec", encoder, *_BEST_QUALITY_ARGS.get(encoder, [])]
+        else:
+            opts = ["-vn", *extra_opts]
+        results.append(str(target))
+        outputs.append((str(target), opts))
+    return results, outputs
+
+
+def transcode_audio(path: str, codecs: List[str]) -> List[str]:
+    """Convert a downloaded audio file to every codec in ``codecs``.
+
+    Returns the output paths in ``codecs`` order. One ffmpeg run decodes
+    the source once and encodes all targets from it; a target in the
+    source's own codec is stream-copied. Outputs sharing an extension
+    (ALAC and M4A) get the codec in the name. The source is removed
+    afterwards unless it already is one of the outputs. Runs in a pool
+    process (or inline when the pipeline is off).
+    """
+    from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+
+    ffmpeg = FFmpegPostProcessor()
+    source = Path(path)
+    results, outputs = _transcode_plan(source, ffmpeg.get_audio_codec(path), codecs)
+    # A target that is the source itself and needs no ffmpeg run
+    keep_source = str(source) in results and all(Path(out) != source for out, _ in outputs)
+
+    if not outputs:
+        return results
+    source_in = source
+    if any(Path(out) == source for out, _ in outputs):
+        source_in = source.with_suffix(f".orig{source.suffix}")
+        os.replace(source, source_in)
+    try:
+        ffmpeg.real_run_ffmpeg([(str(source_in), [])], outputs)
+    except Exception:
+        if source_in != source:
+            os.replace(source_in, source)
+        raise
+    if not keep_source:
+        source_in.unlink(missing_ok=True)
+    return results
+
+
+class PostProcessPool:
+    """CPU stage of the download pipeline.
+
+    Finished downloads are handed over with :meth:`submit` and converted
+    in a process pool sized to the CPU count, while the download slot
+    they held goes to the next job. At most two tasks per process wait
+    or run at once: when conversion falls behind, ``submit`` blocks and
+    downloads pause instead of piling up unconverted files.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[threading.Semaphore] = None
+
+    @property
+    def available(self) -> bool:
+        # Conversion runs yt-dlp's postprocessor in the pool processes
+        return importlib.util.find_spec("yt_dlp") is not None
+
+    @property
+    def workers(self) -> int:
+        return SETTINGS["postprocess_workers"] or os.cpu_count() or 2
+
+    def _executor(self) -> Tuple[ProcessPoolExecutor, threading.Semaphore]:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that runs Tk and download threads is unsafe
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._slots = threading.Semaphore(self.workers * 2)
+            return self._pool, self._slots
+
+    def submit(self, fn, *args, cancelled=lambda: False) -> Optional[Future]:
+        """Queue ``fn(*args)``, blocking while the pipeline is full.
+
+        Returns None if ``cancelled()`` becomes true while waiting.
+        """
+        pool, slots = self._executor()
+        while not slots.acquire(timeout=0.2):
+            if cancelled():
+                return None
+        try:
+            future = pool.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+POSTPROCESS_POOL = PostProcessPool()
+
+
+# ----------------------------------------------------------------------
+# Concurrency limits
+# ----------------------------------------------------------------------
+class JobLimiter:
+    """Counting gate whose limit can be changed while jobs are running."""
+
+    def __init__(self, limit: int) -> None:
+        self._limit = max(1, int(limit))
+        self._active = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def set_limit(self, limit: int) -> None:
+        """Change the limit; waiting jobs pick up the new value immediately."""
+        with self._cond:
+            self._limit = max(1, int(limit))
+            self._cond.notify_all()
+
+    def acquire(self, cancelled=lambda: False) -> bool:
+        """Wait for a free slot. Returns False if ``cancelled()`` became true."""
+        with self._cond:
+            while self._active >= self._limit:
+                if cancelled():
+                    return False
+                self._cond.wait(0.2)
+            if cancelled():
+                return False
+            self._active += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify()
+
+
+# Shared by every DownloadWorker, so VIDEO + AUDIO together never exceed it
+GLOBAL_LIMITER = JobLimiter(SETTINGS["max_concurrent_jobs"])
+
+
+def tab_concurrency(tag: str) -> int:
+    """Return the configured per-tab job limit."""
+    return max(1, int(SETTINGS["tab_concurrency"].get(tag, 1)))
+
+
+# ----------------------------------------------------------------------
+# Bandwidth governor
+# ----------------------------------------------------------------------
+# Seconds of traffic a bucket may save up while its downloads are idle
+BUCKET_BURST_S = 1.0
+# Longest single sleep, so cancellation and limit changes apply quickly
+THROTTLE_SLICE_S = 0.25
+# Offered in Preferences; bytes per second, 0 = unlimited
+RATE_CHOICES = [0, 256 << 10, 512 << 10, 1 << 20, 2 << 20, 5 << 20, 10 << 20, 25 << 20, 50 << 20]
+
+_RATE_RE = re.compile(r"([\d.]+)\s*([KMG]?)i?B?(?:/s)?", re.IGNORECASE)
+
+
+def parse_rate(text: str) -> int:
+    """Parse ``500K`` / ``2M`` / ``1.5G`` (bytes per second); 0 means unlimited."""
+    m = _RATE_RE.fullmatch(text.strip())
+    if not m:
+        raise ValueError(f"invalid rate: {text!r}")
+    return int(float(m.group(1)) * {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}[m.group(2).upper()])
+
+
+def format_rate(rate: int) -> str:
+    return f"{format_bytes(rate)}/s" if rate else "Unlimited"
+
+
+def in_full_speed_hours(now: Optional[datetime] = None) -> bool:
+    """True while the bandwidth schedule lifts the limits."""
+    if not SETTINGS["bandwidth_schedule"]:
+        return False
+    hour = (now or datetime.now()).hour
+    start, end = int(SETTINGS["full_speed_from"]), int(SETTINGS["full_speed_until"])
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # window spans midnight
+
+
+class TokenBucket:
+    """Byte budget refilled at ``rate`` bytes per second (0 = unlimited).
+
+    Downloads book each block after it arrives with :meth:`take`, which
+    may leave the bucket in debt, then wait while :meth:`debt_seconds` is
+    positive. A rate change affects the waiting downloads immediately.
+    """
+
+    def __init__(self, rate: float = 0.0) -> None:
+        self._lock = threading.Lock()
+        self._rate = float(rate)
+        self._tokens = self._rate * BUCKET_BURST_S
+        self._stamp = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            self._refill()
+            self._rate = float(rate)
+            self._tokens = min(self._tokens, self._rate * BUCKET_BURST_S)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate:
+            self._tokens = min(
+                self._tokens + (now - self._stamp) * self._rate, self._rate * BUCKET_BURST_S
+            )
+        self._stamp = now
+
+    def take(self, nbytes: int) -> None:
+        with self._lock:
+            if self._rate:
+                self._refill()
+                self._tokens -= nbytes
+
+    def debt_seconds(self) -> float:
+        with self._lock:
+            if not self._rate:
+                return 0.0
+            self._refill()
+            return max(0.0, -self._tokens / self._rate)
+
+
+class BandwidthGovernor:
+    """Global and per-job download rate limits, read live from SETTINGS.
+
+    The in-process engine reports every block it receives to
+    :meth:`throttle`, which holds the download while the global or the
+    job's bucket is in debt, so a new limit (or the schedule switching to
+    full speed) applies to running downloads within a fraction of a
+    second. The yt-dlp executable can't be slowed from outside; it gets
+    ``--limit-rate`` for its share of the limits when it starts (see
+    :meth:`subprocess_limit`), so with that engine the global limit is
+    approximate and changes don't reach processes already running.
+    """
+
+    def __init__(self) -> None:
+        self._global = TokenBucket()
+        self._jobs: Dict[Any, TokenBucket] = {}
+        self._users: Dict[Any, int] = {}
+        self._lock = threading.Lock()
+        self._refreshed = 0.0
+        self.refresh()
+
+    def limits(self) -> Tuple[int, int]:
+        """Current (global, per-job) limits in bytes/s; 0 = unlimited."""
+        if in_full_speed_hours():
+            return 0, 0
+        return int(SETTINGS["bandwidth_limit"] or 0), int(SETTINGS["job_bandwidth_limit"] or 0)
+
+    def refresh(self) -> None:
+        """Apply the current settings and schedule to every bucket."""
+        total, per_job = self.limits()
+        self._global.set_rate(total)
+        with self._lock:
+            buckets = list(self._jobs.values())
+            self._refreshed = time.monotonic()
+        for bucket in buckets:
+            bucket.set_rate(per_job)
+
+    @contextmanager
+    def job(self, key: Any):
+        """Register a running download; streams of one job share ``key``."""
+        with self._lock:
+            if key not in self._jobs:
+                self._jobs[key] = TokenBucket(self.limits()[1])
+            self._users[key] = self._users.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key], self._jobs[key]
+
+    def throttle(self, key: Any, nbytes: int, cancelled=lambda: False) -> None:
+        """Book ``nbytes`` for ``key`` and wait until both budgets allow more."""
+        if time.monotonic() - self._refreshed > 1.0:
+            self.refresh()  # picks up the schedule as the clock moves on
+        with self._lock:
+            bucket = self._jobs.get(key)
+        buckets = [self._global] + ([bucket] if bucket else [])
+        for b in buckets:
+            b.take(nbytes)
+        while not cancelled():
+            delay = max(b.debt_seconds() for b in buckets)
+            if delay <= 0:
+                break
+            time.sleep(min(delay, THROTTLE_SLICE_S))
+
+    def subprocess_limit(self) -> int:
+        """``--limit-rate`` for one more yt-dlp process; 0 = none.
+
+        Call it inside :meth:`job`: the global limit is split evenly
+        between the jobs holding a download slot at that moment. Jobs
+        that started earlier keep their larger share, so the total can
+        exceed the limit until they finish.
+        """
+        total, per_job = self.limits()
+        with self._lock:
+            running = max(1, len(self._jobs), GLOBAL_LIMITER.active)
+        share = total // running if total else 0
+        return min(r for r in (share, per_job) if r) if share or per_job else 0
+
+
+BANDWIDTH = BandwidthGovernor()
+
+
+# ----------------------------------------------------------------------
+# Retry policy
+# ----------------------------------------------------------------------
+# Checked in order against a failed job's errors; anything else is transient
+_FAILURE_PATTERNS = (
+    ("permanent", re.compile(
+        r"private video|video unavailable|has been removed|account .* terminated|"
+        r"not available in your country|members[- ]only|join this channel|"
+        r"confirm your age|copyright|unsupported url|not a valid url|"
+        r"requested format is not available|no video formats found|"
+        r"live event will begin|premieres in|HTTP Error 40[14]|HTTP Error 410|"
+        r"yt-dlp not found|exited with code 2\b",
+        re.IGNORECASE,
+    )),
+    ("throttled", re.compile(
+        r"HTTP Error 429|too many requests|HTTP Error 403|not a bot|rate[- ]limit",
+        re.IGNORECASE,
+    )),
+)
+# First retry waits about this long; each further one doubles it
+RETRY_BASE_S = {"transient": 5.0, "throttled": 60.0}
+RETRY_MAX_S = 15 * 60.0
+# How often DownloadWorker looks for retries whose backoff has passed
+RETRY_POLL_S = 0.5
+
+
+def classify_failure(errors: List[str]) -> Tuple[str, str]:
+    """Return ``(kind, reason)`` for a failed download's error lines.
+
+    ``kind`` is "permanent" (private, removed, geo-blocked... never
+    retried), "throttled" (HTTP 429/403, bot checks) or "transient";
+    ``reason`` is the error line that decided it.
+    """
+    for kind, pattern in _FAILURE_PATTERNS:
+        for line in errors:
+            if pattern.search(line):
+                return kind, line
+    return "transient", errors[0] if errors else "unknown error"
+
+
+def retry_delay(kind: str, attempt: int) -> float:
+    """Backoff before retry number ``attempt + 1``: exponential, jittered.
+
+    The jitter spreads the retries of a batch that failed together (one
+    throttled burst) so they don't hit the server again all at once.
+    """
+    ceiling = min(RETRY_MAX_S, RETRY_BASE_S.get(kind, RETRY_BASE_S["transient"]) * 2 ** attempt)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+# ----------------------------------------------------------------------
+# Work distribution
+# ----------------------------------------------------------------------
+# Most jobs of one batch waiting on cluster workers at once
+CLUSTER_MAX_PENDING = 64
+# run_download options that mean the same on another machine; cookies and
+# the output folder are each worker's own (see kexis_cluster)
+_REMOTE_OPTS = ("audio", "audio_id", "video_id", "right_codec", "connections")
+
+
+class _Lease:
+    """A job waiting for, or handed to, a cluster worker."""
+
+    def __init__(self, tag: str, job: int, url: str, out: Path, opts: Dict[str, Any]) -> None:
+        self.tag = tag
+        self.job = job
+        self.url = url
+        self.out = out
+        self.opts = opts
+        self.id = ""                    # new every time the job is handed out
+        self.worker = ""
+        self.expires = 0.0              # monotonic
+        self.cancelled = False
+        self.ok = False
+        self.outputs: List[str] = []
+        self.errors: List[str] = []
+        self.done = threading.Event()
+
+    def payload(self) -> Dict[str, Any]:
+        return {
+            "lease": self.id, "tag": self.tag, "job": self.job, "url": self.url,
+            "out": str(self.out), "opts": self.opts,
+        }
+
+
+class Coordinator:
+    """Job queue that cluster workers lease from, for multi-machine batches.
+
+    While ``active``, DownloadWorker hands jobs to :meth:`run` instead of
+    :func:`run_download`, so retries, the archive, the job store and the
+    logs stay on this instance. Workers (kexis_cluster) lease jobs over
+    the control API, renew their leases with heartbeats that also carry
+    their log lines and progress, and report each job's result and output
+    paths. A lease that isn't renewed for cluster_lease_s seconds (the
+    worker died or lost the network) goes back to the front of the queue.
+    """
+
+    def __init__(self) -> None:
+        self.active = False
+        self._lock = threading.Lock()
+        self._queue: "deque[_Lease]" = deque()
+        self._leased: Dict[str, _Lease] = {}
+        # worker name -> last contact (time.time()), capacity, jobs done
+        self.workers: Dict[str, Dict[str, Any]] = {}
+
+    def run(
+        self,
+        url: str,
+        out: Path,
+        *,
+        tag: str,
+        proc_ref: Optional["DownloadWorker"] = None,
+        job: int = 0,
+        outputs: Optional[List[str]] = None,
+        errors: Optional[List[str]] = None,
+        **opts: Any,
+    ) -> bool:
+        """Same contract as :func:`run_download`; blocks until a worker reports back."""
+        lease = _Lease(tag, job, url, out, {k: opts[k] for k in _REMOTE_OPTS if opts.get(k) is not None})
+        with self._lock:
+            self._queue.append(lease)
+        ui_append(tag, f"[#{job}] [cluster] Waiting for a worker")
+        while not lease.done.wait(RETRY_POLL_S):
+            self.expire()
+            if proc_ref is not None and proc_ref.is_cancelled(job):
+                with self._lock:
+                    # A worker running it hears at its next heartbeat
+                    lease.cancelled = True
+                    if lease in self._queue:
+                        self._queue.remove(lease)
+                return False
+        if outputs is not None:
+            outputs.extend(lease.outputs)
+        if errors is not None:
+            errors.extend(lease.errors)
+        return lease.ok
+
+    def lease(self, worker: str, capacity: int) -> List[Dict[str, Any]]:
+        """Hand up to ``capacity`` queued jobs to ``worker``."""
+        self.expire()
+        handed: List[_Lease] = []
+        with self._lock:
+            self._seen(worker)["capacity"] = capacity
+            while self._queue and len(handed) < capacity:
+                lease = self._queue.popleft()
+                lease.id = os.urandom(8).hex()
+                lease.worker = worker
+                lease.expires = time.monotonic() + SETTINGS["cluster_lease_s"]
+                self._leased[lease.id] = lease
+                handed.append(lease)
+        for lease in handed:
+            ui_append(lease.tag, f"[#{lease.job}] [cluster] Running on {worker}")
+        return [lease.payload() for lease in handed]
+
+    def heartbeat(self, worker: str, lease_ids: List[str], items: List[list]) -> List[str]:
+        """Renew ``worker``'s leases and relay its output; returns leases it should drop.
+
+        ``items`` are ``[lease, "log", line]`` or ``[lease, "progress",
+        ProgressEvent fields]``. Dropped leases were cancelled here or
+        already re-queued after expiring.
+        """
+        expires = time.monotonic() + SETTINGS["cluster_lease_s"]
+        drop = []
+        with self._lock:
+            self._seen(worker)
+            for lease_id in lease_ids:
+                lease = self._leased.get(lease_id)
+                if lease is None or lease.worker != worker or lease.cancelled:
+                    drop.append(lease_id)
+                else:
+                    lease.expires = expires
+        self._relay(worker, items)
+        return drop
+
+    def complete(
+        self,
+        worker: str,
+        lease_id: str,
+        ok: bool,
+        outputs: List[str],
+        errors: List[str],
+        items: List[list],
+        released: bool = False,
+    ) -> bool:
+        """Record a job's result; ``released`` puts it back in the queue instead.
+
+        Returns False for a lease that is no longer ``worker``'s.
+        """
+        self._relay(worker, items)
+        with self._lock:
+            lease = self._leased.get(lease_id)
+            if lease is None or lease.worker != worker:
+                return False
+            del self._leased[lease_id]
+            self._seen(worker)["done"] += not released
+            if released and not lease.cancelled:
+                self._queue.appendleft(lease)
+                return True
+        if released:
+            return True
+        lease.ok, lease.outputs, lease.errors = ok, outputs, errors
+        lease.done.set()
+        return True
+
+    def expire(self) -> None:
+        """Re-queue the jobs of workers that stopped sending heartbeats."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [lease for lease in self._leased.values() if lease.expires < now]
+            for lease in expired:
+                del self._leased[lease.id]
+                if not lease.cancelled:
+                    self._queue.appendleft(lease)
+        for lease in expired:
+            if not lease.cancelled:
+                TELEMETRY.count("requeued")
+                ui_append(lease.tag, f"[#{lease.job}] [cluster] {lease.worker} stopped answering; job re-queued")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            leased: Dict[str, int] = {}
+            for lease in self._leased.values():
+                leased[lease.worker] = leased.get(lease.worker, 0) + 1
+            return {
+                "active": self.active,
+                "queued": len(self._queue),
+                "workers": {
+                    name: {**info, "running": leased.get(name, 0)} for name, info in self.workers.items()
+                },
+            }
+
+    def _seen(self, worker: str) -> Dict[str, Any]:
+        info = self.workers.setdefault(worker, {"capacity": 0, "done": 0})
+        info["seen"] = time.time()
+        return info
+
+    def _relay(self, worker: str, items: List[list]) -> None:
+        """Queue a worker's log lines and progress under the batch they belong to."""
+        with self._lock:
+            owned = {
+                lease_id: (lease.job, lease.tag) for lease_id, lease in self._leased.items()
+                if lease.worker == worker
+            }
+        # Outside the lock: log listeners run inside ui_append
+        for lease_id, kind, value in items:
+            if lease_id not in owned:
+                continue
+            job, tag = owned[lease_id]
+            if kind == "progress":
+                ui_append("progress", ProgressEvent(**value)._replace(job=job, tag=tag))
+            else:
+                ui_append(tag, value)
+
+
+CLUSTER = Coordinator()
+
+
+# ----------------------------------------------------------------------
+# Worker thread
+# ----------------------------------------------------------------------
+class DownloadWorker(threading.Thread):
+    """Thread that schedules download jobs on a bounded pool.
+
+    Up to ``max_workers`` jobs of this batch run at once, further limited
+    by ``GLOBAL_LIMITER`` across all batches. Playlist and channel URLs
+    are first expanded into one job per video (see :func:`expand_jobs`),
+    so ``jobs`` may grow once the worker starts. Jobs are numbered from 1
+    in the order they were queued; that number prefixes their log lines.
+
+    Failed jobs are classified (see :func:`classify_failure`); transient
+    ones go back to the end of the queue after a backoff, up to the
+    retry_attempts setting. Jobs that fail for good are listed in
+    ``failures`` and in a JSON report under LOG_DIR.
+
+    Queue waits, metadata lookups, conversions and job and batch
+    durations are recorded in TELEMETRY.
+    """
+
+    def __init__(
+        self,
+        jobs: List[Tuple[str, dict]],
+        *,
+        tag: str,
+        max_workers: Optional[int] = None,
+        store_ids: Optional[List[int]] = None,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.jobs = jobs
+        self.tag = tag
+        self.max_workers = max_workers or tab_concurrency(tag)
+        # IDs in JOB_STORE; resumed batches pass the IDs they were stored under
+        self.store_ids = store_ids if store_ids is not None else JOB_STORE.add(tag, jobs)
+        self.stop_flag = False
+        self._cancelled_jobs: set = set()
+        self.failures: List[Dict[str, Any]] = []
+        self._attempts: Dict[int, int] = {}
+        # (monotonic time the backoff ends, job), appended from job threads
+        self._retry_queue: List[Tuple[float, int]] = []
+        self._retry_lock = threading.Lock()
+        self._postprocessing: List[Future] = []
+        # Conversions whose result isn't recorded yet; the event is set at 0.
+        # Future callbacks run after wait() returns, so run() waits on this
+        self._converting = 0
+        self._converting_lock = threading.Lock()
+        self._conversions_done = threading.Event()
+        self._conversions_done.set()
+        # monotonic times a job was queued / got its slot, for TELEMETRY
+        self._queued_at: Dict[int, float] = {}
+        self._started_at: Dict[int, float] = {}
+        # Several processes per job while its streams are fetched in parallel
+        self.active_procs: Dict[int, List[ChildProcess]] = {}
+        self._procs_lock = threading.Lock()
+
+    # Process bookkeeping used by run_download --------------------------
+    def attach(self, job: int, proc: ChildProcess) -> None:
+        with self._procs_lock:
+            self.active_procs.setdefault(job, []).append(proc)
+        if self.is_cancelled(job):
+            self._terminate(proc)
+
+    def detach(self, job: int, proc: Optional[ChildProcess] = None) -> None:
+        with self._procs_lock:
+            procs = self.active_procs.get(job, [])
+            if proc in procs:
+                procs.remove(proc)
+            if not procs:
+                self.active_procs.pop(job, None)
+
+    @staticmethod
+    def _terminate(proc: ChildProcess) -> None:
+        try:
+            proc.terminate()
+        except Exception:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+    def is_cancelled(self, job: int) -> bool:
+        return self.stop_flag or job in self._cancelled_jobs
+
+    def cancel_job(self, job: int) -> None:
+        """Cancel one job: drop it if queued, stop its processes if running."""
+        self._cancelled_jobs.add(job)
+        with self._procs_lock:
+            procs = list(self.active_procs.get(job, []))
+        for proc in procs:
+            self._terminate(proc)
+
+    def stop(self) -> None:
+        """Stop the worker."""
+        self.stop_flag = True
+        with self._procs_lock:
+            procs = [p for job_procs in self.active_procs.values() for p in job_procs]
+        for proc in procs:
+            self._terminate(proc)
+        # Conversions already running finish; queued ones are dropped
+        for future in list(self._postprocessing):
+            future.cancel()
+
+    # Scheduling ---------------------------------------------------------
+    def _end_job(self, job: int, phase: str) -> None:
+        ui_append("progress", ProgressEvent(job, phase, tag=self.tag))
+        started = self._started_at.pop(job, None)
+        if started is not None:
+            TELEMETRY.observe("job", time.monotonic() - started, SETTINGS["engine"])
+        TELEMETRY.count("jobs", label=phase)
+        # Jobs cut off by the app exiting never get here, so they stay
+        # queued/running in the store and are offered for resume
+        self._set_store_state(job, phase)
+
+    def _set_store_state(self, job: int, state: str) -> None:
+        try:
+            JOB_STORE.set_state(self.store_ids[job - 1], state)
+        except sqlite3.Error as exc:
+            ui_append(self.tag, f"[#{job}] ⚠ Job store update failed: {exc}")
+
+    def _run_job(self, job: int, url: str, opts: dict) -> None:
+        try:
+            self._attempt_job(job, url, opts)
+        except Exception as exc:
+            # The pool would keep the exception to itself, leaving the job
+            # "running" with no end event; fail it instead
+            ui_append(self.tag, f"[#{job}] [EXCEPTION] {exc}")
+            self._record_failure(job, url, "error", str(exc), self._attempts.get(job, 0) + 1)
+            self._finish_job(job, url, False, [])
+
+    def _attempt_job(self, job: int, url: str, opts: dict) -> None:
+        if self.is_cancelled(job):
+            self._end_job(job, "cancelled")
+            return
+        opts = dict(opts)
+        # Audio jobs produce the tab's format plus any extra_codecs, all
+        # converted from one download; each output is archived separately
+        codecs: List[Optional[str]] = [None]
+        if opts.get("audio"):
+            codecs = list(dict.fromkeys([opts.get("right_codec") or "mp3", *opts.pop("extra_codecs", ())]))
+        keys = {}
+        if SETTINGS["archive_enabled"]:
+            keys = {c: archive_key(url, {**opts, "right_codec": c} if c else opts) for c in codecs}
+        existing = {c: DOWNLOAD_ARCHIVE.contains(k) for c, k in keys.items() if k}
+        existing = {c: path for c, path in existing.items() if path}
+        if existing and len(existing) == len(codecs):
+            ui_append(self.tag, f"[#{job}] ⏭ Already downloaded: {', '.join(existing.values())}")
+            self._end_job(job, "done")
+            return
+        codecs = [c for c in codecs if c not in existing]
+
+        # Conversion is deferred (and done here or in the pool, not by
+        # yt-dlp) for the pipeline, and whenever more than the tab's format
+        # is wanted
+        deferred = codecs != [None] and (
+            SETTINGS["pipeline_postprocess"] or codecs != [opts.get("right_codec") or "mp3"]
+        )
+        # Cluster workers download and convert on their own machines; the
+        # global limit doesn't apply to them and they pick formats themselves
+        remote = CLUSTER.active
+        if deferred and (remote or not POSTPROCESS_POOL.available):
+            if len(codecs) > 1:
+                why = "aren't made by cluster workers" if remote else "need the yt_dlp module"
+                ui_append(self.tag, f"[#{job}] ⚠ Extra formats {why}; saving {codecs[0]} only")
+            codecs, deferred = codecs[:1], False
+            opts["right_codec"] = codecs[0]
+
+        if not remote and not GLOBAL_LIMITER.acquire(lambda: self.is_cancelled(job)):
+            self._end_job(job, "cancelled")
+            return
+        now = self._started_at[job] = time.monotonic()
+        TELEMETRY.observe("queue_wait", now - self._queued_at.get(job, now), SETTINGS["engine"])
+        outputs: List[str] = []
+        errors: List[str] = []
+        self._set_store_state(job, "running")
+        try:
+            if not remote and not opts.get("audio") and SETTINGS["auto_formats"] and cacheable_video_id(url):
+                pick_formats(url, opts, tag=self.tag, job=job)
+            ok = (CLUSTER.run if remote else run_download)(
+                url, **opts, tag=self.tag, proc_ref=self, job=job, outputs=outputs,
+                transcode=not deferred, errors=errors,
+            )
+        finally:
+            if not remote:
+                GLOBAL_LIMITER.release()
+        if self.is_cancelled(job):
+            self._end_job(job, "cancelled")
+            return
+        if ok and deferred and not outputs:
+            # Nothing to convert; reporting it done would archive nothing
+            ui_append(self.tag, f"[#{job}] ❌ yt-dlp reported no output file to convert")
+            errors.append("yt-dlp reported no output file")
+            ok = False
+        if not ok and self._retry_later(job, url, errors):
+            return
+        if ok and deferred:
+            self._convert(job, url, outputs[-1], codecs, keys)
+            return
+        self._finish_job(job, url, ok, [(keys.get(codecs[0]), outputs[-1])] if outputs else [])
+
+    # Retries ------------------------------------------------------------
+    def _retry_later(self, job: int, url: str, errors: List[str]) -> bool:
+        """Re-queue a failed job if it is worth another try, else record it."""
+        kind, reason = classify_failure(errors)
+        attempt = self._attempts.get(job, 0)
+        retries = max(0, int(SETTINGS["retry_attempts"]))
+        if kind == "permanent" or attempt >= retries:
+            self._record_failure(job, url, kind, reason, attempt + 1)
+            return False
+        delay = retry_delay(kind, attempt)
+        self._attempts[job] = attempt + 1
+        TELEMETRY.count("retries", label=kind)
+        ui_append(self.tag, f"[#{job}] [retry] {kind.capitalize()} failure: {reason}")
+        ui_append(
+            self.tag,
+            f"[#{job}] [retry] Retrying in {delay:.0f}s (attempt {attempt + 2} of {retries + 1})",
+        )
+        ui_append("progress", ProgressEvent(job, "retrying", tag=self.tag))
+        self._set_store_state(job, "queued")
+        with self._retry_lock:
+            self._retry_queue.append((time.monotonic() + delay, job))
+        return True
+
+    def _due_retries(self) -> List[int]:
+        """Pop the jobs whose backoff has passed, and cancelled ones at once."""
+        now = time.monotonic()
+        with self._retry_lock:
+            due = [job for ready, job in self._retry_queue if ready <= now or self.is_cancelled(job)]
+            self._retry_queue = [(r, j) for r, j in self._retry_queue if j not in due]
+        return due
+
+    def _record_failure(self, job: int, url: str, kind: str, reason: str, attempts: int) -> None:
+        self.failures.append(
+            {"job": job, "url": url, "kind": kind, "attempts": attempts, "reason": reason}
+        )
+
+    def _write_failure_report(self) -> Optional[Path]:
+        """Save ``failures`` as JSON under LOG_DIR; returns the path."""
+        path = LOG_DIR / f"failures-{self.tag.lower()}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        report = {
+            "tag": self.tag,
+            "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "jobs": len(self.jobs),
+            "failures": sorted(self.failures, key=lambda f: f["job"]),
+        }
+        try:
+            LOG_DIR.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        except OSError as exc:
+            ui_append(self.tag, f"⚠ Could not write the failure report: {exc}")
+            return None
+        return path
+
+    def _finish_job(self, job: int, url: str, ok: bool, archived: List[Tuple[Any, str]]) -> None:
+        """Report the job's end and archive its (key, output path) pairs."""
+        self._end_job(job, "done" if ok else "failed")
+        for key, path in archived:
+            if ok and key and path:
+                try:
+                    DOWNLOAD_ARCHIVE.add(key, path)
+                except sqlite3.Error as exc:
+                    ui_append(self.tag, f"[#{job}] ⚠ Download archive update failed: {exc}")
+        ui_append(self.tag, f"\n[#{job}] {'✅' if ok else '❌'} Finished:  {url}\n")
+
+    # Post-processing ----------------------------------------------------
+    def _convert(self, job: int, url: str, path: str, codecs: List[str], keys: dict) -> None:
+        ui_append("progress", ProgressEvent(job, "postprocess", stream="ExtractAudio", tag=self.tag))
+        started = time.monotonic()
+        names = " + ".join(c.upper() for c in codecs)
+        if not SETTINGS["pipeline_postprocess"]:
+            ui_append(self.tag, f"[#{job}] Converting to {names}")
+            future: Future = Future()
+            try:
+                future.set_result(transcode_audio(path, codecs))
+            except Exception as exc:
+                future.set_exception(exc)
+            self._transcode_done(job, url, codecs, keys, started, future)
+            return
+
+        ui_append(self.tag, f"[#{job}] [pipeline] Queued for {names} conversion")
+        self._track_conversion(1)
+        try:
+            future = POSTPROCESS_POOL.submit(
+                transcode_audio, path, codecs, cancelled=lambda: self.is_cancelled(job)
+            )
+        except Exception as exc:
+            self._track_conversion(-1)
+            ui_append(self.tag, f"[#{job}] [pipeline] [EXCEPTION] {exc}")
+            self._record_failure(job, url, "conversion", str(exc), self._attempts.get(job, 0) + 1)
+            self._finish_job(job, url, False, [])
+            return
+        if future is None:
+            self._track_conversion(-1)
+            self._end_job(job, "cancelled")
+            return
+        self._postprocessing.append(future)
+
+        def done(f: Future) -> None:
+            try:
+                self._transcode_done(job, url, codecs, keys, started, f)
+            finally:
+                self._track_conversion(-1)
+
+        future.add_done_callback(done)
+
+    def _track_conversion(self, delta: int) -> None:
+        with self._converting_lock:
+            self._converting += delta
+            if self._converting:
+                self._conversions_done.clear()
+            else:
+                self._conversions_done.set()
+
+    def _transcode_done(
+        self, job: int, url: str, codecs: List[str], keys: dict, started: float, future: Future
+    ) -> None:
+        # Includes the wait for a free conversion process
+        TELEMETRY.observe("convert", time.monotonic() - started)
+        if future.cancelled():
+            self._end_job(job, "cancelled")
+            return
+        step = "[pipeline] " if SETTINGS["pipeline_postprocess"] else ""
+        try:
+            paths = future.result()
+        except Exception as exc:
+            ui_append(self.tag, f"[#{job}] {step}❌ Conversion failed: {exc}")
+            self._record_failure(job, url, "conversion", str(exc), self._attempts.get(job, 0) + 1)
+            self._finish_job(job, url, False, [])
+            return
+        for path in paths:
+            ui_append(self.tag, f"[#{job}] {step}Converted: {path}")
+        self._finish_job(job, url, True, [(keys.get(c), p) for c, p in zip(codecs, paths)])
+
+    def _expand(self) -> None:
+        if not any(is_collection_url(url) for url, _ in self.jobs):
+            return
+        ui_append(self.tag, "[expand] Listing playlists and channels...")
+        jobs = expand_jobs(self.jobs, self.tag, lambda: self.stop_flag)
+        if self.stop_flag or jobs == self.jobs:
+            return
+        try:
+            self.store_ids = JOB_STORE.replace(self.store_ids, self.tag, jobs)
+        except sqlite3.Error as exc:
+            ui_append(self.tag, f"⚠ Job store update failed: {exc}")
+            return
+        self.jobs = jobs
+        ui_append(self.tag, f"[expand] {len(jobs)} download(s) queued")
+
+    def run(self) -> None:
+        started = time.monotonic()
+        if SETTINGS["expand_playlists"]:
+            self._expand()
+        for job in range(1, len(self.jobs) + 1):
+            ui_append("progress", ProgressEvent(job, "queued", tag=self.tag))
+            self._queued_at[job] = time.monotonic()
+        limit = CLUSTER_MAX_PENDING if CLUSTER.active else self.max_workers
+        workers = max(1, min(limit, len(self.jobs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.tag) as pool:
+            pending = {
+                pool.submit(self._run_job, job, url, opts)
+                for job, (url, opts) in enumerate(self.jobs, start=1)
+            }
+            # Retries join the end of the pool's queue once their backoff
+            # has passed, so they don't hold a slot while they wait
+            while pending or self._retry_queue:
+                if pending:
+                    _, pending = wait(pending, timeout=RETRY_POLL_S, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(RETRY_POLL_S)
+                for job in self._due_retries():
+                    url, opts = self.jobs[job - 1]
+                    self._queued_at[job] = time.monotonic()
+                    pending.add(pool.submit(self._run_job, job, url, opts))
+        # Downloads are done; wait for the conversions they handed off to
+        # be recorded (archived or listed as failures)
+        self._conversions_done.wait()
+        TELEMETRY.observe("batch", time.monotonic() - started, SETTINGS["engine"])
+        if self.failures:
+            report = self._write_failure_report()
+            ui_append(
+                self.tag,
+                f"\n❌ {len(self.failures)} download(s) failed"
+                + (f" — report: {report}" if report else ""),
+            )
+        if self.stop_flag:
+            ui_append(self.tag, "\n=== CANCELLED ===\n")
+            return
+        ui_append(self.tag, "\n=== ALL DONE ===\n")
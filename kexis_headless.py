@@ -0,0 +1,493 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+kexi's Downloader Pro - headless mode
+
+Runs batches without a display, for servers, cron and containers:
+
+    python kexisdownloader.py --headless urls.txt [options]
+    python kexisdownloader.py --daemon SPOOL_DIR [options]
+    python kexisdownloader.py --worker COORDINATOR_URL [options]
+
+``--headless`` downloads every URL in a file ('-' reads stdin) and exits.
+``--daemon`` watches SPOOL_DIR for ``*.txt`` URL lists and processes them
+as they appear, moving each list to ``done/`` or ``failed/`` with a
+``.result.json`` summary next to it. ``--api`` also serves the local
+control API (see kexis_api), so other programs can queue batches while
+the daemon runs. With ``--coordinator`` as well, the jobs are run by
+``--worker`` instances on other machines instead (see kexis_cluster).
+
+Output is one JSON object per line on stdout. Exit status: 0 when every
+job succeeded, 1 when any failed, 2 on bad input, 130 when interrupted.
+"""
+
+import argparse
+import json
+import queue
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO, Tuple
+
+from kexis_core import (
+    AUDIO_CODECS_RIGHT,
+    BANDWIDTH,
+    CLUSTER,
+    ENGINES,
+    JOB_END_PHASES,
+    JOB_STORE,
+    SETTINGS,
+    TELEMETRY,
+    TELEMETRY_FORMATS,
+    DownloadWorker,
+    ProgressEvent,
+    find_cookies_file,
+    log_queue,
+    parse_rate,
+    split_url_list,
+)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_INTERRUPTED = 130
+
+# Download-progress events are rate-limited per job; job-level ones never are
+PROGRESS_INTERVAL_S = 1.0
+
+
+# ----------------------------------------------------------------------
+# Structured output
+# ----------------------------------------------------------------------
+class JsonLogPrinter(threading.Thread):
+    """Drain the shared log queue and write it as JSON lines."""
+
+    def __init__(self, stream: TextIO = sys.stdout) -> None:
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.results: Dict[Tuple[str, int], str] = {}
+        self._last_progress: Dict[Tuple[str, int], float] = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        record = {"ts": round(time.time(), 3), **record}
+        with self._lock:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.stream.flush()
+
+    def _handle(self, tag: str, item: Any) -> None:
+        if tag != "progress":
+            self.emit({"type": "log", "tag": tag, "msg": str(item).strip("\n")})
+            return
+        event: ProgressEvent = item
+        key = (event.tag, event.job)
+        if event.phase in JOB_END_PHASES:
+            self.results[key] = event.phase
+        elif event.phase == "download":
+            now = time.monotonic()
+            if now - self._last_progress.get(key, 0.0) < PROGRESS_INTERVAL_S:
+                return
+            self._last_progress[key] = now
+        self.emit({"type": "progress", **event._asdict(), "percent": event.percent})
+
+    def drain(self) -> None:
+        """Write everything currently queued."""
+        while True:
+            try:
+                tag, item = log_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(tag, item)
+
+    def run(self) -> None:
+        while not self._finished.is_set():
+            try:
+                tag, item = log_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            TELEMETRY.gauge("log_queue_depth", log_queue.qsize())
+            self._handle(tag, item)
+
+    def stop(self) -> None:
+        self._finished.set()
+        self.join(timeout=1.0)
+        self.drain()
+
+
+# ----------------------------------------------------------------------
+# Batches
+# ----------------------------------------------------------------------
+def build_jobs(urls: List[str], args: argparse.Namespace) -> List[Tuple[str, dict]]:
+    """Build the same options dicts the GUI's Video / Audio tabs do."""
+    out = Path(args.out or Path.home() / "Downloads").expanduser().resolve()
+    out.mkdir(parents=True, exist_ok=True)
+    cookies_path = args.cookies or find_cookies_file()
+    if args.audio:
+        opts = dict(out=out, audio=True, right_codec=args.codec, cookies_path=cookies_path)
+        extra_codecs = [c for c in dict.fromkeys(args.also_codec or ()) if c != args.codec]
+        if extra_codecs:
+            opts["extra_codecs"] = extra_codecs
+    else:
+        opts = dict(
+            out=out,
+            audio=False,
+            video_id=args.video_format,
+            audio_id=args.audio_format,
+            cookies_path=cookies_path,
+        )
+    if args.connections:
+        opts["connections"] = args.connections
+    return [(u, dict(opts)) for u in urls]
+
+
+class BatchRunner:
+    """Run DownloadWorker batches in the foreground and collect results."""
+
+    def __init__(self, printer: JsonLogPrinter, max_workers: Optional[int]) -> None:
+        self.printer = printer
+        self.max_workers = max_workers
+        self.interrupted = False
+        self._worker: Optional[DownloadWorker] = None
+
+    def interrupt(self) -> None:
+        self.interrupted = True
+        if self._worker:
+            self._worker.stop()
+
+    def run(
+        self,
+        jobs: List[Tuple[str, dict]],
+        tag: str,
+        store_ids: Optional[List[int]] = None,
+    ) -> Dict[str, int]:
+        """Run one batch to completion and return counts per end state."""
+        worker = DownloadWorker(
+            jobs, tag=tag, max_workers=self.max_workers, store_ids=store_ids
+        )
+        self._worker = worker
+        worker.start()
+        # Join in slices so Ctrl+C / SIGTERM are handled promptly
+        while worker.is_alive():
+            worker.join(timeout=0.5)
+        self._worker = None
+
+        # Every job publishes an end event before the worker exits; give
+        # the printer a moment to consume them
+        # Playlist expansion may have turned the URLs into more jobs
+        keys = [(tag, job) for job in range(1, len(worker.jobs) + 1)]
+        deadline = time.monotonic() + 2.0
+        while time.monotonic() < deadline and not all(k in self.printer.results for k in keys):
+            time.sleep(0.05)
+
+        counts = {phase: 0 for phase in JOB_END_PHASES}
+        for key in keys:
+            phase = self.printer.results.pop(key, "cancelled")
+            counts[phase] += 1
+        for failure in worker.failures:
+            self.printer.emit({"type": "failure", "tag": tag, **failure})
+        return counts
+
+
+def read_urls(source: str, printer: JsonLogPrinter) -> List[str]:
+    """Read and validate URLs from a file path or '-' (stdin)."""
+    text = sys.stdin.read() if source == "-" else Path(source).read_text(encoding="utf-8")
+    urls, ignored = split_url_list(text)
+    for line in ignored:
+        printer.emit({"type": "warning", "msg": "ignored invalid URL line", "line": line})
+    return urls
+
+
+def resume_pending(runner: BatchRunner) -> Dict[str, int]:
+    """Run jobs left unfinished in the job store by an earlier session."""
+    totals: Dict[str, int] = {phase: 0 for phase in JOB_END_PHASES}
+    for tag, rows in JOB_STORE.pending().items():
+        runner.printer.emit({"type": "resume", "tag": tag, "jobs": len(rows)})
+        counts = runner.run(
+            [(url, opts) for _, url, opts in rows],
+            tag,
+            store_ids=[job_id for job_id, _, _ in rows],
+        )
+        for phase, n in counts.items():
+            totals[phase] += n
+        if runner.interrupted:
+            break
+    return totals
+
+
+def exit_status(counts: Dict[str, int], interrupted: bool) -> int:
+    """Map batch results to the documented process exit status."""
+    if interrupted:
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if counts["failed"] else EXIT_OK
+
+
+# ----------------------------------------------------------------------
+# Modes
+# ----------------------------------------------------------------------
+def run_once(args: argparse.Namespace, runner: BatchRunner) -> int:
+    """``--headless``: download one URL list and exit."""
+    printer = runner.printer
+    counts = resume_pending(runner) if args.resume else {p: 0 for p in JOB_END_PHASES}
+    if runner.interrupted:
+        return EXIT_INTERRUPTED
+
+    try:
+        urls = read_urls(args.headless, printer)
+    except OSError as exc:
+        printer.emit({"type": "error", "msg": f"cannot read URL list: {exc}"})
+        return EXIT_USAGE
+    if not urls and not args.resume:
+        printer.emit({"type": "error", "msg": "no valid YouTube URLs found"})
+        return EXIT_USAGE
+
+    tag = "AUDIO" if args.audio else "VIDEO"
+    if urls:
+        for phase, n in runner.run(build_jobs(urls, args), tag).items():
+            counts[phase] += n
+    printer.emit({"type": "summary", **counts})
+    return exit_status(counts, runner.interrupted)
+
+
+def run_daemon(args: argparse.Namespace, runner: BatchRunner) -> int:
+    """``--daemon``: process URL lists dropped into the spool folder."""
+    printer = runner.printer
+    spool = Path(args.daemon).expanduser().resolve()
+    folders = {name: spool / name for name in ("processing", "done", "failed")}
+    for folder in (spool, *folders.values()):
+        folder.mkdir(parents=True, exist_ok=True)
+    printer.emit({"type": "daemon", "spool": str(spool), "poll_s": args.poll})
+
+    if args.resume:
+        resume_pending(runner)
+    # Lists left in processing/ by a crash are picked up again
+    for stale in sorted(folders["processing"].glob("*.txt")):
+        stale.rename(spool / stale.name)
+
+    tag = "AUDIO" if args.audio else "VIDEO"
+    while not runner.interrupted:
+        batch_files = sorted(spool.glob("*.txt"))
+        if not batch_files:
+            time.sleep(args.poll)
+            continue
+        for path in batch_files:
+            if runner.interrupted:
+                break
+            claimed = folders["processing"] / path.name
+            try:
+                path.rename(claimed)
+                urls = read_urls(str(claimed), printer)
+            except OSError as exc:
+                printer.emit({"type": "error", "file": path.name, "msg": str(exc)})
+                continue
+            printer.emit({"type": "batch", "file": path.name, "jobs": len(urls)})
+            counts = runner.run(build_jobs(urls, args), tag) if urls else {
+                phase: 0 for phase in JOB_END_PHASES
+            }
+            if runner.interrupted:
+                # Leave the list in processing/ so the next start retries it
+                break
+            dest = folders["failed" if counts["failed"] or not urls else "done"] / path.name
+            claimed.rename(dest)
+            dest.with_suffix(".result.json").write_text(
+                json.dumps({"file": path.name, "urls": len(urls), **counts}, indent=2),
+                encoding="utf-8",
+            )
+            printer.emit({"type": "summary", "file": path.name, **counts})
+            write_stats(args, printer)
+    return EXIT_INTERRUPTED
+
+
+def run_worker(args: argparse.Namespace, runner: BatchRunner) -> int:
+    """``--worker``: run jobs leased from a cluster coordinator until stopped."""
+    from kexis_cluster import ClusterWorker
+
+    worker = ClusterWorker(
+        args.worker,
+        capacity=args.jobs or SETTINGS["max_concurrent_jobs"],
+        name=args.worker_name,
+        out=Path(args.out).expanduser().resolve() if args.out else None,
+    )
+    runner.printer.emit({"type": "worker", "coordinator": worker.base, "name": worker.name,
+                         "capacity": worker.capacity})
+    thread = threading.Thread(target=worker.run, name="cluster-worker", daemon=True)
+    thread.start()
+    while thread.is_alive() and not runner.interrupted:
+        thread.join(timeout=0.5)
+    # Hands running jobs back to the coordinator
+    worker.stop()
+    thread.join()
+    if runner.interrupted:
+        return EXIT_INTERRUPTED
+    # A wrong token or coordinator URL is bad input
+    return EXIT_USAGE if worker.refused else EXIT_OK
+
+
+def write_stats(args: argparse.Namespace, printer: JsonLogPrinter) -> None:
+    """Export TELEMETRY to ``--stats`` (replacing it), if given."""
+    if not args.stats:
+        return
+    try:
+        TELEMETRY.export(Path(args.stats).expanduser())
+    except OSError as exc:
+        printer.emit({"type": "error", "msg": f"cannot write stats: {exc}"})
+
+
+def stats_path(text: str) -> str:
+    if Path(text).suffix.lower() not in TELEMETRY_FORMATS:
+        raise argparse.ArgumentTypeError(
+            f"stats file must end in one of: {', '.join(TELEMETRY_FORMATS)}"
+        )
+    return text
+
+
+# ----------------------------------------------------------------------
+# Entry point
+# ----------------------------------------------------------------------
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="kexisdownloader",
+        description="kexi's Downloader Pro without a GUI.",
+    )
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument(
+        "--headless", metavar="URLS_FILE",
+        help="download every URL in the file ('-' for stdin) and exit",
+    )
+    mode.add_argument(
+        "--daemon", metavar="SPOOL_DIR",
+        help="keep running and process *.txt URL lists dropped into SPOOL_DIR",
+    )
+    mode.add_argument(
+        "--worker", metavar="COORDINATOR_URL",
+        help="run jobs for a cluster coordinator, e.g. http://192.168.1.10:8737",
+    )
+    parser.add_argument("-o", "--out",
+                        help="output folder (default: ~/Downloads; a worker's default is "
+                             "the coordinator's folder)")
+    parser.add_argument("--audio", action="store_true",
+                        help="audio downloads (like the Audio tab)")
+    parser.add_argument("--codec", choices=AUDIO_CODECS_RIGHT, default=AUDIO_CODECS_RIGHT[0],
+                        help="audio output format for --audio")
+    parser.add_argument("--also-codec", action="append", choices=AUDIO_CODECS_RIGHT,
+                        metavar="CODEC",
+                        help="also convert the same download to CODEC (repeatable)")
+    parser.add_argument("--video-format", default="best",
+                        help="video format ID, e.g. 303 (default: best)")
+    parser.add_argument("--audio-format", default="251",
+                        help="audio format ID merged with the video (default: 251)")
+    parser.add_argument("--max-height", type=int, metavar="PX",
+                        help="highest video resolution to pick, e.g. 1080 (default: the saved setting)")
+    parser.add_argument("--codec-order", metavar="LIST",
+                        help="allowed video codecs, best first, e.g. av1,vp9,avc1")
+    parser.add_argument("--container", choices=["mp4", "webm", "any"],
+                        help="prefer formats in this container (default: the saved setting)")
+    parser.add_argument("--min-audio-kbps", type=int, metavar="KBPS",
+                        help="lowest audio bitrate to pick")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="parallel downloads (default: the per-tab setting; a worker's "
+                             "default is the global setting)")
+    parser.add_argument("-N", "--connections", type=int,
+                        help="connections per file (default: the saved setting)")
+    parser.add_argument("--engine", choices=sorted(ENGINES),
+                        help="download engine (default: the saved setting)")
+    parser.add_argument("--limit-rate", type=parse_rate, metavar="RATE",
+                        help="total download speed cap, e.g. 5M; approximate with the subprocess "
+                             "engine (default: the saved setting)")
+    parser.add_argument("--job-limit-rate", type=parse_rate, metavar="RATE",
+                        help="download speed cap per job, e.g. 1M (default: the saved setting)")
+    parser.add_argument("--retries", type=int, metavar="N",
+                        help="retries per job for transient failures (default: the saved setting)")
+    parser.add_argument("--cookies", help="cookies.txt to pass to yt-dlp")
+    parser.add_argument("--no-expand", action="store_true",
+                        help="download playlists/channels as one job instead of one per video")
+    parser.add_argument("--resume", action="store_true",
+                        help="first run jobs left unfinished by an earlier session")
+    parser.add_argument("--poll", type=float, default=5.0,
+                        help="daemon: seconds between spool folder scans")
+    parser.add_argument("--stats", type=stats_path, metavar="FILE",
+                        help="write per-phase timings to FILE (.json, .csv or .prom) on exit, "
+                             "and after every daemon batch")
+    parser.add_argument("--api", action="store_true",
+                        help="serve the local control API while running (most useful with --daemon)")
+    parser.add_argument("--api-port", type=int, metavar="PORT",
+                        help="control API port (default: the saved setting); "
+                             "the token is the saved api_token")
+    parser.add_argument("--coordinator", action="store_true",
+                        help="hand every job to --worker instances; serves the API on --api-host")
+    parser.add_argument("--api-host", metavar="ADDR",
+                        help="address the coordinator listens on (default: the saved api_host)")
+    parser.add_argument("--worker-name",
+                        help="name this worker reports to the coordinator (default: the host name)")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.engine:
+        SETTINGS["engine"] = args.engine
+    if args.no_expand:
+        SETTINGS["expand_playlists"] = False
+    for key, value in (
+        ("format_max_height", args.max_height),
+        ("format_codecs", args.codec_order and [c.strip() for c in args.codec_order.split(",") if c.strip()]),
+        ("format_container", "" if args.container == "any" else args.container),
+        ("format_min_audio_kbps", args.min_audio_kbps),
+    ):
+        if value is not None:
+            SETTINGS[key] = value
+    if args.retries is not None:
+        SETTINGS["retry_attempts"] = max(0, args.retries)
+    if args.limit_rate is not None:
+        SETTINGS["bandwidth_limit"] = args.limit_rate
+    if args.job_limit_rate is not None:
+        SETTINGS["job_bandwidth_limit"] = args.job_limit_rate
+    BANDWIDTH.refresh()
+
+    printer = JsonLogPrinter()
+    printer.start()
+    runner = BatchRunner(printer, args.jobs)
+
+    def on_signal(signum, frame):
+        printer.emit({"type": "signal", "signal": signum})
+        runner.interrupt()
+
+    signal.signal(signal.SIGINT, on_signal)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, on_signal)
+
+    api = None
+    if args.api or args.coordinator:
+        from kexis_api import ControlAPI
+
+        host = "127.0.0.1"
+        if args.coordinator:
+            CLUSTER.active = True
+            host = args.api_host or SETTINGS["api_host"]
+        api = ControlAPI(port=args.api_port, host=host)
+        try:
+            printer.emit({"type": "api", "url": f"http://{host}:{api.start()}/api",
+                          "coordinator": CLUSTER.active})
+        except (OSError, ValueError) as exc:
+            printer.emit({"type": "error", "msg": f"control API could not start on {host}:{api.port}: {exc}"})
+            printer.stop()
+            return EXIT_USAGE
+
+    try:
+        if args.worker:
+            return run_worker(args, runner)
+        if args.daemon:
+            return run_daemon(args, runner)
+        return run_once(args, runner)
+    finally:
+        if api:
+            api.stop()
+        printer.stop()
+        write_stats(args, printer)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+kexi's Downloader Pro - segmented HTTP downloads
+
+Splits one progressive (single-file) stream into byte ranges and fetches
+them over several connections at once, which gets around per-connection
+throttling on large formats such as 8K AV1. The in-process engine uses
+it through :class:`SegmentedYoutubeDL`; the module imports yt_dlp, so
+kexis_core only imports it when that engine actually runs.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import yt_dlp
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.utils import format_bytes
+
+# Streams smaller than two of these are fetched over a single connection
+MIN_SEGMENT_BYTES = 4 * 1024 * 1024
+# Longest single range request; YouTube throttles open-ended ones
+DEFAULT_REQUEST_BYTES = 10 * 1024 * 1024
+READ_BLOCK_BYTES = 64 * 1024
+PROGRESS_INTERVAL_S = 0.25
+STATE_SUFFIX = ".kxseg"
+
+# (url, headers) -> response with .status, .headers, .read(n) and .close()
+Opener = Callable[[str, Dict[str, str]], Any]
+
+# yt-dlp internals the integration below overrides or calls. They are not
+# public API, so if a yt-dlp update drops any of them, downloads go
+# through the stock single-connection path instead.
+_INTERNALS = (
+    (yt_dlp.YoutubeDL, ("dl", "_copy_infodict", "_calc_headers")),
+    (HttpFD, ("real_download", "_get_impersonate_target", "_hook_progress")),
+)
+INTERNALS_SUPPORTED = all(
+    callable(getattr(cls, name, None)) for cls, names in _INTERNALS for name in names
+)
+
+
+# ----------------------------------------------------------------------
+# Range downloader
+# ----------------------------------------------------------------------
+def probe_size(url: str, headers: Dict[str, str], opener: Opener) -> Optional[int]:
+    """Return the stream size if the server honours range requests, else None."""
+    resp = opener(url, {**headers, "Range": "bytes=0-0"})
+    try:
+        status = getattr(resp, "status", None)
+        content_range = resp.headers.get("Content-Range") or ""
+    finally:
+        resp.close()
+    if status != 206 or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def plan_segments(size: int, connections: int) -> List[List[int]]:
+    """Split ``size`` bytes into ``[start, end, position]`` ranges (``end`` inclusive)."""
+    count = max(1, min(connections, size // MIN_SEGMENT_BYTES))
+    step = -(-size // count)
+    return [[start, min(start + step, size) - 1, start] for start in range(0, size, step)]
+
+
+class SegmentedFile:
+    """Fetch one URL into ``path`` over several range connections.
+
+    Each segment's position is checkpointed to ``<path>.kxseg`` while the
+    download runs, so an interrupted file continues where every segment
+    stopped, the same way ``--continue`` resumes a ``.part`` file.
+    ``throttle(nbytes)``, if given, is called from the connection threads
+    after every block and may sleep to hold the download back.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        path: str,
+        size: int,
+        *,
+        connections: int,
+        opener: Opener,
+        headers: Optional[Dict[str, str]] = None,
+        request_bytes: int = DEFAULT_REQUEST_BYTES,
+        retries: float = 10,
+        resume: bool = True,
+        throttle: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.url = url
+        self.path = path
+        self.size = size
+        self.connections = connections
+        self.opener = opener
+        self.headers = dict(headers or {})
+        self.request_bytes = request_bytes
+        self.retries = retries
+        self.resume = resume
+        self.throttle = throttle
+        self.segments: List[List[int]] = []
+        self.resumed_bytes = 0
+        self._lock = threading.Lock()
+        self._abort = threading.Event()
+        self._errors: List[BaseException] = []
+
+    @property
+    def state_path(self) -> Path:
+        return Path(self.path + STATE_SUFFIX)
+
+    @property
+    def downloaded(self) -> int:
+        with self._lock:
+            return sum(pos - start for start, _, pos in self.segments)
+
+    def _load_state(self) -> Optional[List[List[int]]]:
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+            if state["size"] == self.size and os.path.getsize(self.path) == self.size:
+                return state["segments"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _save_state(self) -> None:
+        with self._lock:
+            text = json.dumps({"size": self.size, "segments": self.segments})
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        try:
+            tmp.write_text(text, encoding="utf-8")
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+
+    def _fetch_range(self, fh, segment: List[int], last: int) -> None:
+        resp = self.opener(self.url, {**self.headers, "Range": f"bytes={segment[2]}-{last}"})
+        try:
+            status = getattr(resp, "status", None)
+            if status != 206:
+                raise OSError(f"server ignored the range request (HTTP {status})")
+            fh.seek(segment[2])
+            while segment[2] <= last and not self._abort.is_set():
+                block = resp.read(min(READ_BLOCK_BYTES, last + 1 - segment[2]))
+                if not block:
+                    break
+                fh.write(block)
+                with self._lock:
+                    segment[2] += len(block)
+                if self.throttle:
+                    self.throttle(len(block))
+        finally:
+            resp.close()
+        if segment[2] <= last and not self._abort.is_set():
+            raise OSError(f"connection closed at byte {segment[2]} of range ending {last}")
+
+    def _fetch_segment(self, segment: List[int]) -> None:
+        attempt = 0
+        try:
+            with open(self.path, "r+b") as fh:
+                while segment[2] <= segment[1] and not self._abort.is_set():
+                    last = min(segment[1], segment[2] + self.request_bytes - 1)
+                    before = segment[2]
+                    try:
+                        self._fetch_range(fh, segment, last)
+                    except Exception:
+                        # Progress made since the last failure resets the budget
+                        attempt = 0 if segment[2] > before else attempt + 1
+                        if attempt > self.retries or self._abort.is_set():
+                            raise
+                        time.sleep(min(0.25 * 2 ** attempt, 5.0))
+        except BaseException as exc:
+            self._errors.append(exc)
+            self._abort.set()
+
+    def run(self, on_progress: Callable[[int], None] = lambda done: None) -> None:
+        """Download every segment, calling ``on_progress(bytes_done)`` periodically.
+
+        Exceptions raised by ``on_progress`` (e.g. a cancellation) stop all
+        connections and propagate; so does the first segment that runs out
+        of retries.
+        """
+        segments = self._load_state() if self.resume else None
+        if segments is None:
+            with open(self.path, "wb") as fh:
+                fh.truncate(self.size)
+            segments = plan_segments(self.size, self.connections)
+        self.segments = segments
+        self.resumed_bytes = self.downloaded
+
+        threads = [
+            threading.Thread(target=self._fetch_segment, args=(seg,), daemon=True)
+            for seg in self.segments
+            if seg[2] <= seg[1]
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(t.is_alive() for t in threads):
+                time.sleep(PROGRESS_INTERVAL_S)
+                self._save_state()
+                on_progress(self.downloaded)
+        finally:
+            self._abort.set()
+            for thread in threads:
+                thread.join()
+            self._save_state()
+        if self._errors:
+            raise self._errors[0]
+        self.state_path.unlink(missing_ok=True)
+
+
+# ----------------------------------------------------------------------
+# yt-dlp integration
+# ----------------------------------------------------------------------
+class SegmentedHttpFD(HttpFD):
+    """HttpFD that splits large range-capable streams across connections.
+
+    Anything it can't split (unknown size, no range support, small files,
+    POST requests) falls back to the stock single-connection download.
+    """
+
+    def real_download(self, filename, info_dict):
+        url = info_dict["url"]
+        headers = {"Accept-Encoding": "identity", **(info_dict.get("http_headers") or {})}
+        extensions = {}
+        impersonate_target = self._get_impersonate_target(info_dict)
+        if impersonate_target is not None:
+            extensions["impersonate"] = impersonate_target
+
+        def opener(u: str, h: Dict[str, str]):
+            return self.ydl.urlopen(Request(u, headers=h, extensions=extensions))
+
+        size = None
+        if not info_dict.get("request_data") and "Range" not in headers:
+            try:
+                size = probe_size(url, headers, opener)
+            except Exception as exc:
+                self.ydl.write_debug(f"Range probe failed, using one connection: {exc}")
+        if not size or size < 2 * MIN_SEGMENT_BYTES:
+            return super().real_download(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        resume = self.params.get("continuedl", True)
+        if (
+            resume and os.path.isfile(tmpfilename) and os.path.getsize(tmpfilename)
+            and not os.path.isfile(tmpfilename + STATE_SUFFIX)
+        ):
+            # A .part from a single-connection run: only the stock
+            # downloader knows how far it got, and it continues it
+            self.ydl.write_debug("Partial download without segment state, using one connection")
+            return super().real_download(filename, info_dict)
+        download = SegmentedFile(
+            url,
+            tmpfilename,
+            size,
+            connections=self.params.get("segmented_connections") or 1,
+            opener=opener,
+            headers=headers,
+            request_bytes=(
+                self.params.get("http_chunk_size")
+                or (info_dict.get("downloader_options") or {}).get("http_chunk_size")
+                or DEFAULT_REQUEST_BYTES
+            ),
+            retries=10 if self.params.get("retries") is None else self.params["retries"],
+            resume=resume,
+            throttle=self.params.get("bandwidth_throttle"),
+        )
+        self.report_destination(filename)
+        start = time.time()
+
+        def on_progress(done: int) -> None:
+            now = time.time()
+            speed = self.calc_speed(start, now, done - download.resumed_bytes)
+            self._hook_progress({
+                "status": "downloading",
+                "downloaded_bytes": done,
+                "total_bytes": size,
+                "tmpfilename": tmpfilename,
+                "filename": filename,
+                "eta": self.calc_eta(speed, size - done),
+                "speed": speed,
+                "elapsed": now - start,
+                "ctx_id": info_dict.get("ctx_id"),
+                # the connection threads already passed bandwidth_throttle
+                "throttled": True,
+            }, info_dict)
+
+        try:
+            download.run(on_progress)
+            self.to_screen(
+                f"[download] {format_bytes(size)} fetched over "
+                f"{len(download.segments)} connections"
+            )
+        except yt_dlp.utils.DownloadCancelled:
+            raise
+        except Exception as exc:
+            self.report_error(f"segmented download failed: {exc}")
+            return False
+
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            "downloaded_bytes": size,
+            "total_bytes": size,
+            "filename": filename,
+            "status": "finished",
+            "elapsed": time.time() - start,
+            "ctx_id": info_dict.get("ctx_id"),
+        }, info_dict)
+        return True
+
+
+class SegmentedYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that routes plain HTTP downloads through SegmentedHttpFD.
+
+    Enabled by the ``segmented_connections`` param (> 1). Fragmented
+    formats (DASH/HLS) keep yt-dlp's own downloaders, which parallelise
+    through ``concurrent_fragment_downloads`` instead, and so does
+    everything when :data:`INTERNALS_SUPPORTED` is false.
+    """
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if (
+            not INTERNALS_SUPPORTED
+            or test
+            or name == "-"
+            or not info.get("url")
+            or (self.params.get("segmented_connections") or 1) < 2
+            or get_suitable_downloader(info, self.params) is not HttpFD
+        ):
+            return super().dl(name, info, subtitle, test)
+
+        fd = SegmentedHttpFD(self, self.params)
+        for ph in self._progress_hooks:
+            fd.add_progress_hook(ph)
+        new_info = self._copy_infodict(info)
+        if new_info.get("http_headers") is None:
+            new_info["http_headers"] = self._calc_headers(new_info)
+        return fd.download(name, new_info, subtitle)
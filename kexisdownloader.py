@@ -15,19 +15,66 @@ __license__ = "MIT"
 
 import os
 import sys
-import re
-import shutil
 import queue
 import threading
 import subprocess
+import time
+import sqlite3
+import multiprocessing
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional, Any
 import webbrowser
 
+if __name__ == "__main__":
+    # Frozen builds start the post-processing pool's workers via this script
+    multiprocessing.freeze_support()
+
+if __name__ == "__main__" and any(a in ("--headless", "--daemon", "--worker") for a in sys.argv[1:]):
+    # Headless runs must not need (or pay for) a display toolkit
+    from kexis_headless import main
+    sys.exit(main(sys.argv[1:]))
+
 import customtkinter as ctk
 import tkinter as tk
 from tkinter import messagebox, filedialog, scrolledtext
-import yt_dlp
+
+from kexis_core import (
+    AUDIO_CODECS_RIGHT,
+    AUDIO_IDS_LEFT,
+    BANDWIDTH,
+    BatchProgress,
+    DownloadWorker,
+    ENGINES,
+    FORMAT_COLUMNS,
+    FormatConstraints,
+    FormatRow,
+    FormatTable,
+    GLOBAL_LIMITER,
+    JOB_STORE,
+    LOG_DIR,
+    LogSpill,
+    METADATA_CACHE,
+    PROCESS_LOOP,
+    PROGRESS_LINE_RE,
+    RATE_CHOICES,
+    SETTINGS,
+    TELEMETRY,
+    UI_CALL,
+    URL_RE,
+    VIDEO_IDS,
+    choose_formats,
+    coalesce_log_lines,
+    extract_info_async,
+    find_cookies_file,
+    format_bytes,
+    format_rate,
+    log_queue,
+    save_settings,
+    seed_archive,
+    split_url_list,
+    tab_concurrency,
+    ui_call,
+)
 
 # Try to import darkdetect for system theme detection
 try:
@@ -45,108 +92,21 @@ ctk.set_appearance_mode("System")  # "System", "Dark", "Light"
 ctk.set_default_color_theme("blue")
 
 # ----------------------------------------------------------------------
-# Thread-safe log queue
-# ----------------------------------------------------------------------
-log_queue:  queue.Queue[tuple[str, Any]] = queue.Queue()
-
-
-def ui_append(tag: str, msg: str | float) -> None:
-    """Push a log line / progress value onto the queue."""
-    log_queue.put((tag, msg))
-
-
+# Log pump pacing: idle poll interval, fast re-poll while a backlog
+# remains, and the most queue items / seconds one UI tick may consume
 # ----------------------------------------------------------------------
-# Video / audio format dictionaries
-# ----------------------------------------------------------------------
-VIDEO_IDS: Dict[str, str] = {
-     "Best Quality (Auto)": "best",
-    "8K – AV01 – 403": "403",  "8K – AV1 – 416": "416", "8K – AV1 – 417": "417",
-    "8K – VP9 – 571": "571", "8K – VP9 – 272": "272",
-    "8K – AV1 – 402": "402", "8K – AV1 – 701": "701", "8K – AV1 – 700": "700",
-    "4K – AV01 – 401": "401", "4K – VP9 – 315": "315", "4K – VP9 – 337": "337",
-    "4K – AV01 – 400": "400", "4K – AV1 – 399": "399",
-    "4K – AV01 – 398": "398", "4K – VP9 – 313": "313",
-    "1440p – VP9 – 308": "308", "1440p – VP9 – 271": "271", "1440p – VP9 – 336": "336",
-    "1440p – AV1 – 302": "302", "1440p – AVC1 – 264": "264",
-    "1080p – VP9 – 303": "303", "1080p – VP9 – 248": "248", "1080p – VP9 – 335": "335",
-    "1080p – AV1 – 301": "301", "1080p – AVC1 – 137": "137",
-    "720p – AVC1 – 136": "136",  "720p – VP9 – 247": "247"
-}
-
-
-AUDIO_IDS_LEFT = {
-    "Best Audio (Opus)": "251",
-    "High Audio (Opus)": "250",
-    "Medium Audio (Opus)": "249",
-    "AAC Audio (M4A)": "140",
-    "Low Audio (AAC)": "139",
-}
-
-AUDIO_CODECS_RIGHT = ["mp3", "flac", "alac", "wav", "m4a", "opus", "ogg"]
-
-
-# ----------------------------------------------------------------------
-# Find yt-dlp binary
-# ----------------------------------------------------------------------
-def find_yt_dlp() -> str:
-    """Return the absolute path to the yt-dlp executable."""
-    if getattr(sys, "frozen", False):
-        bundle_dir = Path(
-            sys._MEIPASS if hasattr(sys, "_MEIPASS") else sys.executable
-        ).parent
-        candidate = bundle_dir. parent / "Resources" / "bin" / "yt-dlp"
-        if candidate.exists():
-            return str(candidate)
-        candidate = bundle_dir / "bin" / "yt-dlp"
-        if candidate.exists():
-            return str(candidate)
-
-    venv_path = Path(__file__).parent / "venv" / "bin" / "yt-dlp"
-    if venv_path.exists():
-        return str(venv_path)
-
-    exe = shutil.which("yt-dlp") or shutil.which("yt_dlp. exe")
-    if not exe:
-        raise FileNotFoundError(
-            "yt-dlp not found. Install it with `pip install yt-dlp`."
-        )
-    return exe
-
-
-YTDLP_EXE = find_yt_dlp()
+LOG_POLL_MS = 100
+LOG_BUSY_POLL_MS = 16
+LOG_MAX_ITEMS_PER_TICK = 5000
+LOG_TICK_BUDGET_S = 0.008
 
 
 # ----------------------------------------------------------------------
 # URL validation
 # ----------------------------------------------------------------------
-URL_RE = re.compile(r"^(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+$")
-
-
 def clean_list(text: str) -> list[str]:
     """Extract YouTube URLs from multi-line string."""
-    raw = [x.strip() for x in text.splitlines() if x.strip()]
-    urls:  list[str] = []
-    ignored:  list[str] = []
-
-    for line in raw:
-        if (
-            line.startswith("=")
-            or line.startswith("-")
-            or "DOWNLOAD" in line. upper()
-            or "RUNNING" in line.upper()
-            or "COMMAND:" in line. upper()
-            or line.startswith("Paste")
-            or line.startswith("[")
-            or "✅" in line
-            or "❌" in line
-        ):
-            continue
-
-        if URL_RE.match(line):
-            urls.append(line)
-        else:
-            ignored.append(line)
-
+    urls, ignored = split_url_list(text)
     if ignored:
         messagebox.showwarning(
             "Invalid URLs",
@@ -157,151 +117,6 @@ def clean_list(text: str) -> list[str]:
     return urls
 
 
-# ----------------------------------------------------------------------
-# Core download routine
-# ----------------------------------------------------------------------
-def run_download(
-    url: str,
-    out:  Path,
-    *,
-    audio:  bool = False,
-    audio_id: str | None = None,
-    video_id: str | None = None,
-    right_codec: str | None = None,
-    cookies_path: str | None = None,
-    tag: str = "Job",
-    proc_ref: Optional["DownloadWorker"] = None,
-) -> bool:
-    """Build the yt-dlp command and run it."""
-    out_tpl = str(out / "%(title)s.%(ext)s")
-
-    if audio:
-        fmt = "bestaudio"
-        cmd = [
-            YTDLP_EXE,
-            "--remote-components", "ejs: github",
-            "-f", fmt,
-            "--extract-audio",
-            "--audio-format", right_codec or "mp3",
-            "--audio-quality", "0",
-            "--newline",
-            "-o", out_tpl,
-            url,
-        ]
-    else:
-        if video_id and video_id != "best":
-            if audio_id:
-                fmt = f"{video_id}+{audio_id}/bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"
-            else:
-                fmt = f"{video_id}+bestaudio/bestvideo[ext=mp4]+bestaudio[ext=m4a]/best"
-        else:
-            fmt = "bestvideo[ext=mp4]+bestaudio[ext=m4a]/bestvideo+bestaudio/best"
-
-        cmd = [
-            YTDLP_EXE,
-            "--remote-components", "ejs:github",
-            "-f", fmt,
-            "--merge-output-format", "mp4",
-            "--newline",
-            "-o", out_tpl,
-            url,
-        ]
-
-    if cookies_path:
-        cp = Path(cookies_path).expanduser()
-        if cp.is_file():
-            cmd.extend(["--cookies", str(cp)])
-        else:
-            cmd.extend(["--cookies-from-browser", "chrome"])
-
-    ui_append(tag, f"Running command:\n{' '.join(cmd)}\n")
-
-    creation_flags = 0
-    if os.name == "nt": 
-        creation_flags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
-
-    proc = None
-    try:
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess. PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            creationflags=creation_flags,
-        )
-        if proc_ref:
-            proc_ref. current_proc = proc
-
-        if proc.stdout:
-            for line in proc.stdout:
-                line = line.rstrip()
-                if "[download]" in line and "%" in line:
-                    try:
-                        percent = float(line.split("%")[0].split()[-1])
-                        ui_append("progress", percent)
-                    except Exception:
-                        pass
-                ui_append(tag, line)
-
-                if proc_ref and proc_ref.stop_flag:
-                    try:
-                        proc.terminate()
-                    except Exception:
-                        pass
-                    break
-
-        proc.wait()
-        return proc.returncode == 0
-
-    except Exception as exc:
-        ui_append(tag, f"[EXCEPTION] {exc}")
-        return False
-    finally:
-        if proc_ref:
-            proc_ref. current_proc = None
-        if proc and proc.stdout:
-            try:
-                proc.stdout.close()
-            except Exception:
-                pass
-
-
-# ----------------------------------------------------------------------
-# Worker thread
-# ----------------------------------------------------------------------
-class DownloadWorker(threading.Thread):
-    """Thread that processes download jobs."""
-
-    def __init__(self, jobs: List[Tuple[str, dict]], *, tag: str) -> None:
-        super().__init__(daemon=True)
-        self.jobs = jobs
-        self.tag = tag
-        self.stop_flag = False
-        self.current_proc:  Optional[subprocess.Popen] = None
-
-    def stop(self) -> None:
-        """Stop the worker."""
-        self.stop_flag = True
-        if self.current_proc:
-            try:
-                self.current_proc.terminate()
-            except Exception:
-                try:
-                    self.current_proc.kill()
-                except Exception:
-                    pass
-
-    def run(self) -> None:
-        for url, opts in self.jobs:
-            if self.stop_flag:
-                ui_append(self.tag, "\n=== CANCELLED ===\n")
-                return
-            ok = run_download(url, **opts, tag=self.tag, proc_ref=self)
-            ui_append(self.tag, f"\n{'✅' if ok else '❌'} Finished:  {url}\n")
-        ui_append(self.tag, "\n=== ALL DONE ===\n")
-
-
 # ----------------------------------------------------------------------
 # Main Application
 # ----------------------------------------------------------------------
@@ -327,6 +142,15 @@ class kexisdownloader(ctk.CTk):
         # Log widgets
         self._log_widgets:  Dict[str, tk.Text] = {}
 
+        # Aggregate progress of all running batches
+        self._batch_progress = BatchProgress()
+
+        # Full-history log files (only written when enabled in Preferences)
+        self._log_spill = LogSpill(LOG_DIR)
+
+        # When the next log pump tick should run, to measure how late it is
+        self._poll_due: Optional[float] = None
+
         # Setup UI
         self._setup_menu()
         self._setup_ui()
@@ -334,6 +158,17 @@ class kexisdownloader(ctk.CTk):
         # Start log polling
         self._poll_log()
 
+        if SETTINGS["archive_scan_on_startup"]:
+            self._scan_archive()
+
+        if SETTINGS["resume_jobs_on_startup"]:
+            self.after(500, self._offer_resume)
+
+        # Local control API (kexis_api), imported only when it's switched on
+        self._api = None
+        if SETTINGS["api_enabled"]:
+            self._start_api()
+
         # Bind keyboard shortcuts
         self. bind("<Command-d>", lambda e: self._start_current_download())
         self.bind("<Command-k>", lambda e: self._show_format_checker())
@@ -352,6 +187,7 @@ class kexisdownloader(ctk.CTk):
         file_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="File", menu=file_menu)
         file_menu.add_command(label="Open Downloads Folder", command=self._open_downloads_folder, accelerator="⌘O")
+        file_menu.add_command(label="Open Logs Folder", command=self._open_logs_folder)
         file_menu.add_separator()
         file_menu.add_command(label="Preferences.. .", command=self._show_preferences, accelerator="⌘,")
         file_menu.add_separator()
@@ -371,6 +207,8 @@ class kexisdownloader(ctk.CTk):
         tools_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Tools", menu=tools_menu)
         tools_menu.add_command(label="Check Formats", command=self._show_format_checker, accelerator="⌘K")
+        tools_menu.add_command(label="Scan Output Folders into Archive", command=self._scan_archive)
+        tools_menu.add_command(label="Download Statistics", command=self._show_stats)
 
         # Help menu
         help_menu = tk.Menu(menubar, tearoff=0)
@@ -671,7 +509,23 @@ class kexisdownloader(ctk.CTk):
             height=35,
             corner_radius=8
         )
-        codec_menu.pack(anchor="w", padx=15, pady=(0, 15))
+        codec_menu.pack(anchor="w", padx=15, pady=(0, 10))
+
+        # Extra formats converted from the same download
+        extra_frame = ctk.CTkFrame(controls_frame, fg_color="transparent")
+        extra_frame.pack(fill="x", padx=15, pady=(0, 15))
+        ctk.CTkLabel(
+            extra_frame,
+            text="➕ Also save as:",
+            font=ctk.CTkFont(size=12)
+        ).pack(side="left", padx=(0, 10))
+        self.audio_extra_codec_vars: Dict[str, ctk.BooleanVar] = {}
+        for codec in AUDIO_CODECS_RIGHT:
+            var = ctk.BooleanVar(value=False)
+            ctk.CTkCheckBox(
+                extra_frame, text=codec.upper(), variable=var, width=70
+            ).pack(side="left", padx=(0, 5))
+            self.audio_extra_codec_vars[codec] = var
 
         # Buttons
         button_frame = ctk.CTkFrame(controls_frame, fg_color="transparent")
@@ -759,35 +613,112 @@ class kexisdownloader(ctk.CTk):
 
     # ------------------------------------------------------------------
     def _poll_log(self):
-        """Poll the log queue and update UI."""
-        try:
-            while True:
+        """Drain a bounded slice of the log queue and update the UI once.
+
+        Lines are grouped per tag and written with a single insert, and
+        progress ticks are collapsed, so a flood of yt-dlp output costs a
+        few Tk calls per frame instead of several per line.
+        """
+        start = time.perf_counter()
+        if self._poll_due is not None:
+            TELEMETRY.observe("ui_poll_delay", start - self._poll_due)
+        TELEMETRY.gauge("log_queue_depth", log_queue.qsize())
+        pending: Dict[str, List[str]] = {}
+        calls = []
+        saw_progress = False
+        deadline = start + LOG_TICK_BUDGET_S
+        backlog = False
+        for n in range(LOG_MAX_ITEMS_PER_TICK):
+            if n % 256 == 255 and time.perf_counter() > deadline:
+                backlog = True
+                break
+            try:
                 tag, line = log_queue.get_nowait()
-                widget = self._log_widgets. get(tag)
+            except queue.Empty:
+                break
+            if tag == "progress":
+                self._batch_progress.update(line)
+                saw_progress = True
+            elif tag == UI_CALL:
+                calls.append(line)
+            else:
+                pending.setdefault(tag, []).append(line)
+        else:
+            backlog = True
 
-                if tag == "progress":
-                    self.progress_var.set(line / 100)
-                    self.progress_label.configure(text=f"Downloading...  {int(line)}%")
-                    continue
+        # ui_call() requests from other threads, in the order they were made.
+        # They run before the lines are written, so a batch registered this
+        # way (see _api_batch) doesn't lose its first lines
+        for fn, args in calls:
+            try:
+                fn(*args)
+            except Exception:
+                self.report_callback_exception(*sys.exc_info())
 
-                if widget: 
-                    widget.insert("end", line + "\n")
-                    widget. see("end")
-        except queue.Empty:
-            pass
-        self.after(100, self._poll_log)
+        for tag, lines in pending.items():
+            widget = self._log_widgets.get(tag)
+            if widget is None:
+                continue
+            lines = coalesce_log_lines(lines)
+            # Overwrite the previous tick's progress line for the same job
+            m = PROGRESS_LINE_RE.match(lines[0])
+            if m:
+                tail = PROGRESS_LINE_RE.match(widget.get("end-2l", "end-1c"))
+                if tail and tail.group(1) == m.group(1):
+                    widget.delete("end-2l", "end-1l")
+            widget.insert("end", "\n".join(lines) + "\n")
+            self._trim_log(widget)
+            widget.see("end")
+            if SETTINGS["log_spill_to_file"]:
+                try:
+                    self._log_spill.write(tag, lines)
+                except OSError as exc:
+                    SETTINGS["log_spill_to_file"] = False
+                    print(f"⚠ Log spill disabled: {exc}")
+
+        # Keep refreshing while jobs run so speed / ETA decay when stalled
+        if saw_progress or self._batch_progress.running:
+            self.progress_var.set(self._batch_progress.completion())
+            self.progress_label.configure(text=self._batch_progress.summary())
+
+        delay_ms = LOG_BUSY_POLL_MS if backlog else LOG_POLL_MS
+        done = time.perf_counter()
+        TELEMETRY.observe("ui_poll", done - start)
+        self._poll_due = done + delay_ms / 1000
+        self.after(delay_ms, self._poll_log)
+
+    # ------------------------------------------------------------------
+    def _trim_log(self, widget):
+        """Drop the oldest log lines once the widget exceeds its cap.
+
+        Trimming starts at the ``logstart`` mark so URLs pasted above the
+        first batch survive, and only kicks in 10% past the limit so it
+        runs in chunks rather than on every tick.
+        """
+        start = "logstart" if "logstart" in widget.mark_names() else "1.0"
+        max_lines = SETTINGS["log_max_lines"]
+        if max_lines > 0:
+            last = int(widget.index("end-1c").split(".")[0])
+            if last > max_lines + max_lines // 10:
+                first = int(widget.index(start).split(".")[0])
+                widget.delete(start, f"{min(first + last - max_lines, last)}.0")
+        max_chars = SETTINGS["log_max_kb"] * 1024
+        if max_chars > 0:
+            total = (widget.count("1.0", "end", "chars") or (0,))[0]
+            if total > max_chars + max_chars // 10:
+                widget.delete(start, f"{start} + {total - max_chars} chars lineend +1c")
+
+    # ------------------------------------------------------------------
+    def _mark_log_start(self, widget):
+        """Remember where batch output begins so trimming spares pasted URLs."""
+        if "logstart" not in widget.mark_names():
+            widget.mark_set("logstart", "end-1c")
+            widget.mark_gravity("logstart", "left")
 
     # ------------------------------------------------------------------
     def _find_cookies_file(self) -> Optional[str]:
         """Search for cookies. txt file."""
-        for p in (
-            Path.home() / "Downloads" / "cookies.txt",
-            Path.cwd() / "cookies.txt",
-            Path.home() / "cookies.txt",
-        ):
-            if p.is_file():
-                return str(p)
-        return None
+        return find_cookies_file()
 
     # ------------------------------------------------------------------
     def _ensure_folder(self, path_str: str) -> Path:
@@ -811,6 +742,7 @@ class kexisdownloader(ctk.CTk):
         out_folder = self._ensure_folder(self.video_folder_entry.get())
         cookies_path = self._find_cookies_file()
 
+        self._mark_log_start(self.video_log_text)
         self.video_log_text.insert("end", "\n" + "=" * 60 + "\n")
         self.video_log_text.insert("end", "DOWNLOAD STARTED\n")
         self.video_log_text.insert("end", "=" * 60 + "\n")
@@ -850,24 +782,27 @@ class kexisdownloader(ctk.CTk):
         out_folder = self._ensure_folder(self.audio_folder_entry.get())
         cookies_path = self._find_cookies_file()
 
+        self._mark_log_start(self.audio_log_text)
         self.audio_log_text.insert("end", "\n" + "=" * 60 + "\n")
         self.audio_log_text.insert("end", "DOWNLOAD STARTED\n")
         self.audio_log_text. insert("end", "=" * 60 + "\n")
         self.audio_log_text. see("end")
 
+        codec = self.audio_codec_var.get()
+        extra_codecs = [
+            c for c, var in self.audio_extra_codec_vars.items() if var.get() and c != codec
+        ]
         jobs: List[Tuple[str, dict]] = []
         for u in urls:
-            jobs.append(
-                (
-                    u,
-                    dict(
-                        out=out_folder,
-                        audio=True,
-                        right_codec=self.audio_codec_var.get(),
-                        cookies_path=cookies_path,
-                    ),
-                )
+            opts = dict(
+                out=out_folder,
+                audio=True,
+                right_codec=codec,
+                cookies_path=cookies_path,
             )
+            if extra_codecs:
+                opts["extra_codecs"] = extra_codecs
+            jobs.append((u, opts))
 
         w = DownloadWorker(jobs, tag="AUDIO")
         self.audio_workers = [w]
@@ -875,6 +810,88 @@ class kexisdownloader(ctk.CTk):
 
         self.after(2000, self._check_download_complete)
 
+    # ------------------------------------------------------------------
+    def _offer_resume(self):
+        """Offer to resume jobs left unfinished by the previous session."""
+        try:
+            JOB_STORE.prune()
+            pending = JOB_STORE.pending()
+        except sqlite3.Error as exc:
+            print(f"⚠ Could not read job store: {exc}")
+            return
+        count = sum(len(jobs) for jobs in pending.values())
+        if not count:
+            return
+        if not messagebox.askyesno(
+            "Resume Downloads?",
+            f"{count} download(s) from your last session did not finish.\n"
+            "Resume them now? Partially downloaded files will be continued."
+        ):
+            JOB_STORE.discard_pending()
+            return
+
+        for tag, rows in pending.items():
+            audio = bool(rows[0][2].get("audio"))
+            if tag not in ("VIDEO", "AUDIO"):
+                # Batches queued through the control API log to their tab
+                self._log_widgets[tag] = self._log_widgets["AUDIO" if audio else "VIDEO"]
+            widget = self._log_widgets.get(tag)
+            if widget is None:
+                continue
+            self._mark_log_start(widget)
+            widget.insert("end", "\n" + "=" * 60 + "\n")
+            widget.insert("end", f"RESUMING {len(rows)} DOWNLOAD(S)\n")
+            widget.insert("end", "=" * 60 + "\n")
+            widget.see("end")
+            w = DownloadWorker(
+                [(url, opts) for _, url, opts in rows],
+                tag=tag,
+                store_ids=[job_id for job_id, _, _ in rows],
+            )
+            if not audio:
+                self.video_workers = [w]
+            else:
+                self.audio_workers = [w]
+            self.last_download_folder = rows[0][2].get("out")
+            w.start()
+
+        self.after(2000, self._check_download_complete)
+
+    # ------------------------------------------------------------------
+    def _start_api(self) -> Optional[str]:
+        """Start the control API on the api_host setting; returns why it couldn't."""
+        from kexis_api import ControlAPI
+
+        self._stop_api()
+        api = ControlAPI(on_batch=self._api_batch, host=SETTINGS["api_host"])
+        try:
+            port = api.start()
+        except (OSError, ValueError) as exc:
+            # ValueError: a LAN address without a token
+            print(f"⚠ Control API could not listen on {api.host}:{api.port}: {exc}")
+            return str(exc)
+        self._api = api
+        print(f"🌐 Control API on http://{api.host}:{port}/api")
+        return None
+
+    # ------------------------------------------------------------------
+    def _stop_api(self):
+        """Stop the control API; batches it queued keep running."""
+        if self._api is not None:
+            self._api.stop()
+            self._api = None
+
+    # ------------------------------------------------------------------
+    def _api_batch(self, worker: DownloadWorker):
+        """Show a batch queued through the API in its tab's log.
+
+        Called on the API thread, so the log widgets are only touched on
+        the Tk thread, through ui_call.
+        """
+        audio = bool(worker.jobs and worker.jobs[0][1].get("audio"))
+        widget = self._log_widgets["AUDIO" if audio else "VIDEO"]
+        ui_call(self._log_widgets.__setitem__, worker.tag, widget)
+
     # ------------------------------------------------------------------
     def _check_download_complete(self):
         """Check if downloads are complete and show open folder button."""
@@ -887,6 +904,15 @@ class kexisdownloader(ctk.CTk):
             if result: 
                 self._open_specific_folder(self.last_download_folder)
 
+    # ------------------------------------------------------------------
+    def _scan_archive(self):
+        """Seed the download archive from both output folders in the background."""
+        folders = {
+            Path(entry.get() or Path.home() / "Downloads").expanduser()
+            for entry in (self.video_folder_entry, self.audio_folder_entry)
+        }
+        threading.Thread(target=seed_archive, args=(sorted(folders),), daemon=True).start()
+
     # ------------------------------------------------------------------
     def _cancel_video(self):
         """Cancel video download."""
@@ -935,6 +961,12 @@ class kexisdownloader(ctk.CTk):
         folder = Path.home() / "Downloads"
         self._open_specific_folder(folder)
 
+    # ------------------------------------------------------------------
+    def _open_logs_folder(self):
+        """Open the folder holding spilled log files."""
+        LOG_DIR.mkdir(parents=True, exist_ok=True)
+        self._open_specific_folder(LOG_DIR)
+
     # ------------------------------------------------------------------
     def _open_specific_folder(self, folder: Path):
         """Open a specific folder in Finder/Explorer."""
@@ -950,6 +982,11 @@ class kexisdownloader(ctk.CTk):
         """Show preferences window."""
         PreferencesWindow(self)
 
+    # ------------------------------------------------------------------
+    def _show_stats(self):
+        """Show the download statistics window."""
+        StatsWindow(self)
+
     # ------------------------------------------------------------------
     def _show_about(self):
         """Show about dialog."""
@@ -1040,6 +1077,36 @@ class FormatCheckerWindow(ctk.CTkToplevel):
                 command=self._apply_filter
             ).pack(side="left", padx=5)
 
+        # Sorting (re-renders the parsed table; nothing is fetched again)
+        sort_frame = ctk.CTkFrame(self, fg_color="transparent")
+        sort_frame.pack(fill="x", padx=20, pady=(0, 10))
+
+        ctk.CTkLabel(
+            sort_frame,
+            text="↕ Sort by:",
+            font=ctk.CTkFont(size=13, weight="bold")
+        ).pack(side="left", padx=(15, 10))
+
+        self._sort_columns = {"As listed": None, **{heading: field for field, heading in FORMAT_COLUMNS}}
+        self.sort_var = ctk.StringVar(value="As listed")
+        ctk.CTkOptionMenu(
+            sort_frame,
+            variable=self.sort_var,
+            values=list(self._sort_columns),
+            command=lambda _: self._apply_filter(),
+            width=140,
+            height=30,
+            corner_radius=8
+        ).pack(side="left")
+
+        self.sort_desc_var = ctk.BooleanVar(value=True)
+        ctk.CTkCheckBox(
+            sort_frame,
+            text="Highest first",
+            variable=self.sort_desc_var,
+            command=self._apply_filter
+        ).pack(side="left", padx=10)
+
         # Info label
         info_frame = ctk.CTkFrame(self, fg_color="transparent")
         info_frame.pack(fill="x", padx=20)
@@ -1071,7 +1138,8 @@ class FormatCheckerWindow(ctk.CTkToplevel):
         # Add context menu
         self._add_context_menu()
 
-        self.raw_output = ""
+        self.table: Optional[FormatTable] = None
+        self.choice = None
 
     # ------------------------------------------------------------------
     def _add_context_menu(self):
@@ -1116,115 +1184,102 @@ class FormatCheckerWindow(ctk.CTkToplevel):
         self.results_text.delete("1.0", "end")
         self.results_text.insert("1.0", "⏳ Fetching formats from YouTube...\n\n")
 
-        def worker():
-            cmd = [YTDLP_EXE, "--remote-components", "ejs: github", "-F", url]
+        async def fetch():
+            info = await extract_info_async(url)
+            return FormatTable(info), choose_formats(info, FormatConstraints.from_settings())
 
+        # Runs on the process loop; Tk is only touched through ui_call
+        def done(future):
             try:
-                creation_flags = 0
-                if os.name == "nt": 
-                    creation_flags = getattr(subprocess, "CREATE_NO_WINDOW", 0)
-
-                proc = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    encoding="utf-8",
-                    errors="replace",
-                    creationflags=creation_flags,
-                )
+                ui_call(self._show_table, *future.result())
+            except Exception as exc:
+                ui_call(self._show_error, exc)
 
-                raw_lines = []
-                if proc.stdout:
-                    for ln in proc.stdout:
-                        raw_lines.append(ln. rstrip())
+        PROCESS_LOOP.submit(fetch()).add_done_callback(done)
 
-                self.raw_output = "\n".join(raw_lines)
-                self.after(0, self._apply_filter)
-                proc.wait()
-            except Exception as exc:
-                self.after(0, lambda: self.results_text.insert("end", f"\n❌ Error: {exc}\n"))
+    # ------------------------------------------------------------------
+    def _show_table(self, table: FormatTable, choice):
+        """Keep a freshly fetched table and display it."""
+        # The window may have been closed while the formats were fetched
+        if not self.winfo_exists():
+            return
+        self.table, self.choice = table, choice
+        self._apply_filter()
 
-        threading.Thread(target=worker, daemon=True).start()
+    # ------------------------------------------------------------------
+    def _show_error(self, exc: Exception):
+        """Report a failed fetch, if the window is still open."""
+        if not self.winfo_exists():
+            return
+        self.results_text.insert("end", f"\n❌ Error: {exc}\n")
 
     # ------------------------------------------------------------------
     def _apply_filter(self):
-        """Apply the selected filter to the results."""
-        if not self.raw_output:
+        """Render the table with the selected filter and sort order."""
+        if not self.table:
             return
 
-        filtered = self._parse_and_filter(self.raw_output, self.filter_var.get())
+        filtered = self._render(self.table, self.filter_var.get())
         self.results_text. delete("1.0", "end")
         self.results_text.insert("1.0", filtered)
 
     # ------------------------------------------------------------------
-    def _parse_and_filter(self, output: str, filter_type: str) -> str:
-        """Parse and filter format output with quality indicators."""
-        lines = output.split("\n")
-        result = []
-        audio_formats = []
+    @staticmethod
+    def _cell(row: FormatRow, field: str) -> str:
+        """Format one table cell."""
+        value = getattr(row, field)
+        if field == "size":
+            return format_bytes(value) if value else ""
+        if field in ("abr", "tbr"):
+            return f"{value:.0f}k" if value else ""
+        if field == "fps":
+            return f"{value:.0f}" if value else ""
+        return str(value)
 
-        # Find header
-        start = -1
-        for i, line in enumerate(lines):
-            if "ID" in line and "EXT" in line and "RESOLUTION" in line:
-                start = i
-                break
-        if start == -1:
-            return output
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _quality_indicator(kbps: float) -> str:
+        """Audio quality badge for a bitrate."""
+        if kbps >= 480:
+            return " 🟢 EXCELLENT"
+        if kbps >= 256:
+            return " 🟡 VERY GOOD"
+        if kbps >= 160:
+            return " 🟠 GOOD"
+        return " 🔴 MEDIUM"
 
-        result.extend(lines[: start + 2])
+    # ------------------------------------------------------------------
+    def _render(self, table: FormatTable, filter_type: str) -> str:
+        """Lay out the filtered rows with quality indicators and a summary."""
+        rows = table.view(
+            filter_type, self._sort_columns[self.sort_var.get()], self.sort_desc_var.get()
+        )
+        widths = {
+            field: max([len(heading)] + [len(self._cell(r, field)) for r in rows])
+            for field, heading in FORMAT_COLUMNS
+        }
+        header = "  ".join(heading.ljust(widths[field]) for field, heading in FORMAT_COLUMNS).rstrip()
 
-        # Process formats
-        for line in lines[start + 2:]:
-            if not line.strip():
-                continue
-            low = line.lower()
-            bitrate = 0
-            m = re.search(r"(\d+)k", low)
-            if m:
-                bitrate = int(m.group(1))
-
-            is_audio = "audio only" in low
-            is_video = ("video only" in low) or ("x" in low and not is_audio)
-
-            # Add quality indicator
-            indicator = ""
-            if is_audio: 
-                if bitrate >= 480:
-                    indicator = " 🟢 EXCELLENT"
-                elif bitrate >= 256:
-                    indicator = " 🟡 VERY GOOD"
-                elif bitrate >= 160:
-                    indicator = " 🟠 GOOD"
-                else:
-                    indicator = " 🔴 MEDIUM"
-
-            modified_line = line + indicator if indicator else line
-
-            if filter_type == "all":
-                result.append(modified_line)
-            elif filter_type == "audio" and is_audio:
-                result.append(modified_line)
-                audio_formats.append((bitrate, line))
-            elif filter_type == "high_audio" and is_audio and bitrate >= 256:
-                result.append(modified_line)
-                audio_formats.append((bitrate, line))
-            elif filter_type == "highest_audio" and is_audio and bitrate >= 480:
-                result. append(modified_line)
-                audio_formats.append((bitrate, line))
-            elif filter_type == "video" and is_video:
-                result.append(modified_line)
+        result = []
+        if self.choice:
+            result.append(f"🎯 Auto pick: {self.choice.describe()}")
+        result.append(f"[info] Available formats for {table.video_id}: {table.title}")
+        result.extend([header, "─" * len(header)])
+        for row in rows:
+            line = "  ".join(self._cell(row, field).ljust(widths[field]) for field, _ in FORMAT_COLUMNS)
+            if row.kind == "audio":
+                line = line.rstrip() + self._quality_indicator(row.abr)
+            result.append(line.rstrip())
 
         # Audio summary
-        if filter_type in {"audio", "high_audio", "highest_audio"} and audio_formats:
-            audio_formats.sort(reverse=True)
+        best = table.best_audio(rows)
+        if filter_type in {"audio", "high_audio", "highest_audio"} and best:
             result.append("\n" + "=" * 80)
             result.append("📊 AUDIO QUALITY SUMMARY:")
             result.append("=" * 80)
 
-            max_br = audio_formats[0][0]
-            result.append(f"🎵 Highest available bitrate: {max_br} kbps")
+            max_br = best.abr
+            result.append(f"🎵 Highest available bitrate: {max_br:.0f} kbps")
             if max_br >= 480:
                 result.append("✅ EXCELLENT – near YouTube's max (512 kbps 5.1)")
             elif max_br >= 256:
@@ -1234,12 +1289,150 @@ class FormatCheckerWindow(ctk.CTkToplevel):
             else:
                 result. append("⚠ MEDIUM – lower-quality audio")
 
-            result.append(f"\n📋 Found {len(audio_formats)} audio format(s)")
-            result.append("\n💡 Recommended:  Use format ID {audio_formats[0][1]. split()[0]} for best quality")
+            result.append(f"\n📋 Found {sum(1 for r in rows if r.kind == 'audio')} audio format(s)")
+            result.append(f"\n💡 Recommended:  Use format ID {best.format_id} for best quality")
 
         return "\n".join(result)
 
 
+# ----------------------------------------------------------------------
+# Statistics Window
+# ----------------------------------------------------------------------
+STATS_REFRESH_MS = 1000
+
+
+def _fmt_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.0f} ms" if seconds < 1 else f"{seconds:.2f} s"
+
+
+class StatsWindow(ctk.CTkToplevel):
+    """Where download time goes, per phase, from TELEMETRY; refreshed live."""
+
+    def __init__(self, parent):
+        super().__init__(parent)
+
+        self.title("📈 Download Statistics - kexi's Downloader Pro")
+        self.geometry("760x560")
+        self.minsize(600, 400)
+
+        ctk.CTkLabel(
+            self,
+            text="📈 Download Statistics",
+            font=ctk.CTkFont(size=20, weight="bold")
+        ).pack(anchor="w", padx=20, pady=(20, 5))
+
+        ctk.CTkLabel(
+            self,
+            text="💡 Since the app started (or the last reset). Long queue waits with "
+                 "short downloads mean more parallel jobs would help.",
+            font=ctk.CTkFont(size=11),
+            text_color="gray"
+        ).pack(anchor="w", padx=20)
+
+        results_frame = ctk.CTkFrame(self, corner_radius=15)
+        results_frame.pack(fill="both", expand=True, padx=20, pady=10)
+
+        self.stats_text = tk.Text(
+            results_frame,
+            wrap="none",
+            font=("SF Mono", 11),
+            bg="#1E1E1E" if ctk.get_appearance_mode() == "Dark" else "#F5F5F5",
+            fg="#A8FF60" if ctk.get_appearance_mode() == "Dark" else "#2E7D32",
+            relief="flat",
+            borderwidth=0,
+            padx=15,
+            pady=15
+        )
+        self.stats_text.pack(fill="both", expand=True, padx=2, pady=2)
+
+        button_frame = ctk.CTkFrame(self, fg_color="transparent")
+        button_frame.pack(fill="x", padx=20, pady=(0, 20))
+
+        ctk.CTkButton(
+            button_frame,
+            text="🔄 Reset",
+            height=36,
+            corner_radius=10,
+            fg_color="gray",
+            hover_color="#666666",
+            command=self._reset
+        ).pack(side="left")
+
+        ctk.CTkButton(
+            button_frame,
+            text="💾 Export...",
+            height=36,
+            corner_radius=10,
+            command=self._export
+        ).pack(side="right")
+
+        self._refresh()
+
+    # ------------------------------------------------------------------
+    def _refresh(self):
+        """Redraw the table, then again in STATS_REFRESH_MS while open."""
+        if not self.winfo_exists():
+            return
+        self.stats_text.delete("1.0", "end")
+        self.stats_text.insert("1.0", self._render(TELEMETRY.snapshot()))
+        self.after(STATS_REFRESH_MS, self._refresh)
+
+    # ------------------------------------------------------------------
+    def _render(self, snap: Dict[str, Any]) -> str:
+        """Phase table plus counter and gauge summary lines."""
+        lines = [f"{'PHASE':<16}{'ENGINE':<12}{'COUNT':>7}{'MEAN':>11}{'MAX':>11}{'TOTAL':>12}"]
+        for p in snap["phases"]:
+            lines.append(
+                f"{p['phase']:<16}{p['engine'] or '-':<12}{p['count']:>7}"
+                f"{_fmt_seconds(p['mean_s']):>11}{_fmt_seconds(p['max_s']):>11}"
+                f"{_fmt_seconds(p['total_s']):>12}"
+            )
+        if not snap["phases"]:
+            lines.append("Nothing recorded yet: start a download.")
+        lines.append("")
+
+        counters: Dict[str, Dict[str, float]] = {}
+        for c in snap["counters"]:
+            counters.setdefault(c["name"], {})[c["label"]] = c["value"]
+        download_s = {p["engine"]: p["total_s"] for p in snap["phases"] if p["phase"] == "download"}
+        for engine, received in counters.get("bytes_downloaded", {}).items():
+            line = f"⬇ Downloaded ({engine}): {format_bytes(received)}"
+            if download_s.get(engine):
+                line += f"  ·  {format_bytes(received / download_s[engine])}/s per download"
+            lines.append(line)
+        if counters.get("jobs"):
+            lines.append("📋 Jobs: " + ", ".join(f"{int(n)} {state}" for state, n in counters["jobs"].items()))
+        if counters.get("retries"):
+            lines.append("🔁 Retries: " + ", ".join(f"{int(n)} {kind}" for kind, n in counters["retries"].items()))
+        for g in snap["gauges"]:
+            if g["name"] == "log_queue_depth":
+                lines.append(f"📨 Log queue: {int(g['value'])} waiting, {int(g['max'])} at most")
+        return "\n".join(lines)
+
+    # ------------------------------------------------------------------
+    def _reset(self):
+        TELEMETRY.reset()
+        self.stats_text.delete("1.0", "end")
+        self.stats_text.insert("1.0", self._render(TELEMETRY.snapshot()))
+
+    # ------------------------------------------------------------------
+    def _export(self):
+        """Save the statistics as JSON, CSV or Prometheus text."""
+        path = filedialog.asksaveasfilename(
+            parent=self,
+            title="Export Statistics",
+            defaultextension=".json",
+            initialfile=f"kexis-stats-{time.strftime('%Y%m%d-%H%M%S')}.json",
+            filetypes=[("JSON", "*.json"), ("CSV", "*.csv"), ("Prometheus text", "*.prom")],
+        )
+        if not path:
+            return
+        try:
+            TELEMETRY.export(Path(path))
+        except (OSError, ValueError) as exc:
+            messagebox.showerror("Export failed", str(exc), parent=self)
+
+
 # ----------------------------------------------------------------------
 # Preferences Window
 # ----------------------------------------------------------------------
@@ -1250,8 +1443,8 @@ class PreferencesWindow(ctk.CTkToplevel):
         super().__init__(parent)
 
         self.title("⚙️ Preferences")
-        self.geometry("600x400")
-        self.minsize(500, 300)
+        self.geometry("620x930")
+        self.minsize(520, 680)
 
         # Title
         ctk.CTkLabel(
@@ -1260,8 +1453,8 @@ class PreferencesWindow(ctk.CTkToplevel):
             font=ctk.CTkFont(size=24, weight="bold")
         ).pack(pady=20)
 
-        # Settings frame
-        settings_frame = ctk.CTkFrame(self, corner_radius=15)
+        # Settings frame (scrolls once the sections outgrow the window)
+        settings_frame = ctk.CTkScrollableFrame(self, corner_radius=15)
         settings_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
 
         ctk.CTkLabel(
@@ -1288,6 +1481,280 @@ class PreferencesWindow(ctk.CTkToplevel):
         )
         theme_menu.pack(anchor="w", padx=20, pady=(0, 20))
 
+        # Performance
+        ctk.CTkLabel(
+            settings_frame,
+            text="⚡ Performance",
+            font=ctk.CTkFont(size=16, weight="bold")
+        ).pack(anchor="w", padx=20, pady=(10, 10))
+
+        limit_frame = ctk.CTkFrame(settings_frame, fg_color="transparent")
+        limit_frame.pack(fill="x", padx=20, pady=(0, 10))
+
+        choices = [str(n) for n in range(1, 17)]
+        rows = [
+            ("Parallel downloads (all tabs):", str(SETTINGS["max_concurrent_jobs"]), self._set_global_limit),
+            ("Parallel video downloads:", str(tab_concurrency("VIDEO")), lambda v: self._set_tab_limit("VIDEO", v)),
+            ("Parallel audio downloads:", str(tab_concurrency("AUDIO")), lambda v: self._set_tab_limit("AUDIO", v)),
+            ("Connections per file:", str(SETTINGS["download_connections"]),
+             lambda v: self._set_setting("download_connections", int(v))),
+        ]
+        for row, (label, current, command) in enumerate(rows):
+            ctk.CTkLabel(
+                limit_frame,
+                text=label,
+                font=ctk.CTkFont(size=13)
+            ).grid(row=row, column=0, sticky="w", pady=4)
+            ctk.CTkOptionMenu(
+                limit_frame,
+                variable=ctk.StringVar(value=current),
+                values=choices,
+                command=command,
+                width=90,
+                height=30,
+                corner_radius=8
+            ).grid(row=row, column=1, sticky="w", padx=(10, 0), pady=4)
+
+        ctk.CTkLabel(
+            limit_frame,
+            text="Download engine:",
+            font=ctk.CTkFont(size=13)
+        ).grid(row=len(rows), column=0, sticky="w", pady=4)
+        engine_labels = {v: k for k, v in ENGINES.items()}
+        ctk.CTkOptionMenu(
+            limit_frame,
+            variable=ctk.StringVar(value=ENGINES[SETTINGS["engine"]]),
+            values=list(ENGINES.values()),
+            command=lambda label: self._set_setting("engine", engine_labels[label]),
+            width=260,
+            height=30,
+            corner_radius=8
+        ).grid(row=len(rows), column=1, sticky="w", padx=(10, 0), pady=4)
+        ctk.CTkLabel(
+            limit_frame,
+            text="Splitting single-file formats across connections needs the in-process engine.",
+            font=ctk.CTkFont(size=11),
+            text_color="gray"
+        ).grid(row=len(rows) + 1, column=0, columnspan=2, sticky="w", pady=(0, 4))
+
+        # Bandwidth: applies to running in-process downloads immediately
+        for row, (label, key) in enumerate(
+            (("Speed limit (all downloads):", "bandwidth_limit"),
+             ("Speed limit per download:", "job_bandwidth_limit")),
+            start=len(rows) + 2,
+        ):
+            labels = {format_rate(r): r for r in sorted({*RATE_CHOICES, int(SETTINGS[key])})}
+            ctk.CTkLabel(
+                limit_frame,
+                text=label,
+                font=ctk.CTkFont(size=13)
+            ).grid(row=row, column=0, sticky="w", pady=4)
+            ctk.CTkOptionMenu(
+                limit_frame,
+                variable=ctk.StringVar(value=format_rate(int(SETTINGS[key]))),
+                values=list(labels),
+                command=lambda v, k=key, labels=labels: self._set_bandwidth(k, labels[v]),
+                width=140,
+                height=30,
+                corner_radius=8
+            ).grid(row=row, column=1, sticky="w", padx=(10, 0), pady=4)
+
+        schedule_frame = ctk.CTkFrame(limit_frame, fg_color="transparent")
+        schedule_frame.grid(row=len(rows) + 4, column=0, columnspan=2, sticky="w", pady=4)
+        schedule_switch = ctk.CTkSwitch(
+            schedule_frame,
+            text="Full speed from",
+            command=lambda: self._set_bandwidth("bandwidth_schedule", not SETTINGS["bandwidth_schedule"]),
+            font=ctk.CTkFont(size=13)
+        )
+        schedule_switch.pack(side="left")
+        if SETTINGS["bandwidth_schedule"]:
+            schedule_switch.select()
+        hours = [f"{h:02d}:00" for h in range(24)]
+        for key, text in (("full_speed_from", "until"), ("full_speed_until", "")):
+            ctk.CTkOptionMenu(
+                schedule_frame,
+                variable=ctk.StringVar(value=hours[int(SETTINGS[key])]),
+                values=hours,
+                command=lambda v, k=key: self._set_bandwidth(k, int(v[:2])),
+                width=80,
+                height=30,
+                corner_radius=8
+            ).pack(side="left", padx=(8, 0))
+            if text:
+                ctk.CTkLabel(schedule_frame, text=text, font=ctk.CTkFont(size=13)).pack(side="left", padx=(8, 0))
+        ctk.CTkLabel(
+            limit_frame,
+            text="The in-process engine holds the total exactly and follows changes at once.\n"
+                 "The yt-dlp program gets a fixed share when each download starts, so\n"
+                 "the total is approximate and changes only reach later downloads.",
+            font=ctk.CTkFont(size=11),
+            text_color="gray"
+        ).grid(row=len(rows) + 5, column=0, columnspan=2, sticky="w", pady=(0, 4))
+
+        for key, label in (
+            ("expand_playlists", "Split playlists and channels into separate downloads"),
+            ("parallel_streams", "Download video and audio streams at the same time (in-process engine)"),
+            ("pipeline_postprocess", "Convert audio on all CPU cores while the next track downloads"),
+            ("archive_enabled", "Skip items already in the download archive"),
+            ("archive_scan_on_startup", "Scan output folders into the archive at startup"),
+            ("resume_jobs_on_startup", "Offer to resume unfinished downloads at startup"),
+        ):
+            switch = ctk.CTkSwitch(
+                settings_frame,
+                text=label,
+                command=lambda k=key: self._set_setting(k, not SETTINGS[k]),
+                font=ctk.CTkFont(size=13)
+            )
+            switch.pack(anchor="w", padx=20, pady=4)
+            if SETTINGS[key]:
+                switch.select()
+
+        retry_frame = ctk.CTkFrame(settings_frame, fg_color="transparent")
+        retry_frame.pack(fill="x", padx=20, pady=(6, 0))
+        ctk.CTkLabel(
+            retry_frame,
+            text="Retry failed downloads:",
+            font=ctk.CTkFont(size=13)
+        ).pack(side="left")
+        ctk.CTkOptionMenu(
+            retry_frame,
+            variable=ctk.StringVar(value=str(SETTINGS["retry_attempts"] or "Off")),
+            values=["Off", "1", "2", "3", "5", "10"],
+            command=lambda v: self._set_setting("retry_attempts", 0 if v == "Off" else int(v)),
+            width=90,
+            height=30,
+            corner_radius=8
+        ).pack(side="left", padx=(10, 0))
+        ctk.CTkLabel(
+            retry_frame,
+            text="times (private or removed videos are never retried)",
+            font=ctk.CTkFont(size=11),
+            text_color="gray"
+        ).pack(side="left", padx=(8, 0))
+
+        # Format choice
+        ctk.CTkLabel(
+            settings_frame,
+            text="🎞️ Format Choice",
+            font=ctk.CTkFont(size=16, weight="bold")
+        ).pack(anchor="w", padx=20, pady=(20, 10))
+
+        auto_switch = ctk.CTkSwitch(
+            settings_frame,
+            text="Pick exact formats from each video's format list",
+            command=lambda: self._set_setting("auto_formats", not SETTINGS["auto_formats"]),
+            font=ctk.CTkFont(size=13)
+        )
+        auto_switch.pack(anchor="w", padx=20, pady=4)
+        if SETTINGS["auto_formats"]:
+            auto_switch.select()
+
+        format_frame = ctk.CTkFrame(settings_frame, fg_color="transparent")
+        format_frame.pack(fill="x", padx=20, pady=(0, 10))
+        format_rows = [
+            ("Highest resolution:", "format_max_height",
+             {"Any": 0, "8K": 4320, "4K": 2160, "1440p": 1440, "1080p": 1080, "720p": 720, "480p": 480}),
+            ("Video codecs:", "format_codecs",
+             {"AV1 › VP9 › H.264": ["av1", "vp9", "avc1"], "VP9 › AV1 › H.264": ["vp9", "av1", "avc1"],
+              "VP9 › H.264": ["vp9", "avc1"], "H.264 only": ["avc1"], "Any": []}),
+            ("Container:", "format_container", {"Either": "", "MP4": "mp4", "WebM": "webm"}),
+            ("Minimum audio bitrate:", "format_min_audio_kbps",
+             {"Any": 0, "96 kbps": 96, "128 kbps": 128, "160 kbps": 160}),
+        ]
+        for row, (label, key, options) in enumerate(format_rows):
+            current = next((name for name, value in options.items() if value == SETTINGS[key]), None)
+            ctk.CTkLabel(
+                format_frame,
+                text=label,
+                font=ctk.CTkFont(size=13)
+            ).grid(row=row, column=0, sticky="w", pady=4)
+            ctk.CTkOptionMenu(
+                format_frame,
+                variable=ctk.StringVar(value=current or "Custom"),
+                values=list(options),
+                command=lambda v, k=key, o=options: self._set_setting(k, o[v]),
+                width=180,
+                height=30,
+                corner_radius=8
+            ).grid(row=row, column=1, sticky="w", padx=(10, 0), pady=4)
+
+        log_frame = ctk.CTkFrame(settings_frame, fg_color="transparent")
+        log_frame.pack(fill="x", padx=20, pady=(6, 4))
+        ctk.CTkLabel(
+            log_frame,
+            text="Log lines kept on screen:",
+            font=ctk.CTkFont(size=13)
+        ).pack(side="left")
+        ctk.CTkOptionMenu(
+            log_frame,
+            variable=ctk.StringVar(value=str(SETTINGS["log_max_lines"] or "Unlimited")),
+            values=["1000", "5000", "20000", "100000", "Unlimited"],
+            command=lambda v: self._set_setting("log_max_lines", 0 if v == "Unlimited" else int(v)),
+            width=120,
+            height=30,
+            corner_radius=8
+        ).pack(side="left", padx=(10, 0))
+
+        spill_switch = ctk.CTkSwitch(
+            settings_frame,
+            text="Keep the full log history on disk (File → Open Logs Folder)",
+            command=lambda: self._set_setting("log_spill_to_file", not SETTINGS["log_spill_to_file"]),
+            font=ctk.CTkFont(size=13)
+        )
+        spill_switch.pack(anchor="w", padx=20, pady=4)
+        if SETTINGS["log_spill_to_file"]:
+            spill_switch.select()
+
+        ctk.CTkButton(
+            settings_frame,
+            text="🗑 Clear Metadata Cache",
+            width=200,
+            height=32,
+            corner_radius=8,
+            command=self._clear_cache
+        ).pack(anchor="w", padx=20, pady=(5, 0))
+
+        # Control API
+        ctk.CTkLabel(
+            settings_frame,
+            text="🌐 Control API",
+            font=ctk.CTkFont(size=16, weight="bold")
+        ).pack(anchor="w", padx=20, pady=(20, 10))
+
+        api_frame = ctk.CTkFrame(settings_frame, fg_color="transparent")
+        api_frame.pack(fill="x", padx=20, pady=(0, 4))
+        self.api_port_entry = ctk.CTkEntry(api_frame, width=90, height=30)
+        self.api_port_entry.insert(0, str(SETTINGS["api_port"]))
+        self.api_token_entry = ctk.CTkEntry(api_frame, width=180, height=30, show="•",
+                                            placeholder_text="none")
+        self.api_token_entry.insert(0, SETTINGS["api_token"])
+        for row, (label, entry) in enumerate(
+            ((f"Port (on {SETTINGS['api_host']}):", self.api_port_entry), ("Access token:", self.api_token_entry))
+        ):
+            ctk.CTkLabel(
+                api_frame,
+                text=label,
+                font=ctk.CTkFont(size=13)
+            ).grid(row=row, column=0, sticky="w", pady=4)
+            entry.grid(row=row, column=1, sticky="w", padx=(10, 0), pady=4)
+
+        self.api_switch = ctk.CTkSwitch(
+            settings_frame,
+            text="Let other programs queue and watch downloads",
+            command=self._toggle_api,
+            font=ctk.CTkFont(size=13)
+        )
+        self.api_switch.pack(anchor="w", padx=20, pady=4)
+        if SETTINGS["api_enabled"]:
+            self.api_switch.select()
+        ctk.CTkLabel(
+            settings_frame,
+            text="Port and token changes apply when the API is switched on.",
+            font=ctk.CTkFont(size=11),
+            text_color="gray"
+        ).pack(anchor="w", padx=20, pady=(0, 4))
+
         # Info
         ctk.CTkLabel(
             settings_frame,
@@ -1296,6 +1763,65 @@ class PreferencesWindow(ctk.CTkToplevel):
             text_color="gray"
         ).pack(pady=20)
 
+    # ------------------------------------------------------------------
+    def _set_setting(self, key: str, value: Any):
+        """Store a simple setting and persist it."""
+        SETTINGS[key] = value
+        save_settings()
+
+    # ------------------------------------------------------------------
+    def _toggle_api(self):
+        """Switch the control API on or off, with the port and token entered."""
+        app = self.master
+        if not self.api_switch.get():
+            app._stop_api()
+            self._set_setting("api_enabled", False)
+            return
+        try:
+            port = int(self.api_port_entry.get())
+            if not 1 <= port <= 65535:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid Port", "Enter a port between 1 and 65535.", parent=self)
+            self.api_switch.deselect()
+            return
+        SETTINGS["api_port"] = port
+        SETTINGS["api_token"] = self.api_token_entry.get().strip()
+        error = app._start_api()
+        if error:
+            messagebox.showerror(
+                "Control API", f"Could not listen on {SETTINGS['api_host']}:{port}:\n{error}", parent=self
+            )
+            self.api_switch.deselect()
+            return
+        self._set_setting("api_enabled", True)
+
+    # ------------------------------------------------------------------
+    def _clear_cache(self):
+        """Drop every cached metadata entry."""
+        METADATA_CACHE.clear()
+        messagebox.showinfo("Cache Cleared", "Cached video metadata was removed.", parent=self)
+
+    # ------------------------------------------------------------------
+    def _set_global_limit(self, value: str):
+        """Apply a new global parallel-download limit."""
+        SETTINGS["max_concurrent_jobs"] = int(value)
+        GLOBAL_LIMITER.set_limit(int(value))
+        save_settings()
+
+    # ------------------------------------------------------------------
+    def _set_bandwidth(self, key: str, value: Any):
+        """Change a bandwidth setting; running downloads follow at once."""
+        SETTINGS[key] = value
+        BANDWIDTH.refresh()
+        save_settings()
+
+    # ------------------------------------------------------------------
+    def _set_tab_limit(self, tag: str, value: str):
+        """Apply a new per-tab limit (used by the next batch)."""
+        SETTINGS["tab_concurrency"][tag] = int(value)
+        save_settings()
+
 
 # ----------------------------------------------------------------------
 # Run the app
@@ -0,0 +1,191 @@
+"""choose_formats and the format ranking, against recorded metadata.
+
+bench/fixtures/video.json is a YouTube-shaped format list: AV1, VP9 and
+AVC1 video from 144p to 2160p (some at 60 fps), AAC and Opus audio with
+"-drc" variants, and combined HLS formats.
+"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from kexis_core import (  # noqa: E402
+    DEFAULT_SETTINGS,
+    FormatConstraints,
+    choose_formats,
+    codec_family,
+    rank_audio_formats,
+    rank_video_formats,
+)
+
+# What a fresh install uses
+DEFAULTS = FormatConstraints(
+    max_height=DEFAULT_SETTINGS["format_max_height"],
+    codecs=tuple(DEFAULT_SETTINGS["format_codecs"]),
+    container=DEFAULT_SETTINGS["format_container"],
+    min_audio_kbps=DEFAULT_SETTINGS["format_min_audio_kbps"],
+)
+ANY = FormatConstraints(codecs=("av1", "vp9", "avc1"))
+
+
+@pytest.fixture
+def info():
+    return json.loads((ROOT / "bench" / "fixtures" / "video.json").read_text(encoding="utf-8"))
+
+
+def pick(info, constraints, video_id=None, audio_id=None):
+    choice = choose_formats(info, constraints, video_id, audio_id)
+    return choice.video_id, choice.audio_id
+
+
+def without(info, *format_ids):
+    return {**info, "formats": [f for f in info["formats"] if f["format_id"] not in format_ids]}
+
+
+# Defaults ---------------------------------------------------------------
+def test_defaults_match_old_mp4_first_selector(info):
+    # bestvideo[ext=mp4]+bestaudio[ext=m4a] picked the same pair
+    assert pick(info, DEFAULTS) == ("401", "140")
+    assert pick(info, DEFAULTS, "best", "251") == ("401", "251")
+
+
+def test_no_video_formats_leaves_choice_to_ytdlp(info):
+    audio_only = {**info, "formats": [f for f in info["formats"] if f.get("vcodec") == "none"]}
+    assert choose_formats(audio_only, DEFAULTS) is None
+    assert choose_formats({}, DEFAULTS) is None
+
+
+# Height cap -------------------------------------------------------------
+@pytest.mark.parametrize("cap, expected", [
+    (0, "401"), (2160, "401"), (1440, "400"), (1080, "399"), (1000, "398"), (720, "398"),
+])
+def test_height_cap(info, cap, expected):
+    assert pick(info, ANY._replace(max_height=cap))[0] == expected
+
+
+def test_height_cap_below_everything_takes_smallest(info):
+    video = rank_video_formats(info["formats"], ANY._replace(max_height=100))
+    assert {f["height"] for f in video} == {144}
+    assert video[0]["format_id"] == "394"
+
+
+# Codec preference -------------------------------------------------------
+@pytest.mark.parametrize("codecs, expected", [
+    (("av1", "vp9", "avc1"), "399"),
+    (("vp9", "av1", "avc1"), "303"),
+    (("avc1", "vp9", "av1"), "299"),
+    (("avc1",), "299"),
+])
+def test_codec_order(info, codecs, expected):
+    assert pick(info, ANY._replace(codecs=codecs, max_height=1080))[0] == expected
+
+
+def test_codec_only_restricts_when_something_is_left(info):
+    video = rank_video_formats(info["formats"], ANY._replace(codecs=("hevc",)))
+    # No HEVC here: every codec is allowed, and bitrate decides at 2160p60
+    assert video[0]["format_id"] == "315"
+
+
+def test_resolution_outranks_codec_preference(info):
+    # AVC1 is preferred, but VP9 at 2160p beats it at 1080p
+    assert pick(info, ANY._replace(codecs=("avc1", "vp9")))[0] == "315"
+
+
+def test_codec_family():
+    assert codec_family("av01.0.12M.08") == "av1"
+    assert codec_family("avc1.64002a") == "avc1"
+    assert codec_family("mp4a.40.2") == "aac"
+    assert codec_family(None) == "none"
+    assert codec_family("flac") == "flac"
+
+
+# Container --------------------------------------------------------------
+def test_container_mp4(info):
+    assert pick(info, ANY._replace(container="mp4", codecs=("vp9", "avc1"))) == ("299", "140")
+
+
+def test_container_webm(info):
+    assert pick(info, ANY._replace(container="webm")) == ("315", "251")
+
+
+def test_container_either_prefers_opus_by_bitrate(info):
+    assert pick(info, ANY) == ("401", "251")
+
+
+# Minimum audio bitrate --------------------------------------------------
+def test_min_audio_kbps(info):
+    mp4 = ANY._replace(container="mp4")
+    assert pick(info, mp4)[1] == "140"
+    # 140 (129.5k) and 140-drc (129.6k) fall below the minimum
+    assert pick(info, mp4._replace(min_audio_kbps=130))[1] == "251"
+    assert {f["format_id"] for f in rank_audio_formats(info["formats"], mp4._replace(min_audio_kbps=130))} \
+        == {"251", "251-drc"}
+
+
+def test_min_audio_kbps_nothing_left_is_dropped(info):
+    assert pick(info, ANY._replace(container="mp4", min_audio_kbps=500))[1] == "140"
+
+
+def test_drc_ranks_below_normal(info):
+    ranked = [f["format_id"] for f in rank_audio_formats(info["formats"], ANY)]
+    assert ranked.index("251") < ranked.index("251-drc")
+    assert ranked.index("140") < ranked.index("140-drc")
+
+
+# Requested format IDs ---------------------------------------------------
+def test_offered_ids_are_kept(info):
+    assert pick(info, DEFAULTS, "248", "249") == ("248", "249")
+
+
+def test_combined_format_needs_no_audio(info):
+    assert pick(info, DEFAULTS, "18", "251") == ("18", None)
+
+
+def test_missing_video_id_is_capped_at_its_resolution(info):
+    # 137 is a 1080p row; 1080p AV1 in mp4 replaces it
+    assert pick(without(info, "137"), DEFAULTS, "137") == ("399", "140")
+    # 308 is a 1440p row
+    assert pick(without(info, "308"), ANY._replace(codecs=("vp9",)), "308")[0] == "303"
+
+
+def test_missing_video_id_keeps_lower_height_cap(info):
+    assert pick(without(info, "401"), DEFAULTS._replace(max_height=720), "401")[0] == "398"
+
+
+def test_unknown_ids_fall_back_to_top_ranked(info):
+    assert pick(info, DEFAULTS, "9999", "9998") == ("401", "140")
+    # An audio ID isn't a video format
+    assert pick(info, DEFAULTS, "251")[0] == "401"
+
+
+# Tie-breaking -----------------------------------------------------------
+def test_order_of_formats_does_not_matter(info):
+    expected = {
+        c: (pick(info, c), [f["format_id"] for f in rank_video_formats(info["formats"], c)])
+        for c in (DEFAULTS, ANY, ANY._replace(max_height=720, container="webm"))
+    }
+    rng = random.Random(19)
+    for _ in range(10):
+        shuffled = {**info, "formats": rng.sample(info["formats"], len(info["formats"]))}
+        for c, (choice, ranking) in expected.items():
+            assert pick(shuffled, c) == choice
+            assert [f["format_id"] for f in rank_video_formats(shuffled["formats"], c)] == ranking
+
+
+def test_frame_rate_then_protocol_then_bitrate(info):
+    ranked = [f["format_id"] for f in rank_video_formats(info["formats"], ANY._replace(codecs=("avc1",), max_height=1080))]
+    # 60 fps first; the direct 30 fps file beats the HLS one despite its lower bitrate
+    assert ranked[:3] == ["299", "137", "96"]
+
+
+def test_identical_formats_tie_break_on_format_id(info):
+    twin = dict(next(f for f in info["formats"] if f["format_id"] == "401"), format_id="401a")
+    formats = info["formats"] + [twin]
+    for order in (formats, formats[::-1]):
+        assert rank_video_formats(order, DEFAULTS)[0]["format_id"] == "401a"
@@ -0,0 +1,275 @@
+"""plan_segments and SegmentedFile, against an in-memory fake server.
+
+The fake opener answers range requests from a byte string, records every
+range it was asked for, and can misbehave on purpose: drop a connection
+part-way, or ignore the Range header. One test also runs the yt-dlp
+downloader against bench/range_server.py.
+"""
+
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+pytest.importorskip("yt_dlp")
+
+import kexis_segmented  # noqa: E402
+from kexis_segmented import (  # noqa: E402
+    MIN_SEGMENT_BYTES,
+    STATE_SUFFIX,
+    SegmentedFile,
+    plan_segments,
+    probe_size,
+)
+
+MiB = 1024 * 1024
+
+
+class FakeResponse:
+    def __init__(self, status, headers, body, cut_after=None):
+        self.status = status
+        self.headers = headers
+        self._body = body if cut_after is None else body[:cut_after]
+        self._pos = 0
+
+    def read(self, n):
+        block = self._body[self._pos:self._pos + n]
+        self._pos += len(block)
+        return block
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    """Opener over ``data``; ``cut`` makes the next N responses stop early."""
+
+    def __init__(self, data, honour_range=True):
+        self.data = data
+        self.honour_range = honour_range
+        self.ranges = []
+        self.cut = 0
+
+    def __call__(self, url, headers):
+        m = re.fullmatch(r"bytes=(\d+)-(\d+)", headers.get("Range", ""))
+        if not self.honour_range or not m:
+            return FakeResponse(200, {}, self.data)
+        start, end = int(m.group(1)), min(int(m.group(2)), len(self.data) - 1)
+        self.ranges.append((start, end))
+        cut_after = None
+        if self.cut and end > start:
+            self.cut -= 1
+            cut_after = (end - start + 1) // 2
+        return FakeResponse(
+            206, {"Content-Range": f"bytes {start}-{end}/{len(self.data)}"},
+            self.data[start:end + 1], cut_after,
+        )
+
+
+@pytest.fixture
+def data():
+    return os.urandom(10 * MiB + 12345)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(kexis_segmented, "PROGRESS_INTERVAL_S", 0.01)
+
+
+def segmented(server, path, **kwargs):
+    kwargs.setdefault("connections", 4)
+    return SegmentedFile("http://fake/video.mp4", str(path), len(server.data), opener=server, **kwargs)
+
+
+# plan_segments ----------------------------------------------------------
+@pytest.mark.parametrize("size, connections", [
+    (1, 4), (MIN_SEGMENT_BYTES, 4), (2 * MIN_SEGMENT_BYTES - 1, 8),
+    (2 * MIN_SEGMENT_BYTES, 8), (10 * MIN_SEGMENT_BYTES + 7, 4), (10 * MIN_SEGMENT_BYTES + 7, 1),
+])
+def test_segments_cover_the_file_without_gaps(size, connections):
+    segments = plan_segments(size, connections)
+    assert segments[0][0] == 0 and segments[-1][1] == size - 1
+    for (_, end, _), (start, _, _) in zip(segments, segments[1:]):
+        assert start == end + 1
+    # Nothing is downloaded yet
+    assert all(pos == start for start, _, pos in segments)
+
+
+def test_segment_count():
+    assert len(plan_segments(MIN_SEGMENT_BYTES, 8)) == 1
+    assert len(plan_segments(2 * MIN_SEGMENT_BYTES - 1, 8)) == 1
+    assert len(plan_segments(2 * MIN_SEGMENT_BYTES, 8)) == 2
+    assert len(plan_segments(100 * MIN_SEGMENT_BYTES, 8)) == 8
+    assert len(plan_segments(100 * MIN_SEGMENT_BYTES, 0)) == 1
+
+
+def test_segments_are_even():
+    sizes = {end - start + 1 for start, end, _ in plan_segments(40 * MiB + 3, 4)}
+    assert max(sizes) - min(sizes) <= 3
+
+
+# probe_size -------------------------------------------------------------
+def test_probe_size(data):
+    assert probe_size("http://fake/", {}, FakeServer(data)) == len(data)
+    assert probe_size("http://fake/", {}, FakeServer(data, honour_range=False)) is None
+
+
+# SegmentedFile ----------------------------------------------------------
+def test_download_matches_source(tmp_path, data):
+    server = FakeServer(data)
+    target = tmp_path / "video.mp4.part"
+    progress = []
+    download = segmented(server, target, request_bytes=MiB)
+    download.run(progress.append)
+
+    assert target.read_bytes() == data
+    assert len(download.segments) == 2
+    assert not Path(str(target) + STATE_SUFFIX).exists()
+    assert download.resumed_bytes == 0
+    # No range is longer than request_bytes, and none is fetched twice
+    assert all(end - start + 1 <= MiB for start, end in server.ranges)
+    assert sum(end - start + 1 for start, end in server.ranges) == len(data)
+    assert progress == sorted(progress)
+
+
+def test_resume_from_state_file(tmp_path, data):
+    target = tmp_path / "video.mp4.part"
+    segments = plan_segments(len(data), 4)
+    # The first connection got 1 MiB in, the second finished
+    segments[0][2] = MiB
+    segments[1][2] = segments[1][1] + 1
+    partial = bytearray(len(data))
+    partial[:MiB] = data[:MiB]
+    partial[segments[1][0]:] = data[segments[1][0]:]
+    target.write_bytes(bytes(partial))
+    Path(str(target) + STATE_SUFFIX).write_text(json.dumps({"size": len(data), "segments": segments}))
+
+    server = FakeServer(data)
+    download = segmented(server, target)
+    download.run()
+
+    assert target.read_bytes() == data
+    assert download.resumed_bytes == MiB + segments[1][1] - segments[1][0] + 1
+    assert server.ranges == [(MiB, segments[0][1])]
+    assert not Path(str(target) + STATE_SUFFIX).exists()
+
+
+def test_state_for_another_size_starts_over(tmp_path, data):
+    target = tmp_path / "video.mp4.part"
+    target.write_bytes(b"\0" * len(data))
+    Path(str(target) + STATE_SUFFIX).write_text(json.dumps({
+        "size": len(data) + 1, "segments": [[0, len(data), len(data) + 1]],
+    }))
+    download = segmented(FakeServer(data), target)
+    download.run()
+    assert download.resumed_bytes == 0
+    assert target.read_bytes() == data
+
+
+def test_no_resume_ignores_state(tmp_path, data):
+    target = tmp_path / "video.mp4.part"
+    segments = plan_segments(len(data), 4)
+    segments[0][2] = segments[0][1] + 1
+    target.write_bytes(b"\0" * len(data))
+    Path(str(target) + STATE_SUFFIX).write_text(json.dumps({"size": len(data), "segments": segments}))
+    download = segmented(FakeServer(data), target, resume=False)
+    download.run()
+    assert download.resumed_bytes == 0
+    assert target.read_bytes() == data
+
+
+def test_short_read_is_retried_from_where_it_stopped(tmp_path, data):
+    server = FakeServer(data)
+    server.cut = 1
+    target = tmp_path / "video.mp4.part"
+    segmented(server, target, connections=1, request_bytes=len(data), retries=1).run()
+
+    assert target.read_bytes() == data
+    (start, end), (retry_start, retry_end) = server.ranges
+    assert (start, end) == (0, len(data) - 1)
+    assert (retry_start, retry_end) == ((end + 1) // 2, end)
+
+
+def test_dead_connection_fails_after_retries_and_keeps_state(tmp_path, data):
+    server = FakeServer(data)
+    server.cut = 1
+
+    def opener(url, headers):
+        # After the first, cut-short response the server sends nothing at all
+        resp = server(url, headers)
+        if len(server.ranges) > 1:
+            resp._body = b""
+        return resp
+
+    target = tmp_path / "video.mp4.part"
+    download = SegmentedFile(
+        "http://fake/", str(target), len(data), connections=1, opener=opener,
+        request_bytes=len(data), retries=1,
+    )
+    with pytest.raises(OSError, match="connection closed"):
+        download.run()
+    state = json.loads(Path(str(target) + STATE_SUFFIX).read_text())
+    assert state == {"size": len(data), "segments": [[0, len(data) - 1, len(data) // 2]]}
+    assert len(server.ranges) == 3
+
+
+def test_server_ignoring_range_fails(tmp_path, data):
+    target = tmp_path / "video.mp4.part"
+    download = segmented(FakeServer(data, honour_range=False), target, retries=0)
+    with pytest.raises(OSError, match=r"ignored the range request \(HTTP 200\)"):
+        download.run()
+
+
+def test_progress_callback_cancels(tmp_path, data):
+    class Cancelled(Exception):
+        pass
+
+    def on_progress(done):
+        raise Cancelled
+
+    target = tmp_path / "video.mp4.part"
+    with pytest.raises(Cancelled):
+        segmented(FakeServer(data), target, throttle=lambda n: time.sleep(0.001)).run(on_progress)
+    assert Path(str(target) + STATE_SUFFIX).exists()
+
+
+# yt-dlp integration -----------------------------------------------------
+def test_internals_present():
+    # A yt-dlp that drops one of these silently falls back to one connection
+    assert kexis_segmented.INTERNALS_SUPPORTED
+
+
+def test_ytdlp_downloads_from_range_server(tmp_path, monkeypatch):
+    sys.path.insert(0, str(ROOT / "bench"))
+    from range_server import serve, write_random
+
+    runs = []
+    run = SegmentedFile.run
+    monkeypatch.setattr(SegmentedFile, "run", lambda self, *a: runs.append(self) or run(self, *a))
+
+    served = tmp_path / "www"
+    served.mkdir()
+    write_random(served / "video.mp4", 3 * MIN_SEGMENT_BYTES + 5)
+    server = serve(served)
+    try:
+        out = tmp_path / "out.mp4"
+        ydl = kexis_segmented.SegmentedYoutubeDL({
+            "quiet": True, "segmented_connections": 3, "noprogress": True,
+        })
+        info = {
+            "id": "video", "ext": "mp4", "protocol": "http",
+            "url": f"http://127.0.0.1:{server.server_port}/video.mp4",
+        }
+        assert ydl.dl(str(out), info)
+    finally:
+        server.shutdown()
+    assert out.read_bytes() == (served / "video.mp4").read_bytes()
+    assert [len(r.segments) for r in runs] == [3]
+    assert not Path(str(out) + ".part" + STATE_SUFFIX).exists()
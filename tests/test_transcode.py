@@ -0,0 +1,96 @@
+"""transcode_audio's ffmpeg arguments and output names.
+
+The plan is built from yt-dlp's ACODECS table, so these tests also catch
+a yt-dlp update that changes it. The conversion itself runs when ffmpeg
+is on PATH.
+"""
+
+import re
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+pytest.importorskip("yt_dlp")
+
+from kexis_core import _transcode_plan, transcode_audio  # noqa: E402
+
+WEBM = Path("/music/Song.webm")
+M4A = Path("/music/Song.m4a")
+
+
+def test_encodes_each_target_from_one_source():
+    results, outputs = _transcode_plan(WEBM, "opus", ["mp3", "flac", "ogg"])
+    assert results == ["/music/Song.mp3", "/music/Song.flac", "/music/Song.ogg"]
+    assert outputs == [
+        ("/music/Song.mp3", ["-vn", "-acodec", "libmp3lame", "-q:a", "0"]),
+        ("/music/Song.flac", ["-vn", "-acodec", "flac"]),
+        ("/music/Song.ogg", ["-vn", "-acodec", "libvorbis", "-q:a", "10"]),
+    ]
+
+
+def test_alac_keeps_its_codec():
+    results, outputs = _transcode_plan(WEBM, "opus", ["alac"])
+    assert results == ["/music/Song.m4a"]
+    assert outputs == [("/music/Song.m4a", ["-vn", "-acodec", "alac"])]
+
+
+def test_alac_and_m4a_get_distinct_names():
+    # m4a is named after its extension, so it keeps the plain name
+    for codecs in (["alac", "m4a"], ["m4a", "alac"]):
+        results, outputs = _transcode_plan(WEBM, "opus", codecs)
+        names = dict(zip(codecs, results))
+        assert names == {"m4a": "/music/Song.m4a", "alac": "/music/Song.alac.m4a"}
+        assert dict(outputs) == {
+            "/music/Song.m4a": ["-vn", "-acodec", "aac", "-q:a", "4"],
+            "/music/Song.alac.m4a": ["-vn", "-acodec", "alac"],
+        }
+
+
+def test_same_codec_is_stream_copied():
+    assert _transcode_plan(WEBM, "opus", ["opus"]) == (
+        ["/music/Song.opus"], [("/music/Song.opus", ["-vn", "-acodec", "copy"])],
+    )
+    assert _transcode_plan(Path("/music/Song.mp4"), "aac", ["m4a"]) == (
+        ["/music/Song.m4a"],
+        [("/music/Song.m4a", ["-vn", "-acodec", "copy", "-bsf:a", "aac_adtstoasc"])],
+    )
+
+
+def test_source_already_in_target_needs_no_run():
+    assert _transcode_plan(M4A, "aac", ["m4a"]) == (["/music/Song.m4a"], [])
+    results, outputs = _transcode_plan(M4A, "aac", ["m4a", "alac", "mp3"])
+    assert results == ["/music/Song.m4a", "/music/Song.alac.m4a", "/music/Song.mp3"]
+    assert [out for out, _ in outputs] == ["/music/Song.alac.m4a", "/music/Song.mp3"]
+
+
+def test_encoding_over_the_source_name():
+    # ALAC from an AAC download lands on the download's own name;
+    # transcode_audio moves the source aside first
+    assert _transcode_plan(M4A, "aac", ["alac"]) == (
+        ["/music/Song.m4a"], [("/music/Song.m4a", ["-vn", "-acodec", "alac"])],
+    )
+
+
+@pytest.mark.skipif(not shutil.which("ffmpeg"), reason="needs ffmpeg")
+def test_transcode_audio_writes_every_target(tmp_path):
+    source = tmp_path / "Song.webm"
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=1",
+         "-c:a", "libopus", str(source)],
+        check=True,
+    )
+    results = transcode_audio(str(source), ["alac", "m4a", "opus"])
+    assert results == [str(tmp_path / n) for n in ("Song.alac.m4a", "Song.m4a", "Song.opus")]
+
+    def codec(path):
+        probe = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True)
+        return re.search(r"Audio: (\w+)", probe.stderr).group(1)
+
+    assert [codec(p) for p in results] == ["alac", "aac", "opus"]
+    assert not source.exists()